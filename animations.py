@@ -1,5 +1,8 @@
 import glob
 
+from frame_cache import FrameCache
+from sprite_atlas import find_atlas
+
 
 class Animation:
     """A class for Bonzi's animations."""
@@ -8,19 +11,37 @@ class Animation:
         self.bonzi = bonzi
         self.settings = bonzi.settings
 
-        # Dictionary of lists, each one contains frames for each of Bonzi's animations
-        # glob returns a list of all .bmp files in the specified directory, sorted puts them in numeric order
-        self.animations = {
-            "idle": sorted(glob.glob("idle/*.bmp")),
-            "arrive": sorted(glob.glob("arrive/*.bmp")),
-            "goodbye": sorted(glob.glob("goodbye/*.bmp")),
-            "backflip": sorted(glob.glob("backflip/*.bmp")),
-            "glasses": sorted(glob.glob("glasses/*.bmp")),
-            "wave": sorted(glob.glob("wave/*.bmp")),
-            "nothing": ["idle/0999.bmp"],
-            "talking": sorted(glob.glob("talking/*"))
-        }
+        # Use the packed sprite atlas if it has been built (python sprite_atlas.py)
+        self.atlas = find_atlas(self.settings)
+
+        if self.atlas is not None:
+            # The atlas index already holds the frame order for every animation
+            self.animations = self.atlas.animations
+        else:
+            # Dictionary of lists, each one contains frames for each of Bonzi's animations
+            # glob returns a list of all .bmp files in the specified directory, sorted puts them in numeric order
+            self.animations = {
+                "idle": sorted(glob.glob("idle/*.bmp")),
+                "arrive": sorted(glob.glob("arrive/*.bmp")),
+                "goodbye": sorted(glob.glob("goodbye/*.bmp")),
+                "backflip": sorted(glob.glob("backflip/*.bmp")),
+                "glasses": sorted(glob.glob("glasses/*.bmp")),
+                "wave": sorted(glob.glob("wave/*.bmp")),
+                "nothing": ["idle/0999.bmp"],
+                "talking": sorted(glob.glob("talking/*"))
+            }
+
+        # Decoded frames are kept here so the main loop only has to blit them
+        self.frame_cache = FrameCache(self.settings, self.settings.frame_cache_max_bytes, self.atlas)
 
     def get_animation(self, command):
         """Takes a command and returns the list of frames for corresponding animation."""
         return self.animations.get(command)  # Returns list of frames for command
+
+    def preload_frames(self):
+        """Decode every animation frame once, call after the window has been created."""
+        self.frame_cache.preload(self.animations)
+
+    def get_frame(self, path):
+        """Takes a frame path and returns its decoded, color keyed image."""
+        return self.frame_cache.get(path)
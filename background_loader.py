@@ -0,0 +1,39 @@
+import threading
+import time
+
+
+class BackgroundLoader:
+    """A class for building something slow on a background thread while the window keeps running."""
+    def __init__(self, load):
+        """Start calling load() on a background thread."""
+        self.load = load
+        self.result = None
+        self.error = None
+
+        # How long load() took, set once it has finished
+        self.seconds = None
+        self.done = threading.Event()
+
+        self.thread = threading.Thread(target=self._run, daemon=True)  # thread closes with the program
+        self.thread.start()
+
+    @property
+    def ready(self):
+        """True once load() has finished without an error."""
+        return self.done.is_set() and self.error is None
+
+    @property
+    def failed(self):
+        """True if load() raised an error."""
+        return self.done.is_set() and self.error is not None
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            self.result = self.load()
+        except Exception as e:
+            print("Error while loading:", e)
+            self.error = e
+        finally:
+            self.seconds = time.perf_counter() - start
+            self.done.set()
@@ -0,0 +1,126 @@
+"""Benchmark ChatClient against a new connection per request, using the local fake chat API.
+
+    python -m benchmarks.chat_client --requests 200 --handshake-delay 0.03
+    python -m benchmarks.chat_client --fail-rate 0.2 --retry-after 0.05
+    python -m benchmarks.chat_client --stream --chunk-delay 0.02   # time until the first text shows
+"""
+import argparse
+import json
+import time
+from types import SimpleNamespace
+
+import requests
+
+from benchmarks.common import percentile
+from benchmarks.fake_chat_server import FakeChatServer
+from chat_client import ChatClient
+
+
+def client_settings(**overrides):
+    """Return the API settings ChatClient reads, with the same defaults as the apps' Settings."""
+    settings = SimpleNamespace(api_connect_timeout=5, api_read_timeout=60, api_max_retries=3,
+                               api_backoff=0.5, api_max_backoff=30, api_pool_size=2)
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    return settings
+
+
+def run(label, post, server, count):
+    """Send count requests through post(data) and report latency and connections opened."""
+    data = {"model": "fake", "messages": [{"role": "user", "content": "Hello Bonzi!"}]}
+    connections = server.counts["connections"]
+    latencies = []
+    errors = 0
+    for _ in range(count):
+        start = time.perf_counter()
+        try:
+            post(data).json()
+        except requests.RequestException:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        "client": label,
+        "requests": count,
+        "errors": errors,
+        "connections": server.counts["connections"] - connections,
+        "p50_ms": round(1000 * percentile(latencies, 50), 2),
+        "p99_ms": round(1000 * percentile(latencies, 99), 2),
+        "max_ms": round(1000 * max(latencies), 2),
+    }
+
+
+def run_stream(client, server, count):
+    """Stream count replies and report how long the first text and the whole reply took."""
+    data = {"model": "fake", "messages": [{"role": "user", "content": "Hello Bonzi!"}]}
+    connections = server.counts["connections"]
+    first = []
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        for i, piece in enumerate(client.stream(data)):
+            if i == 0:
+                first.append(time.perf_counter() - start)
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        "client": "stream",
+        "requests": count,
+        "errors": 0,
+        "connections": server.counts["connections"] - connections,
+        "first_p50_ms": round(1000 * percentile(first, 50), 2),
+        "p50_ms": round(1000 * percentile(latencies, 50), 2),
+        "p99_ms": round(1000 * percentile(latencies, 99), 2),
+        "max_ms": round(1000 * max(latencies), 2),
+    }
+
+
+def fresh_post(server, settings):
+    """The old way, requests.post() opens a new connection for every call."""
+    def post(data):
+        response = requests.post(server.url, json=data)
+        response.raise_for_status()
+        return response
+    return post
+
+
+def print_table(results):
+    columns = ["client", "requests", "errors", "connections", "first_p50_ms", "p50_ms", "p99_ms", "max_ms"]
+    print("  ".join(f"{column:>12}" for column in columns))
+    for result in results:
+        print("  ".join(f"{result.get(column, '-'):>12}" for column in columns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--handshake-delay", type=float, default=0.02,
+                        help="extra seconds the fake API adds to each new connection")
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=float, default=None)
+    parser.add_argument("--backoff", type=float, default=0.05, help="first retry wait, shorter than the app's")
+    parser.add_argument("--stream", action="store_true", help="also stream the replies as server-sent events")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="seconds between streamed chunks")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    server = FakeChatServer(latency=args.latency, handshake_delay=args.handshake_delay, fail_rate=args.fail_rate,
+                            fail_status=args.fail_status, retry_after=args.retry_after, chunk_delay=args.chunk_delay,
+                            seed=0).start()
+    settings = client_settings(api_backoff=args.backoff)
+    client = ChatClient(settings, "fake-key", server.url)
+
+    results = [run("fresh", fresh_post(server, settings), server, args.requests),
+               run("session", client.post, server, args.requests)]
+    results[1]["retries"] = client.retries
+    if args.stream:
+        results.append(run_stream(client, server, args.requests))
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print_table(results)
+        print(f"session retries: {client.retries}, server saw {server.counts}")
@@ -0,0 +1,29 @@
+import sys
+from types import SimpleNamespace
+
+from settings import Settings
+from tracing import percentile  # noqa: F401  the benchmarks and the live trace summary share it
+
+
+def make_bonzi(settings=None):
+    """Return a stand-in for the Bonzi class with just the attributes the chatbot touches."""
+    return SimpleNamespace(settings=settings or Settings(),
+                           chat_bubble=None,
+                           input_box=SimpleNamespace(processing_tts=False),
+                           inference=SimpleNamespace(speech_finished=lambda: None))
+
+
+def peak_rss_mb():
+    """Return the peak resident memory of this process in MB, or None if it can't be read."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS reports bytes
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    except (ImportError, AttributeError):
+        return None
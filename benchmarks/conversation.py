@@ -0,0 +1,93 @@
+"""Benchmark per-turn latency as a conversation with Bonzi grows.
+
+    python -m benchmarks.conversation --turns 60
+    python -m benchmarks.conversation --turns 60 --per-turn   # a line for every turn
+
+The conversation is run twice with the same seed, once reusing GPT-2's key/value cache between
+turns and once re-encoding the whole conversation every turn.
+"""
+import argparse
+import json
+import time
+
+from benchmarks.common import make_bonzi, percentile
+from benchmarks.inference import PROMPTS
+
+
+def run(chatbot, turns, reuse_cache, seed=0):
+    """Talk to the chatbot for a number of turns and return the latency and context size of each one."""
+    import torch
+    from conversation import ConversationSession
+
+    torch.manual_seed(seed)
+    chatbot.conversation = ConversationSession(chatbot.tokenizer, chatbot.model.config.n_positions,
+                                               chatbot.max_length)
+    rows = []
+    for i in range(turns):
+        if not reuse_cache:
+            chatbot.conversation.past_key_values = None
+        start = time.perf_counter()
+        with torch.inference_mode():
+            output = chatbot.model.generate(**chatbot.generation_kwargs(PROMPTS[i % len(PROMPTS)]))
+        chatbot.conversation.finish_turn(output)
+        rows.append({"turn": i + 1, "context": len(chatbot.conversation.tokens),
+                     "ms": round(1000 * (time.perf_counter() - start), 1)})
+    return rows, chatbot.conversation.stats()
+
+
+def summarize(label, rows, stats):
+    """Compare the first and last quarter of the turns, flat latency means the cache is doing its job."""
+    quarter = max(1, len(rows) // 4)
+    latencies = [row["ms"] for row in rows]
+    return {
+        "mode": label,
+        "turns": len(rows),
+        "trims": stats["trims"],
+        "encoded": stats["encoded_tokens"],
+        "first_ms": round(sum(latencies[:quarter]) / quarter, 1),
+        "last_ms": round(sum(latencies[-quarter:]) / quarter, 1),
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def print_table(results):
+    columns = ["mode", "turns", "trims", "encoded", "first_ms", "last_ms", "p50_ms", "p99_ms"]
+    print("  ".join(f"{column:>9}" for column in columns))
+    for result in results:
+        print("  ".join(f"{result[column]:>9}" for column in columns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--threads", type=int, default=None, help="PyTorch threads, default lets PyTorch decide")
+    parser.add_argument("--model-dir", default="bonzi_model")
+    parser.add_argument("--per-turn", action="store_true", help="also print every turn's latency and context size")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    from bonzi_gpt import BonziGPT
+
+    bonzi = make_bonzi()
+    bonzi.settings.inference_threads = args.threads
+    bonzi.settings.conversation_memory = True  # off by default in Settings
+    bonzi.settings.response_cache_path = None
+    chatbot = BonziGPT(bonzi, "personality.txt", args.model_dir, speak=False)
+    run(chatbot, 2, True)  # untimed, so first-call setup isn't counted
+
+    results = []
+    turns = {}
+    for label, reuse_cache in (("cached", True), ("re-encode", False)):
+        rows, stats = run(chatbot, args.turns, reuse_cache)
+        results.append(summarize(label, rows, stats))
+        turns[label] = rows
+
+    if args.json:
+        print(json.dumps({"summary": results, "turns": turns if args.per_turn else None}))
+    else:
+        print_table(results)
+        if args.per_turn:
+            for cached, encoded in zip(turns["cached"], turns["re-encode"]):
+                print(f"turn {cached['turn']:>3}  context {cached['context']:>4}  "
+                      f"cached {cached['ms']:>7} ms  re-encode {encoded['ms']:>7} ms")
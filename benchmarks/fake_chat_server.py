@@ -0,0 +1,160 @@
+"""A local stand-in for the OpenAI chat completions API, to measure the chat client offline.
+
+    python -m benchmarks.fake_chat_server --port 8765 --latency 0.05 --fail-rate 0.1
+
+Point ChatClient at http://127.0.0.1:8765/v1/chat/completions. It counts the TCP connections it
+accepts so connection reuse can be checked, and can fail the first few requests or a share of them
+with 429 or 5xx.
+Requests with "stream": true get the reply as server-sent events, a few characters per chunk.
+"""
+import argparse
+import json
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeChatHandler(BaseHTTPRequestHandler):
+    """Answers every chat completions request with the same canned reply."""
+    # HTTP/1.1 keeps connections open between requests, like the real API
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately, without this Nagle's algorithm holds the body
+        # back waiting for the client's delayed ACK on kept-alive connections
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.count("connections")
+        self.first_request = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        data = json.loads(self.rfile.read(length) or b"{}")
+        self.server.count("requests")
+
+        # The first request on a connection pays for the handshake a real TLS connection would need
+        delay = self.server.latency
+        if self.first_request:
+            delay += self.server.handshake_delay
+            self.first_request = False
+        time.sleep(delay)
+
+        if self.server.should_fail():
+            self.server.count("failures")
+            headers = {}
+            if self.server.retry_after is not None:
+                headers["Retry-After"] = str(self.server.retry_after)
+            self.send_json(self.server.fail_status, {"error": {"message": "try again later"}}, headers)
+            return
+
+        reply = self.server.reply
+        if data.get("stream"):
+            self.send_stream(data, reply)
+            return
+        self.send_json(200, {
+            "model": data.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+        })
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_stream(self, data, reply):
+        """Send the reply as server-sent event chunks, like the API does with "stream": true."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        # Chunked encoding lets the connection stay open without knowing the length up front
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        size = self.server.chunk_chars
+        for i in range(0, len(reply), size):
+            chunk = {"model": data.get("model", "fake"),
+                     "choices": [{"index": 0, "delta": {"content": reply[i:i + size]}, "finish_reason": None}]}
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            time.sleep(self.server.chunk_delay)
+        self.write_chunk("data: [DONE]\n\n")
+        self.write_chunk("")  # an empty chunk ends the response
+
+    def write_chunk(self, text):
+        payload = text.encode("utf-8")
+        self.wfile.write(f"{len(payload):x}\r\n".encode("ascii") + payload + b"\r\n")
+
+    def log_message(self, format, *args):
+        pass  # keep benchmark output readable
+
+
+class FakeChatServer(ThreadingHTTPServer):
+    """A class for the stand-in server, its counters can be read while it runs."""
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, handshake_delay=0.0, fail_rate=0.0, fail_status=503,
+                 retry_after=None, reply="Hello! I am Bonzi, your friend.", chunk_chars=4, chunk_delay=0.0,
+                 seed=None, fail_first=0):
+        """retry_after is sent as is with failures, seconds or an HTTP date. fail_first fails that many
+        requests before fail_rate applies."""
+        super().__init__(("127.0.0.1", port), FakeChatHandler)
+        self.latency = latency
+        self.handshake_delay = handshake_delay
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.reply = reply
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = chunk_delay
+        self.random = random.Random(seed)
+        self.fail_first = fail_first
+
+        self.counts = {"connections": 0, "requests": 0, "failures": 0}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1/chat/completions"
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def should_fail(self):
+        with self.lock:
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                return True
+            return self.random.random() < self.fail_rate
+
+    def start(self):
+        """Serve on a background thread and return the server."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--handshake-delay", type=float, default=0.0,
+                        help="extra seconds on the first request of each connection")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests that fail, 0 to 1")
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After seconds sent with failures")
+    parser.add_argument("--reply", default="Hello! I am Bonzi, your friend.", help="text every request gets back")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="seconds between streamed chunks")
+    args = parser.parse_args()
+
+    server = FakeChatServer(args.port, args.latency, args.handshake_delay, args.fail_rate, args.fail_status,
+                            args.retry_after, args.reply, chunk_delay=args.chunk_delay)
+    print(f"Fake chat API on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(server.counts)
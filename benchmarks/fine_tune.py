@@ -0,0 +1,128 @@
+"""Benchmark fine-tuning throughput on the CPU, the old line-by-line dataset against packed blocks.
+
+    python -m benchmarks.fine_tune --epochs 1
+    python -m benchmarks.fine_tune --repeat 20 --batch-size 8 --block-size 256
+
+--repeat makes the text file that many times longer, personality.txt alone is only a few steps.
+The model is trained from the weights in --model-dir, nothing is saved.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.common import make_bonzi
+
+
+def line_dataset(text_file, tokenizer):
+    """The dataset fine_tune_gpt() used to build, one example per line and a batch size of 1."""
+    from datasets import load_dataset
+    dataset = load_dataset("text", data_files=text_file)
+    return dataset.map(lambda examples: {"input_ids": [tokenizer(text)["input_ids"]
+                                                       for text in examples["text"] if text.strip() != ""]},
+                       batched=True, remove_columns=["text"])["train"]
+
+
+def train(model_dir, dataset, data_collator, batch_size, accumulation, epochs, threads):
+    """Train a fresh copy of the model on the dataset and return the steps, seconds and tokens trained."""
+    import torch
+    from transformers import GPT2LMHeadModel, Trainer, TrainingArguments
+
+    if threads:
+        torch.set_num_threads(threads)
+    model = GPT2LMHeadModel.from_pretrained(model_dir)
+    with tempfile.TemporaryDirectory() as output_dir:
+        args = TrainingArguments(output_dir=output_dir, num_train_epochs=epochs,
+                                 per_device_train_batch_size=batch_size,
+                                 gradient_accumulation_steps=accumulation,
+                                 learning_rate=5e-5, save_strategy="no", report_to=[],
+                                 disable_tqdm=True, logging_strategy="no", use_cpu=True, seed=0)
+        trainer = Trainer(model=model, args=args, data_collator=data_collator, train_dataset=dataset)
+        start = time.perf_counter()
+        trainer.train()
+        seconds = time.perf_counter() - start
+
+    # Padding isn't counted, only tokens the model actually learned from
+    if "attention_mask" in dataset.column_names:
+        tokens = sum(sum(mask) for mask in dataset["attention_mask"])
+    else:
+        tokens = sum(len(ids) for ids in dataset["input_ids"])
+    return trainer.state.global_step, seconds, tokens * epochs
+
+
+def result(pipeline, prepare_s, steps, seconds, tokens, examples):
+    return {
+        "pipeline": pipeline,
+        "examples": examples,
+        "prepare_s": round(prepare_s, 3),
+        "steps": steps,
+        "train_s": round(seconds, 2),
+        "steps_per_s": round(steps / seconds, 2),
+        "tokens_per_s": round(tokens / seconds, 1),
+    }
+
+
+def print_table(results):
+    columns = ["pipeline", "examples", "prepare_s", "steps", "train_s", "steps_per_s", "tokens_per_s"]
+    print("  ".join(f"{column:>12}" for column in columns))
+    for row in results:
+        print("  ".join(f"{row[column]:>12}" for column in columns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--text-file", default="personality.txt")
+    parser.add_argument("--repeat", type=int, default=4, help="copies of the text file to train on")
+    parser.add_argument("--model-dir", default="gpt2", help="weights to start from, e.g. gpt2 or bonzi_model")
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--block-size", type=int, default=None, help="default from Settings")
+    parser.add_argument("--batch-size", type=int, default=None, help="default from Settings")
+    parser.add_argument("--accumulation", type=int, default=None, help="default from Settings")
+    parser.add_argument("--threads", type=int, default=None, help="PyTorch threads, default lets PyTorch decide")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    from transformers import DataCollatorForLanguageModeling, GPT2Tokenizer, default_data_collator
+    from training_data import load_training_blocks
+
+    settings = make_bonzi().settings
+    block_size = args.block_size or settings.train_block_size
+    batch_size = args.batch_size or settings.train_batch_size
+    accumulation = args.accumulation or settings.train_gradient_accumulation
+
+    tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
+    tokenizer.pad_token = tokenizer.eos_token
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        text_file = os.path.join(work_dir, "train.txt")
+        with open(args.text_file, encoding="utf-8") as file:
+            text = file.read()
+        with open(text_file, "w", encoding="utf-8") as file:
+            file.write("\n".join([text] * args.repeat))
+
+        start = time.perf_counter()
+        lines = line_dataset(text_file, tokenizer)
+        lines_prepare = time.perf_counter() - start
+        collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
+        results = [result("lines", lines_prepare, *train(args.model_dir, lines, collator, 1, 1, args.epochs,
+                                                          args.threads), len(lines))]
+
+        # Cold tokenizes and fills the cache, warm loads it back
+        cache_dir = os.path.join(work_dir, "training_cache")
+        start = time.perf_counter()
+        load_training_blocks(text_file, tokenizer, block_size, cache_dir, settings.train_workers)
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        blocks = load_training_blocks(text_file, tokenizer, block_size, cache_dir, settings.train_workers)
+        warm = time.perf_counter() - start
+        packed = train(args.model_dir, blocks, default_data_collator, batch_size, accumulation, args.epochs,
+                       args.threads)
+        results.append(result(f"packed {block_size}x{batch_size}", warm, *packed, len(blocks)))
+        results[-1]["cold_prepare_s"] = round(cold, 3)
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print_table(results)
+        print(f"packed data took {cold:.3f}s to tokenize and {warm:.3f}s to load from the cache")
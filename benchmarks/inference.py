@@ -0,0 +1,110 @@
+"""Benchmark GPT-2 response latency and memory for each CPU inference mode and backend.
+
+    python -m benchmarks.inference --compare          # every mode and backend, each in a fresh process
+    python -m benchmarks.inference --mode int8 --threads 4
+    python onnx_backend.py && python -m benchmarks.inference --backend onnx --mode int8
+
+Backends without an export in --onnx-dir fall back to PyTorch, the backend column shows which one ran.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+from benchmarks.common import make_bonzi, percentile, peak_rss_mb
+
+
+PROMPTS = ["Hello!", "What is your name?", "Can you tell me a joke?", "What do you like to do?",
+           "How are you feeling today, Bonzi?"]
+
+
+# (backend, mode) pairs --compare runs, the ONNX backend has no bf16 mode
+COMPARE = [("pytorch", "float32"), ("pytorch", "int8"), ("pytorch", "bf16"), ("onnx", "float32"), ("onnx", "int8")]
+
+
+def run(mode, threads, runs, model_dir="bonzi_model", backend="pytorch", onnx_dir="bonzi_model_onnx"):
+    """Load BonziGPT in one inference mode and backend and time its responses."""
+    import torch
+    from bonzi_gpt import BonziGPT
+
+    bonzi = make_bonzi()
+    bonzi.settings.inference_mode = mode
+    bonzi.settings.inference_threads = threads
+    bonzi.settings.inference_backend = backend
+    bonzi.settings.onnx_model_dir = onnx_dir
+    bonzi.settings.conversation_memory = False  # every prompt is timed on its own
+
+    start = time.perf_counter()
+    chatbot = BonziGPT(bonzi, "personality.txt", model_dir)
+    load_seconds = time.perf_counter() - start
+
+    # One untimed response so first-call setup isn't counted
+    chatbot.backend.generate(**chatbot.generation_kwargs(PROMPTS[0]))
+
+    latencies = []
+    tokens = 0
+    for i in range(runs):
+        kwargs = chatbot.generation_kwargs(PROMPTS[i % len(PROMPTS)])
+        start = time.perf_counter()
+        output = chatbot.backend.generate(**kwargs)
+        latencies.append(time.perf_counter() - start)
+        tokens += output.shape[1] - kwargs["inputs"].shape[1]
+
+    return {
+        "mode": mode,
+        "backend": "pytorch" if chatbot.model is not None else "onnx",
+        "threads": torch.get_num_threads(),
+        "load_s": round(load_seconds, 3),
+        "mean_ms": round(1000 * sum(latencies) / len(latencies), 1),
+        "p50_ms": round(1000 * percentile(latencies, 50), 1),
+        "p95_ms": round(1000 * percentile(latencies, 95), 1),
+        "tokens_per_s": round(tokens / sum(latencies), 1),
+        "ms_per_token": round(1000 * sum(latencies) / max(tokens, 1), 2),
+        "peak_rss_mb": round(peak_rss_mb() or 0, 1),
+    }
+
+
+def compare(configs, threads, runs, model_dir="bonzi_model", onnx_dir="bonzi_model_onnx"):
+    """Run each (backend, mode) pair in its own process so their memory use doesn't mix."""
+    results = []
+    for backend, mode in configs:
+        command = [sys.executable, "-m", "benchmarks.inference", "--mode", mode, "--backend", backend,
+                   "--runs", str(runs), "--model-dir", model_dir, "--onnx-dir", onnx_dir, "--json"]
+        if threads:
+            command += ["--threads", str(threads)]
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def print_table(results):
+    columns = ["mode", "backend", "threads", "load_s", "mean_ms", "p50_ms", "p95_ms", "tokens_per_s", "ms_per_token",
+               "peak_rss_mb"]
+    print("  ".join(f"{column:>12}" for column in columns))
+    for result in results:
+        print("  ".join(f"{result[column]:>12}" for column in columns))
+
+
+if __name__ == '__main__':
+    from cpu_inference import INFERENCE_BACKENDS, INFERENCE_MODES
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=INFERENCE_MODES, default="float32")
+    parser.add_argument("--backend", choices=INFERENCE_BACKENDS, default="pytorch")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--model-dir", default="bonzi_model")
+    parser.add_argument("--onnx-dir", default="bonzi_model_onnx", help="export made by onnx_backend.py")
+    parser.add_argument("--compare", action="store_true", help="benchmark every mode and backend")
+    parser.add_argument("--json", action="store_true", help="print the result as one JSON line")
+    args = parser.parse_args()
+
+    if args.compare:
+        print_table(compare(COMPARE, args.threads, args.runs, args.model_dir, args.onnx_dir))
+    else:
+        result = run(args.mode, args.threads, args.runs, args.model_dir, args.backend, args.onnx_dir)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print_table([result])
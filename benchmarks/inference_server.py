@@ -0,0 +1,102 @@
+"""Benchmark the shared inference server with several Bonzi clients asking at once.
+
+    python -m benchmarks.inference_server --clients 1 2 4 8 --requests 16
+    python -m benchmarks.inference_server --batch-window 0.05 --max-batch 16
+
+Each client count is run twice, once with batching and once with --max-batch 1, which answers
+requests one at a time like separate models would.
+"""
+import argparse
+import json
+import threading
+import time
+
+import requests
+
+from benchmarks.common import make_bonzi, percentile
+from benchmarks.inference import PROMPTS
+from inference_server import InferenceServer, RequestBatcher
+
+
+def run(chatbot, clients, requests_per_client, window, max_batch):
+    """Start a server on a free port, send requests from clients threads and report throughput and latency."""
+    batcher = RequestBatcher(chatbot.generate_batch, chatbot.temperature_for, window, max_batch)
+    server = InferenceServer(batcher, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(index):
+        session = requests.Session()
+        for i in range(requests_per_client):
+            text = PROMPTS[(index + i) % len(PROMPTS)]
+            data = {"model": "bonzi-gpt2", "messages": [{"role": "user", "content": text}]}
+            start = time.perf_counter()
+            try:
+                session.post(server.url, json=data, timeout=300).raise_for_status()
+            except requests.RequestException as e:
+                with lock:
+                    errors.append(e)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    server.shutdown()
+    server.server_close()
+
+    return {
+        "clients": clients,
+        "max_batch": max_batch,
+        "responses": len(latencies),
+        "errors": len(errors),
+        "mean_batch": batcher.stats()["mean_batch"],
+        "per_s": round(len(latencies) / seconds, 2),
+        "p50_ms": round(1000 * percentile(latencies, 50), 1),
+        "p99_ms": round(1000 * percentile(latencies, 99), 1),
+    }
+
+
+def print_table(results):
+    columns = ["clients", "max_batch", "responses", "errors", "mean_batch", "per_s", "p50_ms", "p99_ms"]
+    print("  ".join(f"{column:>10}" for column in columns))
+    for result in results:
+        print("  ".join(f"{result[column]:>10}" for column in columns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=8, help="requests each client sends")
+    parser.add_argument("--batch-window", type=float, default=0.02)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=None, help="PyTorch threads, default lets PyTorch decide")
+    parser.add_argument("--model-dir", default="bonzi_model")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    from bonzi_gpt import BonziGPT
+
+    bonzi = make_bonzi()
+    bonzi.settings.inference_threads = args.threads
+    bonzi.settings.response_cache_path = None  # every request should reach the model
+    chatbot = BonziGPT(bonzi, "personality.txt", args.model_dir, speak=False)
+    chatbot.generate_batch(PROMPTS[:2], 0.7)  # untimed, so first-call setup isn't counted
+
+    results = []
+    for clients in args.clients:
+        for max_batch in (1, args.max_batch):
+            results.append(run(chatbot, clients, args.requests, args.batch_window, max_batch))
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print_table(results)
@@ -0,0 +1,85 @@
+"""Benchmark per-request latency with the persona's cache against encoding the persona every request.
+
+    python -m benchmarks.persona --runs 20
+    python -m benchmarks.persona --persona-tokens 512 --new-tokens 1   # the persona's prefill cost alone
+
+The persona is personality.txt unless --persona-file says otherwise.
+"""
+import argparse
+import json
+import time
+
+from benchmarks.common import make_bonzi, percentile
+from benchmarks.inference import PROMPTS
+
+
+def run(chatbot, runs, cached, new_tokens=None, seed=0):
+    """Time runs responses with or without the persona's cache and return the latencies in seconds."""
+    import torch
+
+    latencies = []
+    for i in range(runs):
+        torch.manual_seed(seed + i)
+        # Timed from building the arguments, copying the persona's cache is part of every request
+        start = time.perf_counter()
+        kwargs = chatbot.generation_kwargs(PROMPTS[i % len(PROMPTS)])
+        if not cached:
+            kwargs.pop("past_key_values")
+        if new_tokens is not None:
+            kwargs.update(max_new_tokens=new_tokens, min_new_tokens=new_tokens)
+        with torch.inference_mode():
+            chatbot.model.generate(**kwargs)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def summarize(label, latencies, persona_tokens):
+    return {
+        "persona": label,
+        "tokens": persona_tokens,
+        "mean_ms": round(1000 * sum(latencies) / len(latencies), 1),
+        "p50_ms": round(1000 * percentile(latencies, 50), 1),
+        "p99_ms": round(1000 * percentile(latencies, 99), 1),
+    }
+
+
+def print_table(results):
+    columns = ["persona", "tokens", "mean_ms", "p50_ms", "p99_ms"]
+    print("  ".join(f"{column:>10}" for column in columns))
+    for result in results:
+        print("  ".join(f"{result[column]:>10}" for column in columns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--persona-file", default="personality.txt")
+    parser.add_argument("--persona-tokens", type=int, default=256, help="persona length, longer files are cut")
+    parser.add_argument("--new-tokens", type=int, default=None, help="tokens every response generates")
+    parser.add_argument("--threads", type=int, default=None, help="PyTorch threads, default lets PyTorch decide")
+    parser.add_argument("--model-dir", default="bonzi_model")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    from bonzi_gpt import BonziGPT
+
+    bonzi = make_bonzi()
+    bonzi.settings.inference_threads = args.threads
+    bonzi.settings.response_cache_path = None
+    bonzi.settings.conversation_memory = False  # every request starts from the persona alone
+    bonzi.settings.persona_file = args.persona_file
+    bonzi.settings.persona_max_tokens = args.persona_tokens
+
+    start = time.perf_counter()
+    chatbot = BonziGPT(bonzi, "personality.txt", args.model_dir, speak=False)
+    print(f"loaded in {time.perf_counter() - start:.2f}s, persona is {len(chatbot.persona.tokens)} tokens")
+    run(chatbot, 2, True)  # untimed, so first-call setup isn't counted
+
+    persona_tokens = len(chatbot.persona.tokens)
+    results = [summarize("cached", run(chatbot, args.runs, True, args.new_tokens), persona_tokens),
+               summarize("re-encode", run(chatbot, args.runs, False, args.new_tokens), persona_tokens)]
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print_table(results)
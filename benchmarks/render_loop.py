@@ -0,0 +1,333 @@
+"""Benchmark the cost of drawing a frame in main.py and bonzi_app.py without a display.
+
+    python -m benchmarks.render_loop                              # both windows, each in a fresh process
+    python -m benchmarks.render_loop --save render_baseline.json  # keep the results to compare against
+    python -m benchmarks.render_loop --baseline render_baseline.json
+
+Each window runs with SDL's dummy video driver and a stand-in chatbot, so no model or API key is needed.
+It plays every animation, types into the input box and streams long replies into the chat bubble.
+Animations are played one frame per drawn frame instead of by the clock, so every frame has work to do.
+
+alloc_kb is how far Python's memory rose above where it started during a frame, from tracemalloc in a
+second untimed pass. net_blocks is how many Python memory blocks each frame left behind, it should stay
+near 0. Memory SDL allocates for surfaces isn't seen by either, peak_rss_mb covers it.
+"""
+import argparse
+import array
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+# Must be set before pygame is imported
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+from benchmarks.common import peak_rss_mb, percentile
+
+
+VARIANTS = ("main", "bonzi_app")
+
+TYPED_TEXT = "Hey Bonzi, can you tell me a really long story about bananas and space travel?"
+
+LONG_TEXTS = [
+    "Well, well, well! Did you know that bananas are technically berries, but strawberries are not? "
+    "I learned that from a very wise gorilla who lived in a tree next to a library. "
+    "He read every book twice and still could not remember where he left his sunglasses.",
+    "Once upon a time, a purple gorilla flew to the moon in a rocket made of old floppy disks. "
+    "When he landed, he found that the moon was not made of cheese at all, it was made of pixels, "
+    "and every crater was a tiny window into somebody's desktop from 1999!",
+]
+
+# Metrics checked against a baseline, a higher number is worse for all of them
+COMPARED = ("mean_ms", "p95_ms", "alloc_kb", "peak_rss_mb")
+
+
+class FrameClock:
+    """Stand-in clock for Timeline that moves on one animation frame each time it is read."""
+    def __init__(self, step):
+        self.step = step
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+class StubChatbot:
+    """Stands in for BonziGPT and BonziChat, answering straight away without a model or the network."""
+    def __init__(self, bonzi=None):
+        self.bonzi = bonzi
+        self.speech = SimpleNamespace(cancel=lambda: None)
+
+    def get_response(self, text, cancel_event=None):
+        return LONG_TEXTS[0]
+
+    def respond(self, text, cancel_event=None):
+        return LONG_TEXTS[0]
+
+    def stream_response(self, text, cancel_event=None):
+        yield from re.findall(r"\S+\s*", LONG_TEXTS[0])
+
+
+class FrameMeter:
+    """Runs frames of the window, timing each one or measuring the memory it allocates."""
+    def __init__(self, tick, allocations=False):
+        self.tick = tick
+        self.allocations = allocations
+        # An array holds plain numbers, so the samples themselves don't show up in net_blocks
+        self.samples = array.array("d")
+
+    def frame(self):
+        if self.allocations:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            self.tick()
+            self.samples.append(tracemalloc.get_traced_memory()[1] - before)
+        else:
+            start = time.perf_counter()
+            self.tick()
+            self.samples.append(time.perf_counter() - start)
+
+
+def make_background():
+    """Write a plain background image for main.py to a temporary folder and return its path."""
+    import pygame
+    from settings import Settings
+
+    settings = Settings()
+    surface = pygame.Surface((settings.window_width, settings.window_height))
+    surface.fill((58, 110, 165))
+    path = os.path.join(tempfile.mkdtemp(), "background.png")
+    pygame.image.save(surface, path)
+    return path
+
+
+def load_main():
+    """Build main.py's window with the stand-in chatbot, returns (bonzi, tick)."""
+    import main
+    from settings import Settings
+
+    # The background image isn't part of the repository, a plain one is drawn instead if it's missing
+    def make_settings():
+        settings = Settings()
+        if not os.path.exists(settings.background_image):
+            settings.background_image = make_background()
+        return settings
+
+    main.Settings = make_settings
+    main.Bonzi.load_chatbot = lambda bonzi: StubChatbot(bonzi)
+    bonzi = main.Bonzi()
+
+    def tick():
+        bonzi.check_events()
+        bonzi.check_chatbot_loaded()
+        bonzi.check_responses()
+        bonzi.update_screen()
+
+    # The chatbot loads on a background thread, the window keeps drawing meanwhile like it would
+    while bonzi.chatbot is None:
+        tick()
+    return bonzi, tick
+
+
+def load_bonzi_app():
+    """Build bonzi_app.py's window with the stand-in chatbot, returns (bonzi, tick)."""
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")  # checked when bonzi_app is imported
+    import bonzi_app
+
+    bonzi_app.BonziChat = StubChatbot
+    bonzi = bonzi_app.Bonzi()
+
+    def tick():
+        bonzi.check_events()
+        bonzi.check_responses()
+        bonzi.update_screen()
+    return bonzi, tick
+
+
+def reset(bonzi):
+    """Put the window back to Bonzi standing still with an empty chat bubble."""
+    import pygame
+
+    bonzi.current_animation = None
+    bonzi.chat_bubble = None
+    bonzi.timeline.stop()
+    bonzi.last_interaction = pygame.time.get_ticks()  # no idle animation in the middle of a phase
+
+
+def play_animations(bonzi, frame, repeat):
+    """Play every animation from its first frame to its last."""
+    for _ in range(repeat):
+        for name, paths in bonzi.animations.animations.items():
+            bonzi.current_animation = name
+            bonzi.timeline.stop()
+            for _ in range(len(paths) + 1):
+                frame()
+
+
+def type_text(bonzi, frame, repeat):
+    """Click the input box, then type into it and delete it again one key per frame."""
+    import pygame
+
+    box = bonzi.input_box
+    while not box.active:
+        pygame.event.post(pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=box.rect.center, button=1))
+        frame()
+
+    for _ in range(repeat):
+        for character in TYPED_TEXT[:box.char_limit]:
+            pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=ord(character), unicode=character))
+            frame()
+        while box.text:
+            pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_BACKSPACE, unicode=""))
+            frame()
+
+
+def show_bubbles(bonzi, frame, repeat):
+    """Stream long replies into the chat bubble a word per frame, the way the inference worker hands them over."""
+    for _ in range(repeat):
+        for text in LONG_TEXTS:
+            bonzi.inference.responses.put(("start", None))
+            for piece in re.findall(r"\S+\s*", text):
+                bonzi.inference.responses.put(("piece", piece))
+                frame()
+            bonzi.inference.responses.put(("done", text))
+            frame()
+
+
+PHASES = [("animations", play_animations), ("typing", type_text), ("chat_bubble", show_bubbles)]
+
+
+def run(variant, repeat):
+    """Run every phase in one window, returns its results."""
+    import pygame
+    from timeline import DEFAULT_FRAME_SECONDS
+
+    bonzi, tick = load_main() if variant == "main" else load_bonzi_app()
+    bonzi.timeline.clock = FrameClock(DEFAULT_FRAME_SECONDS)
+    bonzi.timeline.stop()  # started on the real clock while loading, it starts again on this one
+
+    # Let the arrive animation finish and the first full redraw happen before anything is measured
+    while bonzi.startup:
+        tick()
+
+    phases = {}
+    for name, phase in PHASES:
+        reset(bonzi)
+        phase(bonzi, tick, 1)  # untimed, so first-time setup like rendering new glyphs isn't counted
+
+        reset(bonzi)
+        meter = FrameMeter(tick)
+        blocks = sys.getallocatedblocks()
+        phase(bonzi, meter.frame, repeat)
+        net_blocks = (sys.getallocatedblocks() - blocks) / len(meter.samples)
+
+        reset(bonzi)
+        allocations = FrameMeter(tick, allocations=True)
+        tracemalloc.start()
+        phase(bonzi, allocations.frame, 1)
+        tracemalloc.stop()
+
+        times = meter.samples
+        phases[name] = {
+            "frames": len(times),
+            "mean_ms": round(1000 * sum(times) / len(times), 3),
+            "p50_ms": round(1000 * percentile(times, 50), 3),
+            "p95_ms": round(1000 * percentile(times, 95), 3),
+            "p99_ms": round(1000 * percentile(times, 99), 3),
+            "alloc_kb": round(sum(allocations.samples) / len(allocations.samples) / 1024, 2),
+            "net_blocks": round(net_blocks, 2),
+        }
+
+    pygame.quit()
+    return {"variant": variant, "repeat": repeat, "peak_rss_mb": round(peak_rss_mb() or 0, 1), "phases": phases}
+
+
+def run_all(variants, repeat):
+    """Run each window in its own process, so pygame starts fresh and their memory use doesn't mix."""
+    results = []
+    for variant in variants:
+        command = [sys.executable, "-m", "benchmarks.render_loop", "--variant", variant, "--repeat", str(repeat),
+                   "--json"]
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def rows(results):
+    """Flatten results into one row per window and phase."""
+    for result in results:
+        for phase, values in result["phases"].items():
+            yield dict(values, variant=result["variant"], phase=phase, peak_rss_mb=result["peak_rss_mb"])
+
+
+def print_table(results):
+    columns = ["variant", "phase", "frames", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "alloc_kb", "net_blocks",
+               "peak_rss_mb"]
+    print("  ".join(f"{column:>11}" for column in columns))
+    for row in rows(results):
+        print("  ".join(f"{row[column]:>11}" for column in columns))
+
+
+def compare(results, baseline, tolerance):
+    """Print each metric next to the baseline's, returns the ones that got worse by more than tolerance percent."""
+    previous = {(row["variant"], row["phase"]): row for row in rows(baseline["results"])}
+    worse = []
+    print(f"{'variant':>11}  {'phase':>11}  {'metric':>11}  {'baseline':>10}  {'now':>10}  {'change':>8}")
+    for row in rows(results):
+        old = previous.get((row["variant"], row["phase"]))
+        if old is None:
+            continue
+        for metric in COMPARED:
+            change = 100 * (row[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+            flag = ""
+            if change > tolerance:
+                worse.append((row["variant"], row["phase"], metric, round(change, 1)))
+                flag = "  worse"
+            print(f"{row['variant']:>11}  {row['phase']:>11}  {metric:>11}  {old[metric]:>10}  {row[metric]:>10}  "
+                  f"{change:>+7.1f}%{flag}")
+    return worse
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--variant", choices=VARIANTS, default=None, help="one window, default runs both")
+    parser.add_argument("--repeat", type=int, default=3, help="times each phase is timed")
+    parser.add_argument("--json", action="store_true", help="print the result as one JSON line")
+    parser.add_argument("--save", default=None, help="file to save the results to as JSON")
+    parser.add_argument("--baseline", default=None, help="results saved earlier to compare against")
+    parser.add_argument("--tolerance", type=float, default=25.0,
+                        help="percent a metric can get worse before --baseline fails")
+    args = parser.parse_args()
+
+    if args.variant and args.json:
+        # Runs inside the process run_all() started
+        print(json.dumps(run(args.variant, args.repeat)))
+        raise SystemExit
+
+    results = run_all([args.variant] if args.variant else VARIANTS, args.repeat)
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print_table(results)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump({"machine": platform.platform(), "python": platform.python_version(), "results": results},
+                      file, indent=2)
+        print(f"Saved {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        print()
+        worse = compare(results, baseline, args.tolerance)
+        if worse:
+            raise SystemExit(f"{len(worse)} metrics are more than {args.tolerance:g}% worse than {args.baseline}")
@@ -0,0 +1,106 @@
+"""Benchmark speculative decoding with the draft model against plain generation on the CPU.
+
+    python draft_model.py --layers 4 && python -m benchmarks.speculative --draft-dir bonzi_draft
+    python -m benchmarks.speculative --draft-dir bonzi_draft --draft-tokens 3 --new-tokens 60
+
+Acceptance is the share of the draft's guessed tokens the full model kept.
+"""
+import argparse
+import json
+import time
+
+from benchmarks.common import make_bonzi, percentile
+from benchmarks.inference import PROMPTS
+
+
+class CallCounter:
+    """Counts forward passes of a model."""
+    def __init__(self, model):
+        self.calls = 0
+        model.register_forward_hook(self.hook)
+
+    def hook(self, module, inputs, output):
+        self.calls += 1
+
+
+def run(chatbot, runs, draft, main_calls, draft_calls, new_tokens=None, seed=0):
+    """Generate runs responses with or without the draft model and report speed and acceptance."""
+    import torch
+
+    chatbot.draft_model = draft
+    latencies = []
+    tokens = 0
+    counted = (0, 0)
+    for i in range(runs):
+        torch.manual_seed(seed + i)
+        kwargs = chatbot.generation_kwargs(PROMPTS[i % len(PROMPTS)])
+        if new_tokens is not None:
+            kwargs.update(max_new_tokens=new_tokens, min_new_tokens=new_tokens)
+            kwargs.pop("max_length", None)
+        before = (main_calls.calls, draft_calls.calls)
+        start = time.perf_counter()
+        with torch.inference_mode():
+            output = chatbot.model.generate(**kwargs)
+        latencies.append(time.perf_counter() - start)
+        generated = output.shape[1] - kwargs["inputs"].shape[1]
+        tokens += generated
+        counted = (counted[0] + main_calls.calls - before[0], counted[1] + draft_calls.calls - before[1])
+
+    # Every full model pass keeps the draft tokens it agrees with plus one of its own
+    accepted = tokens - counted[0]
+    return {
+        "mode": "draft" if draft is not None else "plain",
+        "tokens": tokens,
+        "model_calls": counted[0],
+        "draft_calls": counted[1] if draft is not None else 0,
+        "acceptance": round(accepted / counted[1], 2) if draft is not None and counted[1] else None,
+        "tokens_per_s": round(tokens / sum(latencies), 1),
+        "p50_ms": round(1000 * percentile(latencies, 50), 1),
+        "p99_ms": round(1000 * percentile(latencies, 99), 1),
+    }
+
+
+def print_table(results):
+    columns = ["mode", "tokens", "model_calls", "draft_calls", "acceptance", "tokens_per_s", "p50_ms", "p99_ms"]
+    print("  ".join(f"{column:>12}" for column in columns))
+    for result in results:
+        print("  ".join(f"{str(result[column]):>12}" for column in columns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--model-dir", default="bonzi_model")
+    parser.add_argument("--draft-dir", default="bonzi_draft")
+    parser.add_argument("--draft-tokens", type=int, default=None, help="default from Settings.draft_tokens")
+    parser.add_argument("--new-tokens", type=int, default=None, help="tokens every response generates")
+    parser.add_argument("--mode", default="float32", help="inference mode for both models")
+    parser.add_argument("--threads", type=int, default=None, help="PyTorch threads, default lets PyTorch decide")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    from bonzi_gpt import BonziGPT
+
+    bonzi = make_bonzi()
+    bonzi.settings.inference_mode = args.mode
+    bonzi.settings.inference_threads = args.threads
+    bonzi.settings.response_cache_path = None
+    bonzi.settings.conversation_memory = False
+    bonzi.settings.draft_model_dir = args.draft_dir
+    if args.draft_tokens:
+        bonzi.settings.draft_tokens = args.draft_tokens
+    chatbot = BonziGPT(bonzi, "personality.txt", args.model_dir, speak=False)
+    draft = chatbot.draft_model
+    if draft is None:
+        raise SystemExit(f"No draft model in {args.draft_dir}, build one with draft_model.py first")
+
+    main_calls = CallCounter(chatbot.model)
+    draft_calls = CallCounter(draft)
+    for model in (None, draft):
+        run(chatbot, 2, model, main_calls, draft_calls)  # untimed, so first-call setup isn't counted
+    results = [run(chatbot, args.runs, model, main_calls, draft_calls, args.new_tokens) for model in (None, draft)]
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print_table(results)
@@ -0,0 +1,61 @@
+"""Benchmark what tracing adds to each traced call, with tracing off and on.
+
+    python -m benchmarks.tracing
+    python -m benchmarks.tracing --calls 1000000 --json
+"""
+import argparse
+import json
+import time
+
+from tracing import TRACER, traced
+
+
+def plain():
+    pass
+
+
+@traced("benchmark.decorated")
+def decorated():
+    pass
+
+
+def spanned():
+    with TRACER.span("benchmark.span"):
+        pass
+
+
+def time_calls(function, calls):
+    """Return the mean nanoseconds per call of function."""
+    start = time.perf_counter_ns()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter_ns() - start) / calls
+
+
+def run(calls):
+    """Time each way of tracing a call against an untraced one, returns the overhead in ns per call."""
+    results = []
+    for enabled in (False, True):
+        TRACER.enabled = enabled
+        TRACER.clear()
+        base = time_calls(plain, calls)
+        for name, function in (("decorator", decorated), ("span", spanned)):
+            results.append({"tracing": "on" if enabled else "off", "kind": name,
+                            "overhead_ns": round(time_calls(function, calls) - base, 1)})
+    TRACER.enabled = False
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200000)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.calls)
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print(f"{'tracing':>8} {'kind':>10} {'overhead_ns':>12}")
+        for result in results:
+            print(f"{result['tracing']:>8} {result['kind']:>10} {result['overhead_ns']:>12}")
@@ -2,12 +2,20 @@
 import os
 import sys
 import re
-import threading
 import textwrap
 import pygame
-import requests
 from dotenv import load_dotenv
-import pyttsx3
+
+from frame_cache import FrameCache
+from sprite_atlas import ANIMATION_PATTERNS, find_atlas
+from speech import SpeechService
+from chat_client import OPENAI_CHAT_URL, AnimationCommandParser, ChatClient, stream_reply
+from inference_worker import InferenceWorker
+from response_cache import cache_pieces, open_response_cache
+from text_cache import get_font, render_line
+from dirty_rects import DirtyRenderer
+from timeline import BMP_ANIMATION_TIMING, Timeline
+from tracing import TRACER, configure_tracing, traced
 
 # Load API key from .env
 load_dotenv()
@@ -29,6 +37,12 @@ class Settings:
         # Make the window transparent to show desktop
         self.background_color = (0, 0, 0, 0)  # Transparent black
 
+        # Frames drawn per second, animations play at the same speed whatever this is
+        self.frame_rate = 30
+
+        # Only redraw the parts of the window that changed each frame, False redraws everything
+        self.dirty_rects = True
+
         # Color used for colorkey transparency in Bonzi images
         self.color_screen = "#04fcfc"
 
@@ -40,35 +54,93 @@ class Settings:
         self.rate = 225  # words per minute
         self.volume = 1.0  # 0.0 to 1.0
 
+        # OpenAI API connection: timeouts in seconds, retries for rate limits and server errors
+        self.api_connect_timeout = 5
+        self.api_read_timeout = 60
+        self.api_max_retries = 3
+        self.api_backoff = 0.5  # first retry waits up to this long, doubling each time
+        self.api_max_backoff = 30  # longest wait between retries
+        self.api_pool_size = 2  # kept-alive connections
+        # Chat completions endpoint, e.g. a local inference_server.py at http://127.0.0.1:8600/v1/chat/completions
+        self.api_url = OPENAI_CHAT_URL
+
+        # Show the response in the chat bubble and speak it sentence by sentence as it streams in
+        self.stream_responses = True
+
+        # File to remember replies to repeated inputs in, e.g. "response_cache.sqlite3", None turns it off
+        self.response_cache_path = None
+        self.response_cache_max_entries = 256  # inputs kept in memory, the file holds the rest
+        self.response_cache_ttl = 7 * 24 * 60 * 60  # seconds before a reply is forgotten, None keeps it
+        # Different replies to collect per input before the cache answers, picked between at random
+        self.response_cache_variants = 3
+
+        # Folder for cached text-to-speech audio, e.g. "speech_cache", None turns the cache off.
+        # A sentence that isn't cached yet is rendered to a file before it plays, which is slower than
+        # speaking it directly, so it pays off for phrases Bonzi repeats like speech_warmup_phrases.
+        self.speech_cache_dir = None
+        self.speech_cache_max_bytes = 50 * 1024 * 1024
+
+        # Phrases to render into the speech cache at startup so they play instantly
+        self.speech_warmup_phrases = []
+
+        # Memory cap in bytes for decoded animation frames, None keeps every frame loaded
+        self.frame_cache_max_bytes = None
+
+        # Packed sprite atlas built by sprite_atlas.py, loose frame folders are used if it is missing
+        self.atlas_image = "atlas/bonzi_atlas.png"
+        self.atlas_index = "atlas/bonzi_atlas.json"
+
+        # Hot-path timings, see tracing.py. A p50/p95/p99 summary of each stage is printed every
+        # trace_summary_seconds, and trace_file (e.g. "bonzi_trace.json") gets Chrome trace JSON on exit
+        self.trace_enabled = False
+        self.trace_buffer_size = 10000  # spans kept, the oldest are dropped
+        self.trace_summary_seconds = 30  # None turns the printed summary off
+        self.trace_file = None
+
 ### ANIMATIONS ###
 import glob
+
+# Frame globs for each animation, this window only shows the .bmp talking frames.
+BMP_ANIMATION_PATTERNS = dict(ANIMATION_PATTERNS, talking="talking/*.bmp")
+
 class Animation:
     """A class for Bonzi's animations."""
     def __init__(self, bonzi):
         self.bonzi = bonzi
         self.settings = bonzi.settings
-        # Dictionary mapping animation names to sorted list of frame filenames.
-        self.animations = {
-            "idle": sorted(glob.glob("idle/*.bmp")),
-            "arrive": sorted(glob.glob("arrive/*.bmp")),
-            "goodbye": sorted(glob.glob("goodbye/*.bmp")),
-            "backflip": sorted(glob.glob("backflip/*.bmp")),
-            "glasses": sorted(glob.glob("glasses/*.bmp")),
-            "wave": sorted(glob.glob("wave/*.bmp")),
-            "nothing": ["idle/0999.bmp"],
-            "talking": sorted(glob.glob("talking/*.bmp"))
-        }
+        # Use the packed sprite atlas if it has been built, otherwise glob the frame folders.
+        self.atlas = find_atlas(self.settings)
+        if self.atlas is not None:
+            # The atlas holds every talking frame, keep the same ones the loose files give.
+            self.animations = self.atlas.matching(BMP_ANIMATION_PATTERNS)
+        else:
+            # Dictionary mapping animation names to sorted list of frame filenames.
+            self.animations = {name: sorted(glob.glob(pattern)) for name, pattern in BMP_ANIMATION_PATTERNS.items()}
+            self.animations["nothing"] = ["idle/0999.bmp"]
+        # Decoded frames are kept here so the main loop only has to blit them.
+        self.frame_cache = FrameCache(self.settings, self.settings.frame_cache_max_bytes, self.atlas)
 
     def get_animation(self, command):
         """Return the list of frame filenames for the given animation command."""
         return self.animations.get(command)
 
+    def preload_frames(self):
+        """Decode every animation frame once, call after the window has been created."""
+        self.frame_cache.preload(self.animations)
+
+    def get_frame(self, path):
+        """Return the decoded, color keyed image for a frame path."""
+        return self.frame_cache.get(path)
+
 ### CHATBOT USING OPENAI API ###
 class BonziChat:
     """A class for handling the chatbot logic using the OpenAI API via requests."""
     def __init__(self, bonzi):
         self.bonzi = bonzi
         self.api_key = OPENAI_API_KEY
+        # Pooled, kept-alive connection to the API with timeouts and retries.
+        self.client = ChatClient(bonzi.settings, self.api_key, bonzi.settings.api_url)
+        self.model = "o3-mini"
         # The system prompt now includes the list of available animations.
         self.system_prompt = (
             "You are Bonzi Buddy, a friendly desktop assistant. "
@@ -76,36 +148,42 @@ class BonziChat:
             "When you want to trigger an animation, output a command in the format /animation:<animation_name> "
             "with no extra text. Otherwise, provide a normal text response."
         )
-        # Initialize text-to-speech engine.
-        self.engine = pyttsx3.init()
+        # One long-lived text-to-speech engine, it speaks queued sentences on its own thread.
+        self.speech = SpeechService(bonzi.settings)
+        # Replies to repeated inputs, None if turned off in Settings.
+        self.response_cache = open_response_cache(bonzi.settings)
 
-    def get_response(self, user_text):
-        """Get a response from the OpenAI API."""
+    def request_data(self, user_text):
+        """Build the request body for the OpenAI API."""
         messages = [
             {"role": "system", "content": self.system_prompt},
             {"role": "user", "content": user_text}
         ]
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
         # Use the data structure as in the reference documentation.
-        data = {
-            "model": "o3-mini",
+        return {
+            "model": self.model,
             "messages": messages
         }
 
-        try:
-            response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=data)
-            response.raise_for_status()
-        except Exception as e:
-            print("Error calling OpenAI API:", e)
-            # Return the actual error response or exception message.
-            return f"Error calling API: {e}"
-
-        result = response.json()
-        reply = result["choices"][0]["message"]["content"].strip()
+    @traced("api.get_response")
+    def get_response(self, user_text):
+        """Get a response from the OpenAI API."""
+        cache_key = self.cache_key(user_text)
+        reply = self.response_cache.get(cache_key) if cache_key else None
+        if reply is None:
+            try:
+                response = self.client.post(self.request_data(user_text))
+            except Exception as e:
+                print("Error calling OpenAI API:", e)
+                # Return the actual error response or exception message.
+                return f"Error calling API: {e}"
+
+            result = response.json()
+            reply = result["choices"][0]["message"]["content"].strip()
+            # The reply is cached before the animation check, so a cached command still plays.
+            if cache_key:
+                self.response_cache.put(cache_key, reply)
 
         # Look for an animation command in the response
         anim_match = re.search(r"/animation:(\w+)", reply)
@@ -119,19 +197,46 @@ class BonziChat:
             # If no animation command, return the text.
             return reply
 
+    def respond(self, user_text, cancel_event=None):
+        """Get the whole response and queue it for TTS, run by the inference worker when not streaming."""
+        response = self.get_response(user_text)
+        self.text_to_speech(response)
+        return response
+
+    def stream_response(self, user_text, cancel_event=None):
+        """Stream a response from the OpenAI API, yielding text for the chat bubble as it arrives.
+
+        Each finished sentence is queued for TTS straight away, and an /animation: command starts
+        the animation as soon as its name has been written.
+        """
+        parser = AnimationCommandParser(self.bonzi.animations.animations, self.start_animation)
+        cache_key = self.cache_key(user_text)
+        cached = self.response_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            pieces = (piece for piece in [cached])  # the whole reply at once, as a stream
+        else:
+            pieces = self.client.stream(self.request_data(user_text))
+            if cache_key:
+                pieces = cache_pieces(pieces, self.response_cache, cache_key)
+        return stream_reply(pieces, parser, self.speech, self.finish_speaking, cancel_event)
+
+    def cache_key(self, user_text):
+        """Return the response cache key for the user's text, or None if the cache is turned off."""
+        if self.response_cache is None:
+            return None
+        return self.response_cache.key(user_text, {"model": self.model, "system_prompt": self.system_prompt})
+
+    def start_animation(self, animation_name):
+        """Set the current animation in Bonzi, called as soon as the reply asks for one."""
+        self.bonzi.current_animation = animation_name
+
+    @traced("api.text_to_speech")
     def text_to_speech(self, response_text):
-        """Convert the response text into speech."""
-        voices = self.engine.getProperty("voices")
-        # Attempt to set voice to Microsoft David if available.
-        for voice in voices:
-            if "david" in voice.name.lower():
-                self.engine.setProperty("voice", voice.id)
-                break
-        self.engine.setProperty("rate", self.bonzi.settings.rate)
-        self.engine.setProperty("volume", self.bonzi.settings.volume)
-        self.engine.say(response_text)
-        self.engine.runAndWait()
-        # Reset TTS processing flag
+        """Queue the response text to be spoken sentence by sentence."""
+        self.speech.speak(response_text, on_done=self.finish_speaking)
+
+    def finish_speaking(self):
+        """Reset the TTS processing flag once the whole response has been spoken."""
         self.bonzi.input_box.processing_tts = False
 
 ### INPUT BOX ###
@@ -163,6 +268,7 @@ class InputBox:
         self.char_limit = 70
         self.line_char_limit = 35
 
+    @traced("input.handle_event")
     def handle_event(self, event):
         """Process events for the input box."""
         if event.type == pygame.MOUSEBUTTONDOWN:
@@ -179,18 +285,10 @@ class InputBox:
 
         if event.type == pygame.KEYDOWN and self.active:
             if event.key == pygame.K_RETURN:
-                if not self.processing_tts:
+                # Ask the API on the inference worker so the window keeps running, see check_responses().
+                if not self.processing_tts and self.bonzi.inference.submit(self.text):
                     self.processing_tts = True
                     self.bonzi.current_animation = "talking"
-                    # Get response from the API via our BonziChat instance.
-                    response = self.bonzi.chatbot.get_response(self.text)
-                    # Start TTS in a separate thread.
-                    t = threading.Thread(target=self.bonzi.chatbot.text_to_speech, args=(response,))
-                    t.daemon = True
-                    t.start()
-                    # Create chat bubble only if there is response text.
-                    if response:
-                        self.bonzi.chat_bubble = ChatBubble(self.bonzi, response)
                     self.text = ""
             elif event.key == pygame.K_BACKSPACE:
                 self.text = self.text[:-1]
@@ -199,6 +297,10 @@ class InputBox:
                     self.text += event.unicode
             self.txt_surface = self.font.render(self.text, True, self.text_color)
 
+    def draw_state(self):
+        """Return everything that changes how the box looks, so it is only redrawn when this changes."""
+        return self.color, self.text
+
     def draw_box(self):
         """Draw the input box on the screen."""
         self.window.blit(self.background_surface, self.rect)
@@ -251,47 +353,58 @@ class ChatBubble:
     """A class for drawing a chat bubble above Bonzi."""
     def __init__(self, bonzi, text):
         self.bonzi = bonzi
-        self.text = text
-        self.font = pygame.font.Font(None, 24)
-        lines = self.wrap_text(self.text, 20)
-        if lines:
-            self.text_width, self.text_height = self.font.size(max(lines, key=len))
-        else:
-            self.text_width, self.text_height = self.font.size("")
+        # Shared default font, size 24.
+        self.font_size = 24
+        self.font = get_font(self.font_size)
         self.padding = 20
-        self.text_surface = pygame.Surface(
-            (self.text_width + 2 * self.padding, len(lines) * self.text_height + 2 * self.padding),
-            pygame.SRCALPHA
-        )
         # Make chat bubble semi-transparent
         self.bubble_color = (255, 255, 255, 180)
-        self.text_surface.fill((0, 0, 0, 0))
         self.tail_surface = pygame.Surface((20, 20), pygame.SRCALPHA)
         self.tail_surface.fill((0, 0, 0, 0))
         pygame.draw.polygon(self.tail_surface, self.bubble_color, [(10, 0), (0, 20), (20, 20)])
         self.tail_surface = pygame.transform.rotate(self.tail_surface, 180)
+        self.set_text(text)
+
+    def set_text(self, text):
+        """Change the text and draw the whole bubble once onto a cached surface."""
+        self.text = text
+        lines = self.wrap_text(self.text, 20)
+        if lines:
+            self.text_width, self.text_height = self.font.size(max(lines, key=len))
+        else:
+            self.text_width, self.text_height = self.font.size("")
+        self.box_width = self.text_width + 2 * self.padding
+        self.box_height = len(lines) * self.text_height + 2 * self.padding
+
+        # Background, tail and text composited together, so each frame is a single blit.
+        self.bubble_surface = pygame.Surface((self.box_width, self.box_height + self.tail_surface.get_height()),
+                                             pygame.SRCALPHA)
+        pygame.draw.rect(self.bubble_surface, self.bubble_color, (0, 0, self.box_width, self.box_height))
+        # BLEND_RGBA_MAX copies the tail's pixels as they are onto the transparent area.
+        self.bubble_surface.blit(self.tail_surface, (self.box_width // 2 - 10, self.box_height),
+                                 special_flags=pygame.BLEND_RGBA_MAX)
+        for i, line in enumerate(lines):
+            line_surface = render_line(line, self.font_size, (0, 0, 0))
+            self.bubble_surface.blit(line_surface, (self.padding, self.padding + i * self.text_height))
+
+    def append_text(self, piece):
+        """Add streamed text onto the end of the bubble."""
+        self.set_text(self.text + piece)
 
     def wrap_text(self, text, max_width):
         wrapper = textwrap.TextWrapper(width=max_width)
         return wrapper.wrap(text)
 
+    def get_rect(self):
+        """Return where the bubble is drawn in the window, centered above Bonzi."""
+        rect = self.bubble_surface.get_rect()
+        rect.x = self.bonzi.rect.centerx - self.box_width // 2
+        rect.y = self.bonzi.rect.y - self.box_height - 180
+        return rect
+
     def draw_bubble(self):
         """Draw the chat bubble and tail above Bonzi."""
-        lines = self.wrap_text(self.text, 20)
-        for i, line in enumerate(lines):
-            line_surface = self.font.render(line, True, (0, 0, 0))
-            self.text_surface.blit(line_surface, (self.padding, self.padding + i * self.text_height))
-        bubble_x = self.bonzi.rect.centerx - self.text_surface.get_width() // 2
-        bubble_y = self.bonzi.rect.y - self.text_surface.get_height() - 180
-        
-        # Create a semi-transparent surface for the bubble background
-        bubble_surface = pygame.Surface((self.text_surface.get_width(), self.text_surface.get_height()), pygame.SRCALPHA)
-        pygame.draw.rect(bubble_surface, self.bubble_color, bubble_surface.get_rect())
-        
-        # Blit the background, tail, and text
-        self.bonzi.window.blit(bubble_surface, (bubble_x, bubble_y))
-        self.bonzi.window.blit(self.tail_surface, (bubble_x + self.text_surface.get_width() // 2 - 10, bubble_y + self.text_surface.get_height()))
-        self.bonzi.window.blit(self.text_surface, (bubble_x, bubble_y))
+        self.bonzi.window.blit(self.bubble_surface, self.get_rect())
 
 ### MAIN BONZI CLASS ###
 class Bonzi:
@@ -299,21 +412,29 @@ class Bonzi:
     def __init__(self):
         pygame.init()
         self.settings = Settings()
+        configure_tracing(self.settings)
         # Set window to be transparent and borderless
         self.window = pygame.display.set_mode((self.settings.window_width, self.settings.window_height), pygame.NOFRAME | pygame.SRCALPHA)
         pygame.display.set_caption(self.settings.window_title)
         # Make the window transparent
         self.background_color = self.settings.background_color
+        # Only the parts of the window that changed are redrawn each frame.
+        self.renderer = DirtyRenderer(self.window, self.background_color, self.settings.dirty_rects)
 
         self.running = True
         self.shutting_down = False
         self.startup = True
         self.clock = pygame.time.Clock()
-        self.current_frame = 0
+        # Animations play by elapsed time, so the frame rate doesn't change their speed.
+        self.timeline = Timeline(BMP_ANIMATION_TIMING)
 
         # Initialize animations, chatbot (using OpenAI API), input box, buttons.
         self.animations = Animation(self)
+        self.animations.preload_frames()
         self.chatbot = BonziChat(self)
+        # The API is called on a background thread so the window keeps drawing while Bonzi thinks.
+        respond = self.chatbot.stream_response if self.settings.stream_responses else self.chatbot.respond
+        self.inference = InferenceWorker(respond)
         self.input_box = InputBox(self, 10, 10, self.settings.input_box_width, self.settings.input_box_height)
         button_messages = ["Say Hello", "Do a Trick", "Be Cool"]
         self.buttons = [Button(self, msg) for msg in button_messages]
@@ -323,6 +444,8 @@ class Bonzi:
         # current_animation is None unless explicitly set (by API call or button click).
         self.current_animation = None
         self.chat_bubble = None
+        self.frame_path = None
+        self.image = None
         self.rect = None
         self.last_interaction = pygame.time.get_ticks()
 
@@ -330,20 +453,45 @@ class Bonzi:
         """Main loop for the BonziBUDDY application."""
         while self.running:
             self.check_events()
+            self.check_responses()
             self.update_screen()
-            self.clock.tick(8)
+            TRACER.report_if_due()
+            self.clock.tick(self.settings.frame_rate)
+
+    def check_responses(self):
+        """Show any response text the inference worker has produced."""
+        for kind, text in self.inference.poll():
+            if kind == "start":
+                self.chat_bubble = None
+            elif kind == "piece":
+                if self.chat_bubble:
+                    self.chat_bubble.append_text(text)
+                else:
+                    self.chat_bubble = ChatBubble(self, text)
+            elif text is None:
+                # The chatbot failed, stop talking so another response can be asked for.
+                self.input_box.processing_tts = False
+            elif text:
+                # Create chat bubble only if there is response text.
+                if self.chat_bubble:
+                    self.chat_bubble.set_text(text)
+                else:
+                    self.chat_bubble = ChatBubble(self, text)
 
+    @traced("frame.update_screen")
     def update_screen(self):
         """Update the screen with the current state."""
-        # Fill with transparent background
-        self.window.fill((0, 0, 0, 0))
         self.draw_bonzi()
-        self.input_box.draw_box()
+        # Layers as (name, rect, state, draw) in drawing order, the renderer fills changed areas
+        # with the transparent background and redraws only the layers there.
+        layers = [("bonzi", self.rect, self.frame_path, self.blit_bonzi),
+                  ("input_box", self.input_box.rect, self.input_box.draw_state(), self.input_box.draw_box)]
         for button in self.buttons:
-            button.draw_button()
+            layers.append((button.msg, button.rect, None, button.draw_button))
         if self.chat_bubble:
-            self.chat_bubble.draw_bubble()
-        pygame.display.flip()
+            layers.append(("chat_bubble", self.chat_bubble.get_rect(), self.chat_bubble.text,
+                           self.chat_bubble.draw_bubble))
+        self.renderer.draw(layers)
 
     def check_events(self):
         """Check for and process events."""
@@ -351,12 +499,15 @@ class Bonzi:
             if event.type == pygame.QUIT:
                 self.startup = False
                 self.shutting_down = True
-                self.current_frame = 0
+                self.timeline.stop()
                 self.current_animation = "goodbye"
             if event.type == pygame.MOUSEBUTTONDOWN:
                 mouse_pos = pygame.mouse.get_pos()
                 self.check_button_click(mouse_pos)
                 self.last_interaction = pygame.time.get_ticks()
+            # The window's contents were lost, so draw everything again.
+            if event.type == pygame.VIDEOEXPOSE:
+                self.renderer.invalidate()
             self.input_box.handle_event(event)
 
     def check_button_click(self, mouse_pos):
@@ -370,28 +521,31 @@ class Bonzi:
                         self.current_animation = "backflip"
                     elif button.msg == "Be Cool":
                         self.current_animation = "glasses"
-                    self.current_frame = 0
+                    self.timeline.stop()
 
     def draw_bonzi(self):
         """Determine and execute the appropriate animation."""
         if self.startup:
-            frames = self.animations.get_animation("arrive")
+            name = "arrive"
         # If an API call or button has set an animation (and it isn't 'idle'),
         # use that animation to override the idle animation.
         elif self.current_animation and self.current_animation != "idle":
-            frames = self.animations.get_animation(self.current_animation)
+            name = self.current_animation
         # If there has been no interaction for a while, default to idle.
         elif pygame.time.get_ticks() - self.last_interaction > 9000:
-            frames = self.animations.get_animation("idle")
+            name = "idle"
             self.current_animation = "idle"
         else:
-            frames = self.animations.get_animation("nothing")
-        self.execute_animation(frames)
-
-    def execute_animation(self, frames):
-        """Cycle through frames of the given animation."""
-        if self.current_frame >= len(frames):
-            self.current_frame = 0
+            name = "nothing"
+        self.execute_animation(name)
+
+    def execute_animation(self, name):
+        """Show the frame of the given animation that is due now."""
+        if self.timeline.name != name:
+            self.timeline.play(name, self.animations.get_animation(name))
+        # For talking animation, loop until TTS is complete.
+        frame = self.timeline.update(looping=self.input_box.processing_tts)
+        if frame is None:
             if self.shutting_down:
                 sys.exit()
             if self.startup:
@@ -404,23 +558,18 @@ class Bonzi:
             if self.current_animation == "idle":
                 self.last_interaction = pygame.time.get_ticks()
         else:
-            frame = frames[self.current_frame]
             self.load_bonzi_image(frame)
-            # For talking animation, loop until TTS is complete.
-            if self.input_box.processing_tts:
-                if "0040.bmp" in frame:
-                    self.current_frame -= 5
-                else:
-                    self.current_frame += 1
-            else:
-                self.current_frame += 1
 
+    @traced("frame.load_image")
     def load_bonzi_image(self, image_path):
-        """Load and display the current Bonzi image frame."""
-        image = pygame.image.load(image_path)
-        image.set_colorkey(self.settings.color_screen)
-        self.rect = image.get_rect(center=(self.settings.window_width // 2, self.settings.window_height // 1.4))
-        self.window.blit(image, self.rect)
+        """Set the current Bonzi image frame from the frame cache, blit_bonzi() draws it."""
+        self.frame_path = image_path
+        self.image = self.animations.get_frame(image_path)
+        self.rect = self.image.get_rect(center=(self.settings.window_width // 2, self.settings.window_height // 1.4))
+
+    def blit_bonzi(self):
+        """Blit the current Bonzi image frame to the window."""
+        self.window.blit(self.image, self.rect)
 
 if __name__ == '__main__':
     print("Welcome to BonziBUDDY! The program may take a moment to load.")
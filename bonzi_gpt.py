@@ -1,136 +1,377 @@
-from transformers import GPT2LMHeadModel, GPT2Tokenizer, Trainer, TrainingArguments, DataCollatorForLanguageModeling
-from datasets import load_dataset
+# Only the pieces needed to run the model, the training stack is imported in fine_tune_gpt()
+from transformers import (GPT2LMHeadModel, GPT2Tokenizer, StoppingCriteria, StoppingCriteriaList,
+                          TextIteratorStreamer)
+import itertools
 import os
-import pyttsx3
 import threading
+import torch
 
+from conversation import ConversationSession
+from cpu_inference import (INFERENCE_BACKENDS, INFERENCE_MODES, set_thread_count, bf16_supported, quantize_int8,
+                           load_quantized, save_quantized, newest_change)
+from draft_model import load_draft_model
+from onnx_backend import load_onnx_backend
+from persona import PersonaPrefix
+from response_cache import open_response_cache
+from speech import SentenceSplitter, SpeechService
+from tracing import TRACER, traced
 
-class BonziGPT:
-    """A class for creating Bonzi's GPT-2 AI chatbot."""
-    def __init__(self, bonzi, text_file, output_dir="bonzi_model"):
-        """Initialize the GPT-2 model and tokenizer."""
-        self.bonzi = bonzi
-        self.settings = bonzi.settings
 
-        # Check if the model has already been trained
-        if os.path.exists(output_dir):
-            self.model = GPT2LMHeadModel.from_pretrained(output_dir)
-        else:
-            self.model = GPT2LMHeadModel.from_pretrained("gpt2")
+class CancelCriteria(StoppingCriteria):
+    """Stops generation early once a cancel event has been set."""
+    def __init__(self, cancel_event):
+        self.cancel_event = cancel_event
 
-        self.tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
-        self.tokenizer.pad_token = self.tokenizer.eos_token
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.cancel_event.is_set()
 
-        # Train the model if it hasn't been trained
-        if not os.path.exists(output_dir):
-            self.fine_tune_gpt(text_file, output_dir)
 
-        # Initialize the text-to-speech thread and engine
-        self.tts_thread = None
-        self.engine = pyttsx3.init()
+class TorchBackend:
+    """Runs GPT-2 with PyTorch. OnnxBackend in onnx_backend.py has the same methods for ONNX Runtime."""
+    def __init__(self, model):
+        self.model = model
+        self.n_positions = model.config.n_positions
 
-    def get_response(self, text):
-        """Get a response from Bonzi's GPT-2 chatbot after processing the input text."""
-        # Convert the input text to tokenizer format
-        user_input = self.tokenizer.encode(text, return_tensors="pt")
+    def cache_key(self):
+        """Return what a cache built by this backend depends on."""
+        return ("pytorch", id(self.model), self.model.dtype)
 
-        attention_mask = user_input.ne(self.tokenizer.pad_token_id).float()  # model won't focus on padding tokens
+    def prefill(self, tokens):
+        """Return the key/value cache for a list of token ids."""
+        with torch.inference_mode():
+            return self.model(torch.tensor([tokens]), use_cache=True).past_key_values
 
-        temperature = min(1.0, max(0.7, len(text) / 100))  # dynamic temperature based on input length, min 0.7, max 1.0
+    def generate(self, **kwargs):
+        # inference_mode() skips autograd bookkeeping while generating
+        with torch.inference_mode():
+            return self.model.generate(**kwargs)
 
-        bonzi_output = self.model.generate(user_input,
-                                           max_length=60,
-                                           num_return_sequences=1,
-                                           do_sample=True,  # choose words on probability, causing more diversity
-                                           temperature=temperature,  # randomness of output, 1 = maximum, 0 = minimum
-                                           top_p=0.9,  # cumulative probability of the most likely tokens, more natural
-                                           attention_mask=attention_mask,
-                                           pad_token_id=self.tokenizer.eos_token_id)
 
-        response = self.tokenizer.decode(bonzi_output[0], skip_special_tokens=True)
+class BonziGPT:
+    """A class for creating Bonzi's GPT-2 AI chatbot."""
+    def __init__(self, bonzi, text_file, output_dir="bonzi_model", speak=True):
+        """Initialize the GPT-2 model and tokenizer, speak=False skips text-to-speech for the inference server."""
+        self.bonzi = bonzi
+        self.settings = bonzi.settings
 
-        # Start a thread to convert the response to speech while the main program continues
-        self.tts_thread = threading.Thread(target=self.text_to_speech, args=(response,))  # use function and argument
-        self.tts_thread.daemon = True  # thread will close when the main program closes
-        self.tts_thread.start()
+        # CPU inference options from Settings, see cpu_inference.py
+        if self.settings.inference_mode not in INFERENCE_MODES:
+            raise ValueError(f"Unknown inference mode {self.settings.inference_mode!r}, expected one of {INFERENCE_MODES}")
+        if self.settings.inference_backend not in INFERENCE_BACKENDS:
+            raise ValueError(f"Unknown inference backend {self.settings.inference_backend!r}, "
+                             f"expected one of {INFERENCE_BACKENDS}")
+        set_thread_count(self.settings.inference_threads)
 
-        return response
+        self.tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
+        self.tokenizer.pad_token = self.tokenizer.eos_token
 
-    def text_to_speech(self, response):
-        """Convert the AI's response into speech."""
+        # An exported ONNX model runs without loading the PyTorch one at all, see onnx_backend.py
+        self.backend = None
+        if self.settings.inference_backend == "onnx":
+            self.backend = load_onnx_backend(self.settings, output_dir)
+
+        self.model = None
+        if self.backend is None:
+            self.load_model(text_file, output_dir)
+            self.backend = TorchBackend(self.model)
+
+        # Smaller model that guesses a few tokens ahead for this one to check, see draft_model.py.
+        # Assisted generation is part of PyTorch's generate(), so the ONNX backend runs without it.
+        self.draft_model = None
+        if self.model is not None:
+            self.draft_model = load_draft_model(self.settings.draft_model_dir, self.settings.inference_mode)
+        if self.draft_model is not None:
+            self.draft_model.generation_config.num_assistant_tokens = self.settings.draft_tokens
+
+        # One text-to-speech engine for the whole program, it speaks on its own thread
+        self.speech = SpeechService(self.settings) if speak else None
+
+        # Generation settings, also part of the response cache key so changing them skips old replies
+        self.max_length = 60
+        self.top_p = 0.9
+        self.response_cache = open_response_cache(self.settings)
+        # Replies are stored without the input text they start with, reply_only keeps older entries out
+        self.cache_settings = {"model": output_dir, "trained": newest_change(output_dir),
+                               "inference_mode": self.settings.inference_mode,
+                               "max_length": self.max_length, "top_p": self.top_p, "reply_only": True}
+
+        # Persona text put before every prompt, its key/value cache is built once here instead of every request
+        self.persona = None
+        if self.settings.persona_file or self.settings.persona_prompt:
+            self.persona = PersonaPrefix(self.tokenizer, self.settings.persona_prompt, self.settings.persona_file,
+                                         self.settings.persona_max_tokens)
+            self.persona.load(self.backend)
+
+        # Earlier turns of the conversation, fed back to GPT-2 through its key/value cache
+        self.conversation = None
+        if self.settings.conversation_memory:
+            self.conversation = ConversationSession(self.tokenizer, self.backend.n_positions, self.max_length)
+
+    def load_model(self, text_file, output_dir):
+        """Load the PyTorch model, training it first if it hasn't been trained."""
+        # A saved int8 model loads directly, without the float32 weights
+        if self.settings.inference_mode == "int8":
+            self.model = load_quantized(self.settings.quantized_model_path, output_dir)
+        loaded_quantized = self.model is not None
 
-        # Get list of voices
-        voices = self.engine.getProperty("voices")
+        # Check if the model has already been trained
+        if self.model is None:
+            if os.path.exists(output_dir):
+                self.model = GPT2LMHeadModel.from_pretrained(output_dir)
+            else:
+                self.model = GPT2LMHeadModel.from_pretrained("gpt2")
 
-        # Set the voice to Microsoft David
-        for voice in voices:
-            if "david" in voice.name.lower():
-                self.engine.setProperty("voice", voice.id)
-                break
+        # Train the model if it hasn't been trained
+        if not os.path.exists(output_dir):
+            self.fine_tune_gpt(text_file, output_dir)
 
-        # Set the rate and volume
-        self.engine.setProperty("rate", self.bonzi.settings.rate)  # words per minute
-        self.engine.setProperty("volume", self.bonzi.settings.volume)  # volume level 0.0 to 1.0
+        self.optimize_model(loaded_quantized)
+
+    def optimize_model(self, loaded_quantized=False):
+        """Put the model in the inference mode picked in Settings."""
+        mode = self.settings.inference_mode
+
+        if mode == "int8" and not loaded_quantized:
+            self.model = quantize_int8(self.model)
+            save_quantized(self.model, self.settings.quantized_model_path)
+        elif mode == "bf16":
+            if bf16_supported():
+                self.model = self.model.to(torch.bfloat16)
+            else:
+                print("This CPU has no native bf16 support, running the model in float32 instead.")
+
+        # Turn off dropout
+        self.model.eval()
+
+    @traced("gpt.get_response")
+    def get_response(self, text, cancel_event=None):
+        """Get a response from Bonzi's GPT-2 chatbot after processing the input text.
+
+        If cancel_event is given and gets set, generation stops early and None is returned.
+        """
+        cache_key = self.cache_key(text)
+        cached = self.cached_response(cache_key, text)
+        if cached is not None:
+            if self.conversation is not None:
+                self.conversation.add_turn(cached)
+            self.text_to_speech(cached)
+            return cached
+
+        with TRACER.span("gpt.tokenize"):
+            kwargs = self.generation_kwargs(text, cancel_event)
+        with TRACER.span("gpt.generate"):
+            bonzi_output = self.backend.generate(**kwargs)
+
+        if cancel_event and cancel_event.is_set():
+            if self.conversation is not None:
+                self.conversation.cancel_turn()
+            return None
+
+        with TRACER.span("gpt.decode"):
+            if self.conversation is not None:
+                response = self.conversation.finish_turn(bonzi_output)
+            else:
+                # The persona is part of the output too, but not of the response
+                start = len(self.persona.tokens) if self.persona is not None else 0
+                response = self.tokenizer.decode(bonzi_output[0][start:], skip_special_tokens=True)
+
+        self.cache_response(cache_key, text, response)
+
+        # Convert the response to speech while the main program continues
+        self.text_to_speech(response)
 
-        # Convert the text to speech
-        self.engine.say(response)
+        return response
 
-        # Use runAndWait(), it is in a thread, so it shouldn't block the main program
-        self.engine.runAndWait()
+    def stream_response(self, text, cancel_event=None):
+        """Yield Bonzi's response in decoded pieces as GPT-2 generates each token.
+
+        The pieces join up into the same text get_response() would return.
+        """
+        cache_key = self.cache_key(text)
+        cached = self.cached_response(cache_key, text)
+        if cached is not None:
+            # Nothing to wait for, so the whole response comes as one piece
+            if self.conversation is not None:
+                self.conversation.add_turn(cached)
+            yield cached
+            self.text_to_speech(cached)
+            return
+
+        # The streamer hands decoded text from the generating thread to this generator. With conversation
+        # memory or a persona the prompt is more than the input text, so only the input text is shown from it.
+        skip_prompt = self.conversation is not None or self.persona is not None
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=skip_prompt, skip_special_tokens=True)
+        with TRACER.span("gpt.tokenize"):
+            kwargs = self.generation_kwargs(text, cancel_event)
+        result = {}
+
+        def generate():
+            try:
+                with TRACER.span("gpt.generate"):
+                    result["output"] = self.backend.generate(**kwargs, streamer=streamer)
+            except Exception as e:
+                print("Error generating response:", e)
+                streamer.end()  # stop the loop below from waiting forever
+
+        generate_thread = threading.Thread(target=generate, daemon=True)
+        generate_thread.start()
+
+        # Speak each sentence as soon as it is finished instead of waiting for the whole response
+        splitter = SentenceSplitter()
+        pieces = []
+        for piece in itertools.chain([text] if skip_prompt else [], streamer):
+            if piece:
+                pieces.append(piece)
+                yield piece
+                if cancel_event is not None and cancel_event.is_set():
+                    continue  # a newer message has cut Bonzi off, nothing more should be spoken
+                for sentence in splitter.feed(piece):
+                    self.speech.put(sentence)
+        generate_thread.join()
+
+        cancelled = cancel_event is not None and cancel_event.is_set()
+        if self.conversation is not None:
+            if cancelled or "output" not in result:
+                self.conversation.cancel_turn()
+            else:
+                self.conversation.finish_turn(result["output"])
+
+        if cancelled:
+            return
+
+        self.cache_response(cache_key, text, "".join(pieces))
+
+        for sentence in splitter.flush():
+            self.speech.put(sentence)
+        self.speech.end(self.finish_speaking)
+
+    def cache_key(self, text):
+        """Return the response cache key for the input text, or None if the cache shouldn't be used.
+
+        A reply depends on everything said before it, so with conversation memory the cache is only
+        used for the first message.
+        """
+        if self.response_cache is None:
+            return None
+        if self.conversation is not None and self.conversation.turns:
+            return None
+        if self.persona is not None:
+            return self.response_cache.key(text, dict(self.cache_settings, persona=self.persona.fingerprint()))
+        return self.response_cache.key(text, self.cache_settings)
+
+    def cached_response(self, cache_key, text):
+        """Return a cached response to the input text, or None if it has to be generated."""
+        cached = self.response_cache.get(cache_key) if cache_key else None
+        if cached is None:
+            return None
+        # GPT-2's response starts with the input, put back this time's text rather than the cached one's
+        return text + cached
+
+    def cache_response(self, cache_key, text, response):
+        """Remember a generated response without the input text it starts with."""
+        if cache_key and response.startswith(text):
+            self.response_cache.put(cache_key, response[len(text):])
+
+    def generation_kwargs(self, text, cancel_event=None):
+        """Build the keyword arguments for model.generate() from the input text."""
+        prefix_tokens = self.persona.load(self.backend) if self.persona is not None else []
+
+        if self.conversation is not None:
+            # Only the new text is encoded, the earlier turns come from the conversation's cache
+            kwargs = self.conversation.start_turn(text, prefix_tokens,
+                                                   self.persona.cache if self.persona is not None else None)
+        elif prefix_tokens:
+            # Only the new text is encoded, the persona comes from its cache
+            user_input = self.tokenizer.encode(text)
+            inputs = torch.tensor([prefix_tokens + user_input])
+            kwargs = dict(inputs=inputs,
+                          attention_mask=torch.ones_like(inputs),
+                          past_key_values=self.persona.cache(),
+                          max_new_tokens=max(1, self.max_length - len(user_input)))  # the persona isn't counted
+        else:
+            # Convert the input text to tokenizer format
+            user_input = self.tokenizer.encode(text, return_tensors="pt")
+
+            attention_mask = user_input.ne(self.tokenizer.pad_token_id).float()  # model won't focus on padding tokens
+
+            kwargs = dict(inputs=user_input, max_length=self.max_length, attention_mask=attention_mask)
+
+        temperature = self.temperature_for(text)
+
+        # Lets the inference worker stop a generation that is no longer wanted
+        stopping_criteria = StoppingCriteriaList([CancelCriteria(cancel_event)]) if cancel_event else None
+
+        # The draft model's guesses are accepted or resampled so replies are sampled the same as without it
+        if self.draft_model is not None:
+            kwargs["assistant_model"] = self.draft_model
+
+        return dict(kwargs,
+                    num_return_sequences=1,
+                    do_sample=True,  # choose words on probability, causing more diversity
+                    temperature=temperature,  # randomness of output, 1 = maximum, 0 = minimum
+                    top_p=self.top_p,  # cumulative probability of the most likely tokens, more natural
+                    pad_token_id=self.tokenizer.eos_token_id,
+                    stopping_criteria=stopping_criteria)
+
+    def temperature_for(self, text):
+        """Dynamic temperature based on input length, min 0.7, max 1.0."""
+        return min(1.0, max(0.7, len(text) / 100))
+
+    @traced("gpt.generate_batch")
+    def generate_batch(self, texts, temperature):
+        """Generate responses for several input texts in one padded generate() call, used by the inference server.
+
+        Texts are padded on the left so each one's new tokens follow straight on from it. Each text gets
+        the same number of new tokens as it would on its own, max_length less its length: the batch runs
+        for the largest of these and each response is cut back to its own, so a response doesn't depend
+        on which other texts shared its batch. A persona is encoded again for every batch, its cache
+        only has room for one text. The draft model isn't used here, transformers only runs assisted
+        generation one text at a time.
+        """
+        prefix_tokens = self.persona.load(self.backend) if self.persona is not None else []
+        rows = [prefix_tokens + self.tokenizer.encode(text) for text in texts]
+        width = max(len(row) for row in rows)
+        input_ids = torch.tensor([[self.tokenizer.pad_token_id] * (width - len(row)) + row for row in rows])
+        attention_mask = torch.tensor([[0] * (width - len(row)) + [1] * len(row) for row in rows])
+
+        # New tokens each text gets on its own, see generation_kwargs(), neither the padding nor the persona counts
+        budgets = [max(1, self.max_length - (len(row) - len(prefix_tokens))) for row in rows]
+
+        outputs = self.backend.generate(inputs=input_ids,
+                                        attention_mask=attention_mask,
+                                        max_new_tokens=max(budgets),
+                                        do_sample=True,
+                                        temperature=temperature,
+                                        top_p=self.top_p,
+                                        pad_token_id=self.tokenizer.eos_token_id)
+
+        # Padding and the persona come before each text, the rest is the text and its response
+        return [self.tokenizer.decode(output[width - len(row) + len(prefix_tokens):width + budget],
+                                      skip_special_tokens=True)
+                for output, row, budget in zip(outputs, rows, budgets)]
+
+    @traced("gpt.text_to_speech")
+    def text_to_speech(self, response):
+        """Queue the AI's response to be spoken sentence by sentence while the main program continues."""
+        self.speech.speak(response, on_done=self.finish_speaking)
 
+    def finish_speaking(self):
+        """Clean up once Bonzi has said his whole response."""
         # Remove the chat bubble once TTS finishes.
         self.bonzi.chat_bubble = None
 
         # Set processing_tts to False and allow another response
         self.bonzi.input_box.processing_tts = False
 
+        # A response queued behind this one can start now
+        self.bonzi.inference.speech_finished()
+
     def fine_tune_gpt(self, text_file, output_dir="./"):
         """Train the GPT-2 model on a text file."""
-        tokenizer = self.tokenizer
-        model = self.model
-
-        # Prepare the dataset
-        dataset = load_dataset("text", data_files=text_file)
-        tokenized_dataset = dataset.map(lambda examples:
-                                        {"input_ids": [tokenizer(text)["input_ids"]
-                                         for text in examples["text"] if text.strip() != ""]},
-                                        batched=True,
-                                        remove_columns=["text"],
-                                        )
-
-        # Take out the None values
-        tokenized_dataset = tokenized_dataset.filter(lambda x: x is not None)
-
-        # Put data in format for language modeling
-        data_collator = DataCollatorForLanguageModeling(
-            tokenizer=tokenizer,
-            mlm=False,  # Not using masked language modeling
-        )
-
-        # Training arguments
-        training_args = TrainingArguments(
-            output_dir=output_dir,  # output directory
-            overwrite_output_dir=True,  # overwrite the content of the output directory
-            num_train_epochs=2,  # number of training epochs, or number of times the model will see the dataset
-            per_device_train_batch_size=1,  # batch size for training, number of samples per forward/backward pass
-            save_steps=10_000,  # number of steps before saving
-            save_total_limit=2,  # limit the number of checkpoints, or saved models
-            learning_rate=5e-5,  # standard learning rate to optimize the model
-        )
-
-        # Create the trainer using the model, training arguments, data collator, and dataset.
-        trainer = Trainer(
-            model=model,
-            args=training_args,
-            data_collator=data_collator,
-            train_dataset=tokenized_dataset["train"],
-        )
-
-        # Call the training method
-        trainer.train()
-
-        # Save the model
-        trainer.save_model(output_dir)
+        # Training is rare, so its imports are kept out of every normal launch
+        from training_data import train_model
+
+        train_model(self.model, self.tokenizer, text_file, output_dir, self.settings)
 
 
 
@@ -1,6 +1,7 @@
 import pygame
 import textwrap
 from chatbubble import ChatBubble
+from tracing import traced
 
 
 class InputBox:
@@ -21,6 +22,9 @@ class InputBox:
         self.active = False
         self.processing_tts = False
 
+        # Shown instead of the text until the chatbot has loaded, None once it is ready
+        self.loading_message = "Loading Bonzi's brain..."
+
         # Align with middle bottom of window, space by 10 pixels
         self.rect.midbottom = self.window_rect.midbottom
         self.rect.y -= 10
@@ -31,6 +35,7 @@ class InputBox:
         # Set line character limit
         self.line_char_limit = 35
 
+    @traced("input.handle_event")
     def handle_event(self, event):
         """Handle events for the input box."""
         if event.type == pygame.MOUSEBUTTONDOWN:
@@ -54,13 +59,20 @@ class InputBox:
         if event.type == pygame.KEYDOWN:
             if self.active:
                 if event.key == pygame.K_RETURN:
-                    # Only start a response if the TTS engine is finished
-                    if not self.processing_tts:
-                        self.processing_tts = True
-                        self.bonzi.current_animation = "talking"
-                        response = self.bonzi.chatbot.get_response(self.text)
-                        self.bonzi.chat_bubble = ChatBubble(self, str(response))
-                        self.text = ""
+                    # Nothing can answer until the chatbot has loaded
+                    # With the "drop" policy, only start a response if the TTS engine is finished
+                    if self.loading_message is None and \
+                            (not self.processing_tts or self.settings.inference_busy_policy != "drop"):
+                        # Generate on the inference worker so the window keeps running, see show_response()
+                        if self.bonzi.inference.submit(self.text):
+                            # With the "cancel" policy, a new message cuts Bonzi off mid-sentence. submit() has
+                            # already cancelled the old response, so it can't queue more speech after this
+                            if self.settings.inference_busy_policy == "cancel":
+                                self.bonzi.chatbot.speech.cancel()
+
+                            self.processing_tts = True
+                            self.bonzi.current_animation = "talking"
+                            self.text = ""
                 elif event.key == pygame.K_BACKSPACE:
                     self.text = self.text[:-1]
                 else:
@@ -75,11 +87,45 @@ class InputBox:
         # Draw the box
         pygame.draw.rect(self.window, self.color, self.rect)
 
+        text = self.shown_text()
+
         # Wrap the text
-        wrapped_text = textwrap.fill(self.text, self.line_char_limit)
+        wrapped_text = textwrap.fill(text, self.line_char_limit)
 
         # Draw the text onto the box with a spacer
         lines = wrapped_text.split('\n')
         for i, line in enumerate(lines):
             self.window.blit(self.font.render(line, True, self.text_color),
                              (self.rect.x + 5, self.rect.y + 5 + i * 32))
+
+    def shown_text(self):
+        """Return the text in the box, the loading message shows while the chatbot loads unless the user is typing."""
+        return self.text if self.active or self.loading_message is None else self.loading_message
+
+    def draw_state(self):
+        """Return everything that changes how the box looks, so it is only redrawn when this changes."""
+        return self.color, self.shown_text()
+
+    def set_loading(self, message):
+        """Show a loading message in the box, None means the chatbot is ready for input."""
+        self.loading_message = message
+
+    def show_response(self, response):
+        """Show a finished response from the inference worker in a chat bubble."""
+        # The chatbot failed, stop talking so another response can be asked for
+        if response is None:
+            self.processing_tts = False
+            return
+
+        # A streamed response already has a bubble, just make sure it holds the full text
+        if self.bonzi.chat_bubble:
+            self.bonzi.chat_bubble.set_text(str(response))
+        else:
+            self.bonzi.chat_bubble = ChatBubble(self, str(response))
+
+    def show_piece(self, piece):
+        """Add a streamed piece of the response to the chat bubble, creating it on the first piece."""
+        if self.bonzi.chat_bubble:
+            self.bonzi.chat_bubble.append_text(piece)
+        else:
+            self.bonzi.chat_bubble = ChatBubble(self, piece)
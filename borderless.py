@@ -5,15 +5,19 @@ import glob
 import re
 import threading
 import textwrap
-import requests
 from dotenv import load_dotenv
-import pyttsx3
 
-from PyQt5.QtCore import Qt, QTimer, QPoint
-from PyQt5.QtGui import QPixmap, QPainter, QColor, QFont
+from PyQt5.QtCore import Qt, QTimer, QPoint, pyqtSignal
+from PyQt5.QtGui import QPixmap, QPainter, QColor, QFont, QImage, QBitmap
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QLabel, 
                              QLineEdit, QPushButton, QHBoxLayout, QVBoxLayout)
 
+from speech import SpeechService
+from chat_client import OPENAI_CHAT_URL, AnimationCommandParser, ChatClient, stream_reply
+from timeline import BMP_ANIMATION_TIMING, Timeline
+from response_cache import cache_pieces, open_response_cache
+from tracing import configure_tracing, traced
+
 # Load API key from .env
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -28,9 +32,40 @@ class Settings:
         self.window_height = 500
         self.background_color = QColor(0, 0, 0, 0)  # fully transparent
         self.color_screen = "#04fcfc"  # color key if needed
+        # Frames drawn per second, animations play at the same speed whatever this is
+        self.frame_rate = 30
         # Voice settings for TTS
         self.rate = 225  
         self.volume = 1.0  
+        # OpenAI API connection: timeouts in seconds, retries for rate limits and server errors
+        self.api_connect_timeout = 5
+        self.api_read_timeout = 60
+        self.api_max_retries = 3
+        self.api_backoff = 0.5  # first retry waits up to this long, doubling each time
+        self.api_max_backoff = 30  # longest wait between retries
+        self.api_pool_size = 2  # kept-alive connections
+        # Chat completions endpoint, e.g. a local inference_server.py at http://127.0.0.1:8600/v1/chat/completions
+        self.api_url = OPENAI_CHAT_URL
+        # Show the response in the chat bubble and speak it sentence by sentence as it streams in
+        self.stream_responses = True
+        # File to remember replies to repeated inputs in, e.g. "response_cache.sqlite3", None turns it off
+        self.response_cache_path = None
+        self.response_cache_max_entries = 256  # inputs kept in memory, the file holds the rest
+        self.response_cache_ttl = 7 * 24 * 60 * 60  # seconds before a reply is forgotten, None keeps it
+        # Different replies to collect per input before the cache answers, picked between at random
+        self.response_cache_variants = 3
+        # Folder for cached text-to-speech audio, e.g. "speech_cache", None turns the cache off.
+        # A sentence that isn't cached yet is rendered to a file before it plays, which is slower than
+        # speaking it directly, so it pays off for phrases Bonzi repeats like speech_warmup_phrases.
+        self.speech_cache_dir = None
+        self.speech_cache_max_bytes = 50 * 1024 * 1024
+        # Phrases to render into the speech cache at startup so they play instantly
+        self.speech_warmup_phrases = []
+        # Hot-path timings, see tracing.py, trace_file (e.g. "bonzi_trace.json") gets Chrome trace JSON on exit
+        self.trace_enabled = False
+        self.trace_buffer_size = 10000  # spans kept, the oldest are dropped
+        self.trace_summary_seconds = None  # this window has no main loop to print a summary from
+        self.trace_file = None
 
 ### ANIMATIONS ###
 class Animation:
@@ -48,71 +83,129 @@ class Animation:
             "nothing": ["idle/0999.bmp"]
         }
 
+        # Frame path -> decoded QPixmap with the color key already masked out
+        self.pixmaps = {}
+
     def get_animation(self, command):
         """Return list of frame file paths for a given animation."""
         return self.animations.get(command, self.animations["idle"])
 
+    def preload_pixmaps(self, color_key):
+        """Decode every frame once, needs the QApplication to exist already."""
+        for frames in self.animations.values():
+            for path in frames:
+                if path not in self.pixmaps:
+                    self.pixmaps[path] = self._load_pixmap(path, QColor(color_key))
+
+    def get_pixmap(self, path):
+        """Return the decoded frame for a path, or None if it couldn't be loaded."""
+        return self.pixmaps.get(path)
+
+    def _load_pixmap(self, path, color_key):
+        """Load a frame and turn its color key into a mask, frames with their own alpha are left as they are."""
+        image = QImage(path)
+        if image.isNull():
+            return None
+        pixmap = QPixmap.fromImage(image)
+        if not image.hasAlphaChannel():
+            key = color_key.rgb()
+            # Paletted BMPs use the palette entry closest to the key, like pygame's color key does
+            if image.colorCount():
+                key = min(image.colorTable(), key=lambda rgb: sum(
+                    (a - b) ** 2 for a, b in zip(QColor(rgb).getRgb(), color_key.getRgb())))
+            pixmap.setMask(QBitmap.fromImage(image.createMaskFromColor(key, Qt.MaskInColor)))
+        return pixmap
+
 ### CHATBOT USING OPENAI API ###
 class BonziChat:
     """Handles chatbot logic via the OpenAI API."""
     def __init__(self, parent):
         self.parent = parent  # reference to BonziWindow
         self.api_key = OPENAI_API_KEY
+        # Pooled, kept-alive connection to the API with timeouts and retries.
+        self.client = ChatClient(parent.settings, self.api_key, parent.settings.api_url)
+        self.model = "o3-mini"
         self.system_prompt = (
             "You are Bonzi Buddy, a friendly desktop assistant. "
             "Your available animations are: idle, arrive, goodbye, backflip, glasses, wave, talking. "
             "When you want to trigger an animation, output a command in the format /animation:<animation_name> "
             "with no extra text. Otherwise, provide a normal text response."
         )
-        self.engine = pyttsx3.init()
+        # One long-lived text-to-speech engine, it speaks queued sentences on its own thread.
+        self.speech = SpeechService(parent.settings)
+        # Replies to repeated inputs, None if turned off in Settings.
+        self.response_cache = open_response_cache(parent.settings)
 
-    def get_response(self, user_text):
-        """Call the OpenAI API and return the response text."""
+    def request_data(self, user_text):
+        """Build the request body for the OpenAI API."""
         messages = [
             {"role": "system", "content": self.system_prompt},
             {"role": "user", "content": user_text}
         ]
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "model": "o3-mini",
+        return {
+            "model": self.model,
             "messages": messages
         }
-        try:
-            response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=data)
-            response.raise_for_status()
-        except Exception as e:
-            print("Error calling OpenAI API:", e)
-            return f"Error calling API: {e}"
-        result = response.json()
-        reply = result["choices"][0]["message"]["content"].strip()
+
+    @traced("api.get_response")
+    def get_response(self, user_text):
+        """Call the OpenAI API and return the response text."""
+        cache_key = self.cache_key(user_text)
+        reply = self.response_cache.get(cache_key) if cache_key else None
+        if reply is None:
+            try:
+                response = self.client.post(self.request_data(user_text))
+            except Exception as e:
+                print("Error calling OpenAI API:", e)
+                return f"Error calling API: {e}"
+            result = response.json()
+            reply = result["choices"][0]["message"]["content"].strip()
+            # The reply is cached before the animation check, so a cached command still plays.
+            if cache_key:
+                self.response_cache.put(cache_key, reply)
 
         # Check for an animation command in the response.
         anim_match = re.search(r"/animation:(\w+)", reply)
         if anim_match:
             animation_name = anim_match.group(1)
-            self.parent.set_animation(animation_name)
+            self.parent.animation_requested.emit(animation_name)
             # Return empty text (chat bubble not shown)
             return ""
         else:
             return reply
 
+    def stream_response(self, user_text):
+        """Stream a response from the OpenAI API, yielding text for the chat bubble as it arrives.
+
+        Each finished sentence is queued for TTS straight away, and an /animation: command starts
+        the animation as soon as its name has been written.
+        """
+        # The parser runs on the worker thread, the animation starts on the GUI thread
+        parser = AnimationCommandParser(self.parent.animation_manager.animations, self.parent.animation_requested.emit)
+        cache_key = self.cache_key(user_text)
+        cached = self.response_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            pieces = (piece for piece in [cached])  # the whole reply at once, as a stream
+        else:
+            pieces = self.client.stream(self.request_data(user_text))
+            if cache_key:
+                pieces = cache_pieces(pieces, self.response_cache, cache_key)
+        return stream_reply(pieces, parser, self.speech, self.finish_speaking)
+
+    def cache_key(self, user_text):
+        """Return the response cache key for the user's text, or None if the cache is turned off."""
+        if self.response_cache is None:
+            return None
+        return self.response_cache.key(user_text, {"model": self.model, "system_prompt": self.system_prompt})
+
     def text_to_speech(self, response_text):
-        """Perform text-to-speech conversion."""
-        voices = self.engine.getProperty("voices")
-        # Attempt to use Microsoft David if available
-        for voice in voices:
-            if "david" in voice.name.lower():
-                self.engine.setProperty("voice", voice.id)
-                break
-        self.engine.setProperty("rate", self.parent.settings.rate)
-        self.engine.setProperty("volume", self.parent.settings.volume)
-        self.engine.say(response_text)
-        self.engine.runAndWait()
-        # Mark TTS as done.
+        """Queue the response text to be spoken sentence by sentence."""
+        self.speech.speak(response_text, on_done=self.finish_speaking)
+
+    def finish_speaking(self):
+        """Mark TTS as done and go back to idle once the whole response has been spoken."""
         self.parent.processing_tts = False
+        self.parent.animation_requested.emit("idle")  # called on the speech thread
 
 ### CHAT BUBBLE (Overlay Text) ###
 class ChatBubble(QWidget):
@@ -136,9 +229,15 @@ class ChatBubble(QWidget):
 ### MAIN WINDOW ###
 class BonziWindow(QMainWindow):
     """Main window for the floating Bonzi assistant."""
+    # Qt widgets may only be touched on the GUI thread, the chatbot's threads hand their results over
+    # through these signals and Qt queues the connected slots to run on the GUI thread
+    bubble_text = pyqtSignal(str)
+    animation_requested = pyqtSignal(str)
+
     def __init__(self):
         super().__init__()
         self.settings = Settings()
+        configure_tracing(self.settings)
         self.setFixedSize(self.settings.window_width, self.settings.window_height)
         # Frameless, transparent, always on top
         self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint)
@@ -147,12 +246,15 @@ class BonziWindow(QMainWindow):
         # Variables for dragging the window
         self.drag_position = QPoint()
 
-        # Animation and state
+        # Animation and state, the timeline plays frames by elapsed time rather than per timer tick
         self.animation_manager = Animation()
-        self.current_animation = "arrive"
-        self.frames = self.animation_manager.get_animation(self.current_animation)
-        self.current_frame_index = 0
+        self.animation_manager.preload_pixmaps(self.settings.color_screen)
+        self.timeline = Timeline(BMP_ANIMATION_TIMING)
+        self.frame_path = None
+        self.set_animation("arrive")
         self.processing_tts = False
+        self.bubble_text.connect(self.show_chat_bubble)
+        self.animation_requested.connect(self.set_animation)
 
         # Set up chatbot
         self.chatbot = BonziChat(self)
@@ -204,37 +306,35 @@ class BonziWindow(QMainWindow):
         # Timer to update animation frames
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.update_animation)
-        self.timer.start(120)  # adjust frame rate (milliseconds)
+        self.timer.start(1000 // self.settings.frame_rate)  # redraw interval (milliseconds)
 
     def set_animation(self, anim_name):
-        """Set the current animation and reset frame index."""
+        """Set the current animation and start it from its first frame."""
         self.current_animation = anim_name
-        self.frames = self.animation_manager.get_animation(anim_name)
-        self.current_frame_index = 0
+        self.timeline.play(anim_name, self.animation_manager.get_animation(anim_name))
 
     def update_animation(self):
-        """Cycle through animation frames and update the image."""
-        if not self.frames:
-            return
-
+        """Show the animation frame that is due now."""
         # Loop frames for "talking" animation until TTS is done.
-        if self.current_animation == "talking" and self.processing_tts:
-            frame_path = self.frames[self.current_frame_index]
-            # Example: if a certain frame name is reached, loop back a few frames.
-            if "0040.bmp" in frame_path and self.current_frame_index > 0:
-                self.current_frame_index -= 1
-            else:
-                self.current_frame_index = (self.current_frame_index + 1) % len(self.frames)
-        else:
-            self.current_frame_index = (self.current_frame_index + 1) % len(self.frames)
+        frame_path = self.timeline.update(looping=self.current_animation == "talking" and self.processing_tts)
+        if frame_path is None:
+            # Animations repeat until another one is set.
+            self.set_animation(self.current_animation)
+            frame_path = self.timeline.update()
+            if frame_path is None:
+                return
+
+        # Only load a new image when the frame has changed
+        if frame_path == self.frame_path:
+            return
+        self.frame_path = frame_path
 
-        frame_path = self.frames[self.current_frame_index]
-        if os.path.exists(frame_path):
-            pixmap = QPixmap(frame_path)
-            # Set the color key if needed (you might have to adjust for your images)
-            # Here we assume the images already have transparent backgrounds.
+        pixmap = self.animation_manager.get_pixmap(frame_path)
+        if pixmap is not None:
             self.image_label.setPixmap(pixmap)
-            self.image_label.setFixedSize(pixmap.size())
+            # Resizing the label makes the layout run again, most frames are the same size
+            if self.image_label.size() != pixmap.size():
+                self.image_label.setFixedSize(pixmap.size())
         else:
             self.image_label.clear()
 
@@ -255,13 +355,19 @@ class BonziWindow(QMainWindow):
 
         # Start API call and TTS in a separate thread.
         def process_text():
+            if self.settings.stream_responses:
+                # Grow the chat bubble as the response streams in, it is spoken sentence by sentence.
+                response = ""
+                for piece in self.chatbot.stream_response(text):
+                    response += piece
+                    self.bubble_text.emit(response)
+                return
             response = self.chatbot.get_response(text)
             if response:
                 # Show chat bubble with the response.
-                self.show_chat_bubble(response)
+                self.bubble_text.emit(response)
+            # Speak the response, Bonzi goes back to idle once TTS is done.
             self.chatbot.text_to_speech(response)
-            # After TTS, revert to idle animation.
-            self.set_animation("idle")
 
         threading.Thread(target=process_text, daemon=True).start()
 
@@ -0,0 +1,259 @@
+import email.utils
+import json
+import random
+import re
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from speech import SentenceSplitter
+from tracing import TRACER, traced
+
+
+OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+
+# Responses worth trying again, rate limiting and server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Written by the model to make Bonzi do an animation instead of replying, e.g. /animation:wave
+ANIMATION_PREFIX = "/animation:"
+ANIMATION_NAME = re.compile(r"\w*")
+
+
+class ChatClient:
+    """A class for calling the chat completions API over one pooled, kept-alive connection."""
+    def __init__(self, settings, api_key, url=OPENAI_CHAT_URL):
+        """Set up the session, timeouts and retries come from Settings."""
+        self.settings = settings
+        self.url = url
+
+        # A session keeps the TCP and TLS connection open between requests instead of reconnecting each time
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=self.settings.api_pool_size))
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=self.settings.api_pool_size))
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+
+        # Counters to see how often the API needed retrying
+        self.requests = 0
+        self.retries = 0
+
+    @traced("api.request")
+    def post(self, data, stream=False):
+        """POST data as JSON and return the response, retrying rate limits, server errors and failed connections.
+
+        Raises the last error if every attempt fails.
+        """
+        timeout = (self.settings.api_connect_timeout, self.settings.api_read_timeout)
+        attempt = 0
+        while True:
+            self.requests += 1
+            try:
+                response = self.session.post(self.url, json=data, timeout=timeout, stream=stream)
+            except requests.ConnectionError:
+                # Covers connect timeouts too, a read timeout isn't retried since the request may have run
+                if attempt >= self.settings.api_max_retries:
+                    raise
+                delay = self.backoff(attempt)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.settings.api_max_retries:
+                    response.raise_for_status()
+                    return response
+                delay = self.retry_after(response)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                elif delay > self.settings.api_max_backoff:
+                    # The server wants us to wait longer than Bonzi should hang, give up now
+                    response.raise_for_status()
+                response.close()  # hand the connection back to the pool
+
+            attempt += 1
+            self.retries += 1
+            time.sleep(delay)
+
+    def stream(self, data):
+        """POST data with streaming turned on and yield each piece of the reply's text as it arrives."""
+        start = time.perf_counter_ns()
+        response = self.post(dict(data, stream=True), stream=True)
+        response.encoding = "utf-8"  # event streams don't always say
+        first = True
+        try:
+            # chunk_size=None hands over lines as soon as they arrive instead of filling a buffer first
+            for event in iter_sse(response.iter_lines(chunk_size=None, decode_unicode=True)):
+                # Reading on past [DONE] to the end of the response lets the connection be reused
+                if event == "[DONE]":
+                    continue
+                for choice in json.loads(event).get("choices", []):
+                    content = (choice.get("delta") or {}).get("content")
+                    if content:
+                        if first:
+                            TRACER.record("api.first_piece", start)  # time until Bonzi can start talking
+                            first = False
+                        yield content
+        finally:
+            response.close()
+
+    def backoff(self, attempt):
+        """Return how long to wait before a retry, exponential with full jitter so clients spread out."""
+        ceiling = min(self.settings.api_max_backoff, self.settings.api_backoff * 2 ** attempt)
+        return random.uniform(0, ceiling)
+
+    def retry_after(self, response):
+        """Return the seconds a Retry-After header asks for, or None if there isn't a usable one."""
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            # Retry-After can also be an HTTP date
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, when.timestamp() - time.time())
+
+    def stats(self):
+        """Return a dictionary of the request counters."""
+        return {"requests": self.requests, "retries": self.retries}
+
+    def close(self):
+        """Close the pooled connections."""
+        self.session.close()
+
+
+def iter_sse(lines):
+    """Yield the data of each server-sent event from an iterator of lines."""
+    data = []
+    for line in lines:
+        if not line:
+            # A blank line ends the event
+            if data:
+                yield "\n".join(data)
+                data = []
+        elif line.startswith("data:"):
+            value = line[len("data:"):]
+            data.append(value[1:] if value.startswith(" ") else value)
+        # Comments (":") and event, id and retry fields aren't needed
+    if data:
+        yield "\n".join(data)
+
+
+def stream_reply(pieces, parser, speech, on_done, cancel_event=None):
+    """Yield a streamed reply's text for the chat bubble, queuing each finished sentence on the speech service.
+
+    pieces comes from ChatClient.stream(), parser is an AnimationCommandParser and on_done is called
+    on the speech thread once everything has been spoken. An API error is shown and spoken like a reply.
+    """
+    splitter = SentenceSplitter()
+    shown = False
+    try:
+        for piece in pieces:
+            if cancel_event is not None and cancel_event.is_set():
+                pieces.close()
+                return
+            text = parser.feed(piece)
+            if not shown:
+                text = text.lstrip()  # same as stripping the whole reply
+            if text:
+                shown = True
+                for sentence in splitter.feed(text):
+                    speech.put(sentence)
+                yield text
+        text = parser.flush()
+        if not shown:
+            text = text.lstrip()
+        if text:
+            for sentence in splitter.feed(text):
+                speech.put(sentence)
+            yield text
+    except Exception as e:
+        print("Error calling OpenAI API:", e)
+        text = f"Error calling API: {e}"
+        for sentence in splitter.feed(text):
+            speech.put(sentence)
+        yield text
+    finally:
+        # Whatever is left after the last full sentence, then on_done once it has all been spoken
+        for sentence in splitter.flush():
+            speech.put(sentence)
+        speech.end(on_done)
+
+
+class AnimationCommandParser:
+    """A class for finding an /animation:<name> command in streamed text as soon as it is written.
+
+    Text is held back only while it could still turn out to be a command, the rest is passed on to show
+    and speak right away. So text the model writes before a command is shown and spoken, where a reply
+    containing a command used to show nothing at all. Everything after the command is dropped.
+    """
+    def __init__(self, names, on_animation):
+        """names are the known animations, on_animation(name) is called once when a command is found."""
+        self.names = list(names)
+        self.on_animation = on_animation
+        self.buffer = ""
+
+        # The animation found, None until there is one
+        self.animation = None
+
+    def feed(self, text):
+        """Add streamed text and return the part of it that is safe to show."""
+        if self.animation is not None:
+            return ""
+        self.buffer += text
+
+        shown = ""
+        while True:
+            start = self.buffer.find(ANIMATION_PREFIX)
+            if start == -1:
+                # Keep any ending that could be the start of the prefix, e.g. "/anim"
+                keep = self._partial_prefix()
+                shown += self.buffer[:len(self.buffer) - keep]
+                self.buffer = self.buffer[len(self.buffer) - keep:]
+                return shown
+
+            shown += self.buffer[:start]
+            self.buffer = self.buffer[start:]
+            name = ANIMATION_NAME.match(self.buffer, len(ANIMATION_PREFIX)).group()
+            finished = len(ANIMATION_PREFIX) + len(name) < len(self.buffer)
+
+            if name and (finished or self._only_match(name)):
+                self._found(name)
+                return shown
+            if not finished:
+                return shown  # wait for more of the name
+
+            # The prefix wasn't followed by a name, so it is just text
+            shown += ANIMATION_PREFIX
+            self.buffer = self.buffer[len(ANIMATION_PREFIX):]
+
+    def flush(self):
+        """Return whatever text is left once the stream has ended, firing a command cut off by the end."""
+        rest = self.buffer
+        self.buffer = ""
+        if self.animation is None and rest.startswith(ANIMATION_PREFIX):
+            name = ANIMATION_NAME.match(rest, len(ANIMATION_PREFIX)).group()
+            if name:
+                self._found(name)
+                return ""
+        return "" if self.animation is not None else rest
+
+    def _found(self, name):
+        self.animation = name
+        self.buffer = ""
+        self.on_animation(name)
+
+    def _only_match(self, name):
+        """True if name is a known animation that no longer known name starts with, so it can't grow."""
+        return name in self.names and not any(other != name and other.startswith(name) for other in self.names)
+
+    def _partial_prefix(self):
+        """Return the length of the longest ending of the buffer that starts the prefix."""
+        for length in range(min(len(self.buffer), len(ANIMATION_PREFIX) - 1), 0, -1):
+            if ANIMATION_PREFIX.startswith(self.buffer[-length:]):
+                return length
+        return 0
@@ -1,16 +1,39 @@
 import pygame
 import textwrap
 
+from text_cache import get_font, render_line
+
 
 class ChatBubble:
     """A class for creating chat bubbles above Bonzi."""
 
     def __init__(self, bonzi, text):
         self.bonzi = bonzi
-        self.text = text
 
-        # Create a font object to render the text, None is the default font
-        self.font = pygame.font.Font(None, 24)
+        # Shared default font, size 24
+        self.font_size = 24
+        self.font = get_font(self.font_size)
+
+        # Space between the text and the edge of the bubble
+        self.padding = 20
+
+        # Create a separate surface for the tail
+        self.tail_surface = pygame.Surface((20, 20))
+
+        # Make the background of the tail surface transparent
+        self.tail_surface.set_colorkey((0, 0, 0))
+
+        # Draw the chat bubble tail on the tail surface
+        pygame.draw.polygon(self.tail_surface, (255, 255, 255), [(10, 0), (0, 20), (20, 20)])
+
+        # Rotate the tail surface by 180 degrees
+        self.tail_surface = pygame.transform.rotate(self.tail_surface, 180)
+
+        self.set_text(text)
+
+    def set_text(self, text):
+        """Change the bubble's text and draw the whole bubble once onto a cached surface."""
+        self.text = text
 
         # Wrap the text so chat bubble looks nicer
         lines = self.wrap_text(self.text, 20)
@@ -21,28 +44,28 @@ class ChatBubble:
         else:
             self.text_width, self.text_height = self.font.size("")
 
-        # Create a Surface to display text on with the dimensions of the text plus some padding
-        self.padding = 20
-        self.text_surface = pygame.Surface(
-            (self.text_width + 2 * self.padding, len(lines) * self.text_height + 2 * self.padding))
+        # Size of the bubble box, the dimensions of the text plus some padding
+        self.box_width = self.text_width + 2 * self.padding
+        self.box_height = len(lines) * self.text_height + 2 * self.padding
 
-        # Set surface color to white
-        self.text_surface.fill("white")
+        # The box with the tail underneath it, everything around them is transparent
+        self.bubble_surface = pygame.Surface((self.box_width, self.box_height + self.tail_surface.get_height()),
+                                             pygame.SRCALPHA)
 
-        # Color-key white so it's transparent
-        self.text_surface.set_colorkey("white")
+        # Draw the chat bubble rectangle in white
+        pygame.draw.rect(self.bubble_surface, (255, 255, 255), (0, 0, self.box_width, self.box_height))
 
-        # Create a separate surface for the tail
-        self.tail_surface = pygame.Surface((20, 20))
+        # Blit the tail under the middle of the box
+        self.bubble_surface.blit(self.tail_surface, (self.box_width // 2 - 10, self.box_height))
 
-        # Make the background of the tail surface transparent
-        self.tail_surface.set_colorkey((0, 0, 0))
+        # Render each line and blit onto the bubble
+        for i, line in enumerate(lines):
+            line_surface = render_line(line, self.font_size, (0, 0, 0))
+            self.bubble_surface.blit(line_surface, (self.padding, self.padding + i * self.text_height))
 
-        # Draw the chat bubble tail on the tail surface
-        pygame.draw.polygon(self.tail_surface, (255, 255, 255), [(10, 0), (0, 20), (20, 20)])
-
-        # Rotate the tail surface by 180 degrees
-        self.tail_surface = pygame.transform.rotate(self.tail_surface, 180)
+    def append_text(self, piece):
+        """Add streamed text onto the end of the bubble."""
+        self.set_text(self.text + piece)
 
     def wrap_text(self, text, max_width):
         """Wrap text to fit within a certain width."""
@@ -52,25 +75,14 @@ class ChatBubble:
 
         return wrapped_text
 
+    def get_rect(self):
+        """Return where the bubble is drawn in the window, centered above Bonzi."""
+        rect = self.bubble_surface.get_rect()
+        rect.x = self.bonzi.rect.centerx - self.box_width // 2
+        rect.y = self.bonzi.rect.y - self.box_height - 180
+        return rect
+
     def draw_bubble(self):
         """Draw the chat bubble box and tail with the text above Bonzi."""
-        # Render each line and blit onto text surface
-        lines = self.wrap_text(self.text, 20)
-        for i, line in enumerate(lines):
-            line_surface = self.font.render(line, True, (0, 0, 0))
-            self.text_surface.blit(line_surface, (self.padding, self.padding + i * self.text_height))
-
-        # Get x and y positions for the chat bubble, centered above Bonzi
-        bubble_x = self.bonzi.rect.centerx - self.text_surface.get_width() // 2
-        bubble_y = self.bonzi.rect.y - self.text_surface.get_height() - 180
-
-        # Draw the chat bubble rectangle in white
-        bubble_rect = pygame.draw.rect(self.bonzi.window, (255, 255, 255),
-                                       (bubble_x, bubble_y, self.text_surface.get_width(),
-                                        self.text_surface.get_height()))
-
-        # Blit the tail surface onto the window
-        self.bonzi.window.blit(self.tail_surface, (bubble_rect.centerx - 10, bubble_rect.bottom))
-
-        # Blit the Surface object onto the chat bubble
-        self.bonzi.window.blit(self.text_surface, bubble_rect.topleft)
+        # The bubble was already drawn in set_text(), so this is a single blit
+        self.bonzi.window.blit(self.bubble_surface, self.get_rect())
@@ -0,0 +1,126 @@
+import torch
+
+
+class ConversationSession:
+    """A class for remembering the conversation so far as tokens, along with GPT-2's key/value cache for them.
+
+    Each turn only the new text has to be encoded, the earlier turns come from the cache that
+    model.generate() returned last time. Once the conversation gets close to the model's position
+    limit the oldest turns are dropped.
+    """
+    def __init__(self, tokenizer, max_positions=1024, max_length=60, keep_fraction=0.5):
+        """max_positions is the model's n_positions, max_length the tokens a turn's input and reply can use together.
+
+        When the limit is reached, the oldest turns are dropped until keep_fraction of it is left.
+        """
+        self.tokenizer = tokenizer
+        self.max_positions = max_positions
+        self.max_length = max_length
+        self.keep_fraction = keep_fraction
+
+        # Token ids of the whole conversation and how many of them each turn added, oldest first
+        self.tokens = []
+        self.turns = []
+
+        # What generate() returned for self.tokens, None when it has to be rebuilt
+        self.past_key_values = None
+
+        # Persona tokens placed before the conversation, see persona.py
+        self.prefix_tokens = []
+
+        # Token count before the turn that is generating, None if there isn't one
+        self.pending = None
+
+        # Counters to see how much the cache saves
+        self.encoded_tokens = 0
+        self.trims = 0
+
+    def start_turn(self, text, prefix_tokens=(), prefix_cache=None):
+        """Add the input text to the conversation and return the keyword arguments for model.generate().
+
+        prefix_tokens are a persona's token ids to put before the conversation and prefix_cache()
+        returns a copy of their cache, used when the conversation's own cache has to be rebuilt.
+        """
+        if self.pending is not None:
+            # The last turn never finished, its half-written cache can't be trusted
+            self.cancel_turn()
+
+        prefix_tokens = list(prefix_tokens)
+        if prefix_tokens != self.prefix_tokens:
+            self.prefix_tokens = prefix_tokens
+            self.past_key_values = None
+        max_positions = self.max_positions - len(prefix_tokens)
+
+        # Turns go on separate lines, like the lines of personality.txt
+        turn = self.tokenizer.encode(("\n" if self.tokens else "") + text)
+        max_new_tokens = max(1, self.max_length - len(turn))
+        turn = turn[-(max_positions - max_new_tokens):]
+
+        if len(self.tokens) + len(turn) + max_new_tokens > max_positions:
+            self.trim(int(max_positions * self.keep_fraction) - len(turn) - max_new_tokens)
+
+        # The cache holds every token but the last one generated, generate() only runs the rest
+        if self.past_key_values is not None:
+            cached = len(prefix_tokens) + len(self.tokens) - 1
+        elif prefix_tokens and prefix_cache is not None:
+            self.past_key_values = prefix_cache()
+            cached = len(prefix_tokens)
+        else:
+            cached = 0
+        self.encoded_tokens += len(prefix_tokens) + len(self.tokens) + len(turn) - cached
+
+        self.pending = len(self.tokens)
+        self.tokens = self.tokens + turn
+        inputs = torch.tensor([prefix_tokens + self.tokens])
+        return dict(inputs=inputs,
+                    attention_mask=torch.ones_like(inputs),
+                    past_key_values=self.past_key_values,
+                    max_new_tokens=max_new_tokens,
+                    use_cache=True,
+                    return_dict_in_generate=True)  # so the new cache comes back with the tokens
+
+    def finish_turn(self, output):
+        """Keep the generated reply and its cache, returns this turn's text."""
+        previous = self.pending
+        self.pending = None
+        self.tokens = output.sequences[0].tolist()[len(self.prefix_tokens):]
+        self.turns.append(len(self.tokens) - previous)
+        self.past_key_values = output.past_key_values
+        return self.tokenizer.decode(self.tokens[previous:], skip_special_tokens=True).lstrip("\n")
+
+    def cancel_turn(self):
+        """Forget the turn that was generating, e.g. when it was cancelled."""
+        if self.pending is None:
+            return
+        self.tokens = self.tokens[:self.pending]
+        self.pending = None
+        # Newer transformers versions add to the cache in place, so it is rebuilt next turn
+        self.past_key_values = None
+
+    def add_turn(self, response):
+        """Add a turn that didn't come from generate(), like a reply from the response cache."""
+        if self.pending is not None:
+            self.cancel_turn()
+        max_positions = self.max_positions - len(self.prefix_tokens)
+        turn = self.tokenizer.encode(("\n" if self.tokens else "") + response)[-max_positions // 2:]
+        if len(self.tokens) + len(turn) + self.max_length > max_positions:
+            self.trim(int(max_positions * self.keep_fraction) - len(turn) - self.max_length)
+        # The cache still covers the tokens before it, the next generate() encodes this turn too
+        self.tokens = self.tokens + turn
+        self.turns.append(len(turn))
+
+    def trim(self, budget):
+        """Drop the oldest turns until the conversation is at most budget tokens."""
+        # GPT-2's position embeddings are absolute, so dropping tokens from the front moves every later
+        # token and the cache has to be rebuilt. Trimming well below the limit means that happens rarely.
+        dropped = 0
+        while self.turns and len(self.tokens) - dropped > max(0, budget):
+            dropped += self.turns.pop(0)
+        self.tokens = self.tokens[dropped:]
+        self.past_key_values = None
+        self.trims += 1
+
+    def stats(self):
+        """Return a dictionary of the conversation counters."""
+        return {"turns": len(self.turns), "tokens": len(self.tokens),
+                "encoded_tokens": self.encoded_tokens, "trims": self.trims}
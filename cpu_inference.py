@@ -0,0 +1,78 @@
+import os
+
+import torch
+from torch import nn
+from transformers import GPT2Config, GPT2LMHeadModel
+from transformers.pytorch_utils import Conv1D
+
+
+# Inference modes BonziGPT can run the model in, picked with Settings.inference_mode
+INFERENCE_MODES = ("float32", "int8", "bf16")
+
+# What runs the model, picked with Settings.inference_backend
+INFERENCE_BACKENDS = ("pytorch", "onnx")
+
+
+def set_thread_count(threads):
+    """Set how many threads PyTorch uses for each operation, None leaves PyTorch's default."""
+    if threads:
+        torch.set_num_threads(threads)
+
+
+def bf16_supported():
+    """Return True if the CPU has native bfloat16 support, emulated bf16 is slower than float32."""
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def conv1d_to_linear(module):
+    """Swap GPT-2's Conv1D layers for the equivalent nn.Linear so dynamic quantization can find them."""
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            # Conv1D stores its weight as (in, out), nn.Linear as (out, in)
+            linear = nn.Linear(child.weight.shape[0], child.nf)
+            linear.weight = nn.Parameter(child.weight.data.t().contiguous())
+            linear.bias = nn.Parameter(child.bias.data)
+            setattr(module, name, linear)
+        else:
+            conv1d_to_linear(child)
+    return module
+
+
+def quantize_int8(model):
+    """Dynamically quantize every linear layer of the model to int8 in place and return it.
+
+    The model passed in is changed, callers replace their float32 model with the returned one.
+    """
+    # Conv1D is swapped in place anyway, so quantize in place too rather than copying the whole model
+    model = conv1d_to_linear(model).eval()
+    return torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def newest_change(model_dir):
+    """Return the latest modified time of any file in the trained model folder."""
+    times = [os.path.getmtime(os.path.join(model_dir, name)) for name in os.listdir(model_dir)]
+    return max(times, default=0)
+
+
+def load_quantized(quantized_path, model_dir):
+    """Load the saved int8 model, or None if it is missing or older than the trained model."""
+    if not os.path.exists(quantized_path) or not os.path.exists(model_dir):
+        return None
+    if os.path.getmtime(quantized_path) < newest_change(model_dir):
+        return None
+    try:
+        # Build the int8 layout from the config alone, then fill it with the saved int8 weights
+        model = quantize_int8(GPT2LMHeadModel(GPT2Config.from_pretrained(model_dir)))
+        model.load_state_dict(torch.load(quantized_path, weights_only=False))
+        return model
+    except Exception as e:
+        print("Could not load the quantized model, quantizing again:", e)
+        return None
+
+
+def save_quantized(model, quantized_path):
+    """Save the int8 weights so later starts can skip loading the float32 ones."""
+    torch.save(model.state_dict(), quantized_path)
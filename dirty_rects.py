@@ -0,0 +1,93 @@
+import pygame
+
+
+class DirtyRenderer:
+    """A class for redrawing only the parts of the window that changed since the last frame."""
+    def __init__(self, window, background, enabled=True):
+        """background is a surface the size of the window, or a color to fill with.
+
+        With enabled False every frame is drawn in full and flipped, like before.
+        """
+        self.window = window
+        self.background = background
+        self.enabled = enabled
+
+        # Layer name -> (rect, state) from the last frame, compared to find what changed
+        self.previous = {}
+
+        # The first frame, and any frame after invalidate(), is drawn in full
+        self.full_redraw = True
+
+    def invalidate(self):
+        """Draw the next frame in full, for when the window's contents were lost."""
+        self.full_redraw = True
+
+    def draw(self, layers):
+        """Draw a frame and return the rects that were sent to the display.
+
+        layers is a list of (name, rect, state, draw) tuples in drawing order. A layer is redrawn
+        when its rect or state differs from the last frame, along with every layer overlapping it.
+        draw() is called with no arguments and should blit the layer at its rect.
+        """
+        current = {name: (rect, state) for name, rect, state, draw in layers}
+        window_rect = self.window.get_rect()
+
+        if self.full_redraw or not self.enabled:
+            self._restore(window_rect)
+            for name, rect, state, draw in layers:
+                draw()
+            pygame.display.flip()
+            self.full_redraw = False
+            self.previous = current
+            return [window_rect]
+
+        # Both where a changed layer was and where it is now need redrawing
+        dirty = []
+        for name, (rect, state) in current.items():
+            if self.previous.get(name) != (rect, state):
+                dirty.append(rect)
+                if name in self.previous:
+                    dirty.append(self.previous[name][0])
+        for name, (rect, state) in self.previous.items():
+            if name not in current:
+                dirty.append(rect)  # layer was removed, e.g. the chat bubble closed
+
+        dirty = merge_rects([rect.clip(window_rect) for rect in dirty if rect is not None])
+        for area in dirty:
+            # Clipping keeps layers from being drawn twice over themselves outside the dirty area,
+            # which would darken anything semi-transparent
+            self.window.set_clip(area)
+            self._restore(area)
+            for name, rect, state, draw in layers:
+                if rect is not None and rect.colliderect(area):
+                    draw()
+        self.window.set_clip(None)
+
+        if dirty:
+            pygame.display.update(dirty)
+        self.previous = current
+        return dirty
+
+    def _restore(self, area):
+        """Put the background back over an area of the window."""
+        if isinstance(self.background, pygame.Surface):
+            self.window.blit(self.background, area, area)
+        else:
+            self.window.fill(self.background, area)
+
+
+def merge_rects(rects):
+    """Combine overlapping rects so no part of the window is drawn twice, empty rects are dropped."""
+    merged = []
+    for rect in rects:
+        if not rect.width or not rect.height:
+            continue
+        rect = pygame.Rect(rect)
+
+        # Keep growing the rect until it no longer touches any of the merged ones
+        overlapping = rect.collidelist(merged)
+        while overlapping != -1:
+            rect.union_ip(merged.pop(overlapping))
+            overlapping = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
@@ -0,0 +1,83 @@
+"""Build a smaller draft copy of Bonzi's GPT-2 model for speculative decoding.
+
+    python draft_model.py --layers 4                 # bonzi_model -> bonzi_draft, then trained on personality.txt
+    python draft_model.py --layers 3 --no-train
+
+The draft keeps a few of the model's layers, spread from the first to the last, and is then fine-tuned
+on the same text so it guesses the way the full model talks. Set draft_model_dir in settings.py to use it.
+"""
+import argparse
+import copy
+import os
+
+import torch
+from transformers import GPT2LMHeadModel
+
+from cpu_inference import bf16_supported, quantize_int8
+
+
+def keep_layer_indices(total, layers):
+    """Return which of total layers to keep, evenly spread and always including the first and last."""
+    if layers >= total:
+        return list(range(total))
+    if layers == 1:
+        return [total - 1]
+    return sorted({round(i * (total - 1) / (layers - 1)) for i in range(layers)})
+
+
+def truncate_layers(model, layers):
+    """Return a copy of a GPT-2 model with only some of its transformer layers."""
+    draft = copy.deepcopy(model)
+    keep = keep_layer_indices(len(draft.transformer.h), layers)
+    draft.transformer.h = torch.nn.ModuleList(draft.transformer.h[i] for i in keep)
+
+    # Each layer knows its own index for the cache, so they are numbered again
+    for index, block in enumerate(draft.transformer.h):
+        block.attn.layer_idx = index
+    draft.config.n_layer = len(keep)
+    return draft
+
+
+def load_draft_model(draft_dir, inference_mode="float32"):
+    """Load the draft model in the same inference mode as the main model, or None if there isn't one."""
+    if not draft_dir:
+        return None
+    if not os.path.exists(draft_dir):
+        print(f"No draft model in {draft_dir}, build one with draft_model.py. Generating without it.")
+        return None
+
+    draft = GPT2LMHeadModel.from_pretrained(draft_dir)
+    if inference_mode == "int8":
+        draft = quantize_int8(draft)
+    elif inference_mode == "bf16" and bf16_supported():
+        draft = draft.to(torch.bfloat16)
+    return draft.eval()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-dir", default="bonzi_model")
+    parser.add_argument("--output-dir", default="bonzi_draft")
+    parser.add_argument("--layers", type=int, default=4, help="transformer layers the draft keeps")
+    parser.add_argument("--text-file", default="personality.txt")
+    parser.add_argument("--epochs", type=int, default=None, help="default from Settings.train_epochs")
+    parser.add_argument("--no-train", action="store_true", help="save the cut-down copy without training it")
+    args = parser.parse_args()
+
+    from transformers import GPT2Tokenizer
+    from settings import Settings
+
+    model = GPT2LMHeadModel.from_pretrained(args.model_dir)
+    draft = truncate_layers(model, args.layers)
+    print(f"Draft keeps {draft.config.n_layer} of {model.config.n_layer} layers, "
+          f"{sum(p.numel() for p in draft.parameters()) / 1e6:.1f}M parameters")
+
+    if args.no_train:
+        draft.save_pretrained(args.output_dir)
+    else:
+        from training_data import train_model
+
+        tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
+        tokenizer.pad_token = tokenizer.eos_token
+        train_model(draft, tokenizer, args.text_file, args.output_dir, Settings(), args.epochs)
+    print(f"Saved the draft model to {args.output_dir}")
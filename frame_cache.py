@@ -0,0 +1,100 @@
+from collections import OrderedDict
+
+import pygame
+
+
+class FrameCache:
+    """A class for keeping Bonzi's decoded animation frames in memory."""
+    def __init__(self, settings, max_bytes=None, atlas=None):
+        """Initialize the cache, max_bytes of None means the cache never evicts."""
+        self.settings = settings
+        self.max_bytes = max_bytes
+
+        # Packed sprite atlas to read frames from, loose files are used when it is None
+        self.atlas = atlas
+
+        # Ordered so the least recently used frame is always first
+        self.frames = OrderedDict()
+        self.total_bytes = 0
+
+        # Counters to see how well the cache is doing
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def preload(self, animations):
+        """Decode every frame in a dictionary of animation frame lists once."""
+        for frames in animations.values():
+            for path in frames:
+                if path not in self.frames:
+                    self._store(path, self._load(path))
+
+    def get(self, path):
+        """Return the display-ready surface for a frame path, loading it on a miss."""
+        image = self.frames.get(path)
+        if image is not None:
+            self.hits += 1
+            self.frames.move_to_end(path)
+            return image
+
+        self.misses += 1
+        image = self._load(path)
+        self._store(path, image)
+        return image
+
+    def stats(self):
+        """Return a dictionary of the cache counters."""
+        return {
+            "frames": len(self.frames),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def clear(self):
+        """Drop every cached frame, counters are kept."""
+        self.frames.clear()
+        self.total_bytes = 0
+
+    def _load(self, path):
+        """Decode a frame, convert it to the display format and color key it."""
+        if self.atlas is not None and path in self.atlas:
+            image = self.atlas.get_frame(path)
+        else:
+            image = pygame.image.load(path)
+
+        # Color key before converting, the frames are palettized so the key snaps to their exact cyan
+        if image.get_colorkey() is None:
+            image.set_colorkey(self.settings.color_screen)
+
+        # convert() needs a display mode, fall back to the raw image before the window exists
+        if pygame.display.get_surface() is not None:
+            color_key = image.get_colorkey()
+
+            # Keep per-pixel alpha for the .png talking frames
+            if image.get_flags() & pygame.SRCALPHA:
+                image = image.convert_alpha()
+            else:
+                image = image.convert()
+            image.set_colorkey(color_key)
+        return image
+
+    def _store(self, path, image):
+        """Add a frame to the cache and evict the oldest frames if over the memory cap."""
+        self.frames[path] = image
+        self.total_bytes += self._size_of(image)
+
+        if self.max_bytes is None:
+            return
+
+        # Always keep the newest frame, even if it is bigger than the cap by itself
+        while self.total_bytes > self.max_bytes and len(self.frames) > 1:
+            _, old_image = self.frames.popitem(last=False)
+            self.total_bytes -= self._size_of(old_image)
+            self.evictions += 1
+
+    @staticmethod
+    def _size_of(image):
+        """Return roughly how many bytes of pixel data a surface holds."""
+        return image.get_pitch() * image.get_height()
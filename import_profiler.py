@@ -0,0 +1,84 @@
+"""Times imports to find what slows down startup.
+
+Set BONZI_PROFILE_IMPORTS=1 before starting main.py and the slowest imports are printed once the
+chatbot has loaded. For a full tree of every import, run python -X importtime main.py instead.
+"""
+import builtins
+import os
+import sys
+import threading
+import time
+
+
+class ImportProfiler:
+    """A class for timing imports by wrapping Python's import function."""
+    def __init__(self):
+        # Module name -> (self seconds, cumulative seconds)
+        self.times = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()  # imports on different threads are timed separately
+        self.original_import = None
+
+    def start(self):
+        """Start timing every import from now on."""
+        self.original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def stop(self):
+        """Put Python's import function back."""
+        if self.original_import is not None:
+            builtins.__import__ = self.original_import
+            self.original_import = None
+
+    def slowest(self, count=15):
+        """Return the slowest imports as (name, self seconds, cumulative seconds), slowest first."""
+        with self.lock:
+            rows = [(name, own, total) for name, (own, total) in self.times.items()]
+        return sorted(rows, key=lambda row: -row[2])[:count]
+
+    def report(self, count=15):
+        """Print the slowest imports."""
+        print(f"{'cumulative':>11} {'self':>9}  import")
+        for name, own, total in self.slowest(count):
+            print(f"{total * 1000:9.1f}ms {own * 1000:7.1f}ms  {name}")
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        """Stand-in for __import__ that times imports of modules that haven't been loaded yet."""
+        # Already loaded modules cost nothing, except "from x import y" which can load lazy submodules
+        if level or (name in sys.modules and not fromlist):
+            return self.original_import(name, globals, locals, fromlist, level)
+
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+
+        # Each stack entry collects the time spent in imports nested inside it
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self.original_import(name, globals, locals, fromlist, level)
+        finally:
+            total = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += total
+
+            # Skip the many imports that only look up something already loaded
+            if total > 0.001:
+                key = f"{name} ({', '.join(fromlist)})" if fromlist else name
+                with self.lock:
+                    own, cumulative = self.times.get(key, (0.0, 0.0))
+                    self.times[key] = (own + total - nested, cumulative + total)
+
+
+# Profiling starts as soon as this module is imported if the environment variable is set
+PROFILER = None
+if os.getenv("BONZI_PROFILE_IMPORTS"):
+    PROFILER = ImportProfiler()
+    PROFILER.start()
+
+
+def report(count=15):
+    """Print the slowest imports if BONZI_PROFILE_IMPORTS is set, otherwise do nothing."""
+    if PROFILER is not None:
+        PROFILER.report(count)
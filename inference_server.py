@@ -0,0 +1,234 @@
+"""Run Bonzi's GPT-2 model once and share it between many Bonzi windows.
+
+    python inference_server.py --port 8600
+
+Requests that arrive within a few milliseconds of each other are generated together in one padded
+batch. The server speaks the same /v1/chat/completions format as the OpenAI API, so main.py can use
+it by setting inference_server_url in settings.py, and bonzi_app.py and borderless.py by pointing
+their api_url at it.
+"""
+import argparse
+import json
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from speech import SpeechService
+from tracing import TRACER, configure_tracing, traced
+
+
+class RequestBatcher:
+    """A class for collecting requests from many threads and generating them in batches on one thread."""
+    def __init__(self, generate_batch, temperature_for, window=0.02, max_batch=8):
+        """generate_batch(texts, temperature) returns a response per text, temperature_for(text) picks its temperature.
+
+        After the first request arrives, the batcher waits up to window seconds for more, up to max_batch.
+        """
+        self.generate_batch = generate_batch
+        self.temperature_for = temperature_for
+        self.window = window
+        self.max_batch = max_batch
+        self.requests = queue.Queue()
+
+        # Counters to see how well requests are being batched
+        self.batches = 0
+        self.batched_requests = 0
+
+        self.thread = threading.Thread(target=self._run, daemon=True)  # thread closes with the program
+        self.thread.start()
+
+    def submit(self, text):
+        """Queue text to be generated, returns a Future that will hold the response."""
+        future = Future()
+        self.requests.put((text, future))
+        return future
+
+    def stats(self):
+        """Return a dictionary of the batching counters."""
+        mean = self.batched_requests / self.batches if self.batches else 0.0
+        return {"batches": self.batches, "requests": self.batched_requests, "mean_batch": round(mean, 2)}
+
+    def _run(self):
+        """Batching loop."""
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # Temperature can't differ within one generate() call, so requests are grouped by it
+            groups = {}
+            for text, future in batch:
+                groups.setdefault(self.temperature_for(text), []).append((text, future))
+
+            for temperature, group in groups.items():
+                self.batches += 1
+                self.batched_requests += len(group)
+                try:
+                    responses = self.generate_batch([text for text, _ in group], temperature)
+                except Exception as e:
+                    print("Error generating batch:", e)
+                    for _, future in group:
+                        future.set_exception(e)
+                    continue
+                for (_, future), response in zip(group, responses):
+                    future.set_result(response)
+            TRACER.report_if_due()
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    """Answers /v1/chat/completions requests with GPT-2, the last user message is the input text."""
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately, without this Nagle's algorithm delays kept-alive replies
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            data = json.loads(self.rfile.read(length) or b"{}")
+            text = [message["content"] for message in data["messages"] if message["role"] == "user"][-1]
+        except (ValueError, KeyError, IndexError, TypeError):
+            self.send_json(400, {"error": {"message": "expected messages with a user message"}})
+            return
+
+        try:
+            response = self.server.batcher.submit(text).result()
+        except Exception as e:
+            self.send_json(500, {"error": {"message": str(e)}})
+            return
+
+        if data.get("stream"):
+            # The batch generates the whole response at once, so it is streamed as one chunk
+            chunk = {"choices": [{"index": 0, "delta": {"content": response}, "finish_reason": "stop"}]}
+            payload = f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode("utf-8")
+            self.send_body(200, "text/event-stream", payload)
+            return
+
+        self.send_json(200, {"model": "bonzi-gpt2",
+                             "choices": [{"index": 0, "message": {"role": "assistant", "content": response},
+                                          "finish_reason": "stop"}]})
+
+    def send_json(self, status, body):
+        self.send_body(status, "application/json", json.dumps(body).encode("utf-8"))
+
+    def send_body(self, status, content_type, payload):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass  # one line per request would drown out everything else
+
+
+class InferenceServer(ThreadingHTTPServer):
+    """A class for the HTTP server, each request waits on its own thread for its batch to finish."""
+    daemon_threads = True
+
+    def __init__(self, batcher, host="127.0.0.1", port=8600):
+        super().__init__((host, port), InferenceHandler)
+        self.batcher = batcher
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+
+class RemoteBonziGPT:
+    """A class that stands in for BonziGPT in main.py, asking a shared inference server for responses."""
+    def __init__(self, bonzi, url):
+        self.bonzi = bonzi
+        self.settings = bonzi.settings
+        self.url = url
+
+        # Kept-alive connection to the server
+        self.session = requests.Session()
+
+        # Bonzi still speaks on this computer
+        self.speech = SpeechService(self.settings)
+
+    @traced("remote.get_response")
+    def get_response(self, text, cancel_event=None):
+        """Get a response from the inference server, None if it was cancelled while waiting."""
+        data = {"model": "bonzi-gpt2", "messages": [{"role": "user", "content": text}]}
+        with TRACER.span("remote.request"):
+            result = self.session.post(self.url, json=data, timeout=self.settings.inference_server_timeout)
+        result.raise_for_status()
+        response = result.json()["choices"][0]["message"]["content"]
+
+        if cancel_event and cancel_event.is_set():
+            return None
+
+        self.text_to_speech(response)
+        return response
+
+    def stream_response(self, text, cancel_event=None):
+        """Yield the whole response as one piece, the server generates responses in batches."""
+        response = self.get_response(text, cancel_event)
+        if response is not None:
+            yield response
+
+    def text_to_speech(self, response):
+        """Queue the response to be spoken sentence by sentence while the main program continues."""
+        self.speech.speak(response, on_done=self.finish_speaking)
+
+    def finish_speaking(self):
+        """Clean up once Bonzi has said his whole response."""
+        self.bonzi.chat_bubble = None
+        self.bonzi.input_box.processing_tts = False
+        self.bonzi.inference.speech_finished()  # a response queued behind this one can start now
+
+
+def start_server(chatbot, host="127.0.0.1", port=8600, window=0.02, max_batch=8):
+    """Start serving a loaded BonziGPT on a background thread and return the server."""
+    batcher = RequestBatcher(chatbot.generate_batch, chatbot.temperature_for, window, max_batch)
+    server = InferenceServer(batcher, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--model-dir", default="bonzi_model")
+    parser.add_argument("--batch-window", type=float, default=0.02,
+                        help="seconds to wait for more requests after the first one of a batch")
+    parser.add_argument("--max-batch", type=int, default=8)
+    args = parser.parse_args()
+
+    from types import SimpleNamespace
+    from bonzi_gpt import BonziGPT
+    from settings import Settings
+
+    # The model only needs Settings, there is no window for it to draw in
+    settings = Settings()
+    configure_tracing(settings)
+    chatbot = BonziGPT(SimpleNamespace(settings=settings), "personality.txt", args.model_dir, speak=False)
+    server = InferenceServer(RequestBatcher(chatbot.generate_batch, chatbot.temperature_for,
+                                            args.batch_window, args.max_batch), args.host, args.port)
+    print(f"Bonzi's brain is ready on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(server.batcher.stats())
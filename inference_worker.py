@@ -0,0 +1,135 @@
+import queue
+import threading
+import time
+
+from tracing import TRACER
+
+
+# What to do with a new request while another one is still generating
+BUSY_POLICIES = ("drop", "queue", "cancel")
+
+
+class InferenceWorker:
+    """A class for running Bonzi's chatbot on its own thread so the window keeps drawing."""
+    def __init__(self, respond, policy="drop"):
+        """Start the worker thread, respond is called as respond(text, cancel_event).
+
+        respond can return the whole response as a string, or an iterator of text pieces to stream it.
+        """
+        if policy not in BUSY_POLICIES:
+            raise ValueError(f"Unknown busy policy {policy!r}, expected one of {BUSY_POLICIES}")
+
+        self.respond = respond
+        self.policy = policy
+
+        # Text goes to the worker through requests, finished responses come back through responses
+        self.requests = queue.Queue()
+        self.responses = queue.Queue()
+
+        # Cancel events for every request that has been submitted but not finished
+        self.pending = []
+        self.lock = threading.Lock()
+
+        # Cleared while a response is being spoken, with the "queue" policy the next request waits for it
+        # so Bonzi finishes one response before generating the next, see speech_finished()
+        self.spoken = threading.Event()
+        self.spoken.set()
+
+        self.thread = threading.Thread(target=self._run, name="inference", daemon=True)  # thread closes with the program
+        self.thread.start()
+
+    @property
+    def busy(self):
+        """True while a request is generating or waiting to generate."""
+        with self.lock:
+            return bool(self.pending)
+
+    def submit(self, text):
+        """Send text to the chatbot, returns False if the busy policy dropped it."""
+        with self.lock:
+            if self.pending:
+                if self.policy == "drop":
+                    return False
+                if self.policy == "cancel":
+                    # Stop whatever is generating and throw away anything still waiting
+                    for cancel_event in self.pending:
+                        cancel_event.set()
+
+            cancel_event = threading.Event()
+            self.pending.append(cancel_event)
+
+        self.requests.put((text, cancel_event, time.perf_counter_ns()))
+        return True
+
+    def poll(self):
+        """Return every event the worker has produced since the last poll without blocking.
+
+        Events are (kind, text) tuples: ("start", None) when a request begins generating,
+        ("piece", text) for each streamed piece and ("done", response) once it is finished.
+        A "done" response of None means the chatbot raised an error for that request.
+        """
+        events = []
+        while True:
+            try:
+                events.append(self.responses.get_nowait())
+            except queue.Empty:
+                return events
+
+    def speech_finished(self):
+        """Call once the chatbot has finished speaking a response, lets the next queued request start."""
+        self.spoken.set()
+
+    def stop(self):
+        """Cancel everything and let the worker thread exit."""
+        with self.lock:
+            for cancel_event in self.pending:
+                cancel_event.set()
+        self.spoken.set()
+        self.requests.put((None, None, None))
+
+    def _run(self):
+        """Worker loop, generates responses one at a time in the order they were submitted."""
+        while True:
+            text, cancel_event, submitted = self.requests.get()
+            if cancel_event is None:
+                return
+
+            # Wait for the last response to be spoken, the chatbot speaks as it generates
+            self.spoken.wait()
+
+            response = None
+            if not cancel_event.is_set():
+                TRACER.record("turn.queued", submitted)  # time spent waiting behind other requests
+                if self.policy == "queue":
+                    self.spoken.clear()
+                self.responses.put(("start", None))
+                try:
+                    response = self._respond(text, cancel_event)
+                except Exception as e:
+                    print("Error generating response:", e)
+
+            with self.lock:
+                self.pending.remove(cancel_event)
+
+            # Nothing will be spoken for a failed or cancelled request
+            if response is None or cancel_event.is_set():
+                self.spoken.set()
+
+            # Cancelled requests never finish in the window
+            if not cancel_event.is_set():
+                TRACER.record("turn.total", submitted)  # from pressing enter to the whole response
+                self.responses.put(("done", response))
+
+    def _respond(self, text, cancel_event):
+        """Run the chatbot for one request, passing streamed pieces on as they arrive."""
+        result = self.respond(text, cancel_event)
+        if result is None or isinstance(result, str):
+            return result
+
+        pieces = []
+        for piece in result:
+            if cancel_event.is_set():
+                break
+            pieces.append(piece)
+            self.responses.put(("piece", piece))
+        return "".join(pieces)
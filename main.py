@@ -1,25 +1,42 @@
+# Times the imports below when BONZI_PROFILE_IMPORTS is set, must come first
+import import_profiler
+
 # python library imports
 import pygame
 import sys
+import time
 
 # my imports
 from settings import Settings
 from animations import Animation
 from buttons import Button
 from bonzi_input import InputBox
-from bonzi_gpt import BonziGPT
+from inference_worker import InferenceWorker
+from background_loader import BackgroundLoader
+from dirty_rects import DirtyRenderer
+from timeline import Timeline
+from tracing import TRACER, configure_tracing, traced
 
 
 class Bonzi:
     """Main class for the simplified BonziBUDDY program."""
     def __init__(self):
         """Initialize the program."""
+        # Used to report how long the first frame and the chatbot take to be ready
+        self.start_time = time.perf_counter()
+        self.first_frame_seconds = None
+
         pygame.init()
 
         # Class instances
         self.settings = Settings()  # Look at settings.py to see options
+        configure_tracing(self.settings)  # times the hot paths if trace_enabled is set, see tracing.py
         self.animations = Animation(self)
-        self.chatbot = BonziGPT(self, "personality.txt")  # pass the text_file the GPT-2 model will be trained on
+
+        # Load the GPT-2 chatbot in the background so the window and arrive animation show right away
+        self.chatbot = None
+        self.inference = None
+        self.chatbot_loader = BackgroundLoader(self.load_chatbot)
 
         # Create the main window
         self.window = pygame.display.set_mode((self.settings.window_width, self.settings.window_height))
@@ -29,6 +46,12 @@ class Bonzi:
         self.background = pygame.image.load(self.settings.background_image)
         self.background = pygame.transform.scale(self.background, (self.settings.window_width, self.settings.window_height))
 
+        # Decode every animation frame up front now that the display format is known
+        self.animations.preload_frames()
+
+        # Only the parts of the window that changed are redrawn each frame
+        self.renderer = DirtyRenderer(self.window, self.background, self.settings.dirty_rects)
+
         # Boolean if program is running
         self.running = True
 
@@ -41,8 +64,8 @@ class Bonzi:
         # Create clock for frame rate
         self.clock = pygame.time.Clock()
 
-        # Set current animation frame to 0
-        self.current_frame = 0
+        # Plays Bonzi's animations by elapsed time, so the frame rate doesn't change their speed
+        self.timeline = Timeline()
 
         # Create buttons
         button_messages = ["Say Hello", "Do a Trick", "Be Cool"]
@@ -59,7 +82,9 @@ class Bonzi:
         # Create a user input box
         self.input_box = InputBox(self, 10, 10, self.settings.input_box_width, self.settings.input_box_height)
 
-        # Initialize Bonzi's rect
+        # Initialize Bonzi's current frame, its image and rect
+        self.frame_path = None
+        self.image = None
         self.rect = None
 
         # Initialize chat bubble
@@ -72,25 +97,36 @@ class Bonzi:
         """Runs the program."""
         while self.running:
             self.check_events()
+            self.check_chatbot_loaded()
+            self.check_responses()
             self.update_screen()
-            self.clock.tick(8)
+            TRACER.report_if_due()
+            self.clock.tick(self.settings.frame_rate)
 
+    @traced("frame.update_screen")
     def update_screen(self):
         """Update the screen to most recent changes."""
-        # Redraw the screen
-        self.window.blit(self.background, (0, 0))
+        # Pick Bonzi's frame for this tick
         self.draw_bonzi(self.current_animation)
-        self.input_box.draw_box()
 
+        # Everything on screen in drawing order as (name, rect, state, draw), a layer is only
+        # redrawn when its rect or state changes or it overlaps one that did
+        layers = [("bonzi", self.rect, self.frame_path, self.blit_bonzi),
+                  ("input_box", self.input_box.rect, self.input_box.draw_state(), self.input_box.draw_box)]
         for button in self.buttons:
-            button.draw_button()
+            layers.append((button.msg, button.rect, None, button.draw_button))
 
         # Draw the chat bubble
         if self.chat_bubble:
-            self.chat_bubble.draw_bubble()
+            layers.append(("chat_bubble", self.chat_bubble.get_rect(), self.chat_bubble.text,
+                           self.chat_bubble.draw_bubble))
 
         # Show changes
-        pygame.display.flip()
+        self.renderer.draw(layers)
+
+        if self.first_frame_seconds is None:
+            self.first_frame_seconds = time.perf_counter() - self.start_time
+            print(f"First frame shown after {self.first_frame_seconds:.2f}s")
 
     def check_events(self):
         """Check for events in the program."""
@@ -99,7 +135,7 @@ class Bonzi:
             if event.type == pygame.QUIT:
                 self.startup = False
                 self.shutting_down = True
-                self.current_frame = 0   # Stop current animation, begin goodbye animation
+                self.timeline.stop()   # Stop current animation, begin goodbye animation
                 self.current_animation = "goodbye"
 
             # Check for mouse click on buttons
@@ -110,9 +146,57 @@ class Bonzi:
                 # Update last interaction time for any event
                 self.last_interaction = pygame.time.get_ticks()
 
+            # The window's contents were lost, e.g. it was covered up, so draw everything again
+            if event.type == pygame.VIDEOEXPOSE:
+                self.renderer.invalidate()
+
             # Check events for the input box
             self.input_box.handle_event(event)
 
+    def load_chatbot(self):
+        """Import and build the GPT-2 chatbot, runs on the background loader thread."""
+        if self.settings.inference_server_url:
+            # The model runs in a shared server, so torch isn't needed here
+            from inference_server import RemoteBonziGPT
+            return RemoteBonziGPT(self, self.settings.inference_server_url)
+        from bonzi_gpt import BonziGPT  # transformers and torch take a while to import
+        return BonziGPT(self, "personality.txt")  # pass the text_file the GPT-2 model will be trained on
+
+    def check_chatbot_loaded(self):
+        """Start the inference worker once the background loader has finished the chatbot."""
+        if self.chatbot is not None or not self.chatbot_loader.done.is_set():
+            return
+
+        if self.chatbot_loader.failed:
+            self.input_box.set_loading("Bonzi's brain failed to load.")
+            return
+
+        self.chatbot = self.chatbot_loader.result
+
+        # Run the chatbot on a background thread so generating a response doesn't freeze the window
+        # Streaming shows the response in the chat bubble word by word as it is generated
+        respond = self.chatbot.stream_response if self.settings.stream_responses else self.chatbot.get_response
+        self.inference = InferenceWorker(respond, self.settings.inference_busy_policy)
+        self.input_box.set_loading(None)
+
+        ready_seconds = time.perf_counter() - self.start_time
+        print(f"Chatbot ready after {ready_seconds:.2f}s (loading took {self.chatbot_loader.seconds:.2f}s)")
+        import_profiler.report()
+
+    def check_responses(self):
+        """Show any response text the inference worker has produced."""
+        if self.inference is None:
+            return
+
+        for kind, text in self.inference.poll():
+            if kind == "start":
+                self.chat_bubble = None
+                self.input_box.processing_tts = True  # a queued response starts after the last one was spoken
+            elif kind == "piece":
+                self.input_box.show_piece(text)
+            else:
+                self.input_box.show_response(text)
+
     def check_button_click(self, mouse_pos):
         """Check if a button was clicked, does action displayed on button."""
         # Only process button clicks after the startup animation is done
@@ -126,28 +210,32 @@ class Bonzi:
                     elif button.msg == "Be Cool":
                         self.current_animation = "glasses"
 
-                    # Reset the current frame counter to 0 when a button is clicked
-                    self.current_frame = 0
+                    # Start the animation from the beginning when a button is clicked
+                    self.timeline.stop()
 
     def draw_bonzi(self, animation_name=None):
         """Take Bonzi's animations and call the function to display them."""
 
         if self.startup:
-            frames = self.animations.get_animation("arrive")
+            name = "arrive"
         elif animation_name:
-            frames = self.animations.get_animation(animation_name)
+            name = animation_name
         elif pygame.time.get_ticks() - self.last_interaction > 9000:
-            frames = self.animations.get_animation("idle")
+            name = "idle"
             self.current_animation = "idle"
         else:
-            frames = self.animations.get_animation("nothing")
-        self.execute_animation(frames)
+            name = "nothing"
+        self.execute_animation(name)
 
-    def execute_animation(self, frames):
-        """Displays each frame in passed list from draw_bonzi()"""
-        if self.current_frame >= len(frames):
-            self.current_frame = 0  # Go back to the first frame
+    def execute_animation(self, name):
+        """Picks the frame of the animation from draw_bonzi() that is due now"""
+        if self.timeline.name != name:
+            self.timeline.play(name, self.animations.get_animation(name))
 
+        # If Bonzi is talking, loop through his speaking frames until he is done
+        frame = self.timeline.update(looping=self.input_box.processing_tts)
+
+        if frame is None:
             if self.shutting_down:  # Let Bonzi finish his leaving animation before closing program
                 sys.exit()
 
@@ -164,24 +252,18 @@ class Bonzi:
             self.current_animation = None
 
         else:
-            frame = frames[self.current_frame]
             self.load_bonzi_image(frame)
 
-            # If Bonzi is talking, loop through his speaking frames until he is done
-            if self.input_box.processing_tts:
-                if "0040.bmp" in frame:   # 0040.bmp is his last speaking frame, move back index if not done speaking
-                    self.current_frame -= 5
-                else:
-                    self.current_frame += 1
-            else:
-                self.current_frame += 1
-
+    @traced("frame.load_image")
     def load_bonzi_image(self, image):
-        """Load Bonzi's current image frame, set color key and rect, blit to window."""
-        image = pygame.image.load(image)
-        image.set_colorkey(self.settings.color_screen)
-        self.rect = image.get_rect(center=(self.settings.window_width // 2, self.settings.window_height // 1.4))
-        self.window.blit(image, self.rect)
+        """Get Bonzi's current image frame from the frame cache and set rect, blit_bonzi() draws it."""
+        self.frame_path = image
+        self.image = self.animations.get_frame(image)
+        self.rect = self.image.get_rect(center=(self.settings.window_width // 2, self.settings.window_height // 1.4))
+
+    def blit_bonzi(self):
+        """Blit Bonzi's current frame to the window."""
+        self.window.blit(self.image, self.rect)
 
 
 # Run the program
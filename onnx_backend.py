@@ -0,0 +1,268 @@
+"""Export Bonzi's GPT-2 model to ONNX and run it with ONNX Runtime on the CPU.
+
+    python onnx_backend.py                       # bonzi_model -> bonzi_model_onnx/model.onnx and model_int8.onnx
+    python onnx_backend.py --check               # also compare greedy replies with PyTorch
+
+The exported model takes the key/value cache as inputs and returns the new one as outputs, so each
+step only runs the new tokens. Set inference_backend = "onnx" in settings.py to use it.
+"""
+import argparse
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from transformers import GPT2Config, LogitsProcessorList, TemperatureLogitsWarper, TopPLogitsWarper
+
+from cpu_inference import newest_change
+
+
+ONNX_FILE = "model.onnx"
+ONNX_INT8_FILE = "model_int8.onnx"
+
+
+def cache_from_tensors(past):
+    """Turn a list of (key, value) tensors per layer into the cache type this transformers version expects."""
+    from transformers import DynamicCache
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(tuple(past))
+    return DynamicCache(past)
+
+
+def cache_to_tensors(cache):
+    """Return a list of (key, value) tensors per layer from a transformers cache."""
+    if isinstance(cache, tuple):
+        return list(cache)
+    if hasattr(cache, "to_legacy_cache"):
+        return list(cache.to_legacy_cache())
+    return [(layer.keys, layer.values) for layer in cache.layers]
+
+
+class ExportWrapper(torch.nn.Module):
+    """GPT-2 with its cache as flat tensor inputs and outputs, which is what ONNX needs."""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        self.n_layer = model.config.n_layer
+
+    def forward(self, input_ids, attention_mask, position_ids, *past):
+        cache = cache_from_tensors([(past[2 * i], past[2 * i + 1]) for i in range(self.n_layer)])
+        output = self.model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                            past_key_values=cache, use_cache=True)
+        return (output.logits, *[tensor for pair in cache_to_tensors(output.past_key_values) for tensor in pair])
+
+
+def export_onnx(model_dir="bonzi_model", output_dir="bonzi_model_onnx", int8=True):
+    """Export the trained model to output_dir, with an int8 copy of it if int8 is True."""
+    from transformers import GPT2LMHeadModel
+
+    # Eager attention traces to plain ONNX operators
+    model = GPT2LMHeadModel.from_pretrained(model_dir, attn_implementation="eager").eval()
+    config = model.config
+    head_dim = config.n_embd // config.n_head
+    os.makedirs(output_dir, exist_ok=True)
+    config.save_pretrained(output_dir)  # the backend reads the layer sizes from here
+    path = os.path.join(output_dir, ONNX_FILE)
+
+    # Example inputs: 2 new tokens after 3 cached ones, every length is marked dynamic below
+    past = [torch.zeros(1, config.n_head, 3, head_dim) for _ in range(2 * config.n_layer)]
+    inputs = (torch.ones(1, 2, dtype=torch.long), torch.ones(1, 5, dtype=torch.long),
+              torch.tensor([[3, 4]]), *past)
+
+    past_names = [f"past_{kind}_{i}" for i in range(config.n_layer) for kind in ("key", "value")]
+    present_names = [f"present_{kind}_{i}" for i in range(config.n_layer) for kind in ("key", "value")]
+    dynamic_axes = {"input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "total_sequence"},
+                    "position_ids": {0: "batch", 1: "sequence"},
+                    "logits": {0: "batch", 1: "sequence"}}
+    for name in past_names:
+        dynamic_axes[name] = {0: "batch", 2: "past_sequence"}
+    for name in present_names:
+        dynamic_axes[name] = {0: "batch", 2: "total_sequence"}
+
+    with torch.no_grad():
+        torch.onnx.export(ExportWrapper(model), inputs, path,
+                          input_names=["input_ids", "attention_mask", "position_ids", *past_names],
+                          output_names=["logits", *present_names],
+                          dynamic_axes=dynamic_axes, opset_version=17, dynamo=False)
+    print(f"Saved {path}")
+
+    if int8:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        int8_path = os.path.join(output_dir, ONNX_INT8_FILE)
+        quantize_dynamic(path, int8_path, weight_type=QuantType.QInt8)
+        print(f"Saved {int8_path}")
+
+
+class OnnxBackend:
+    """A class for running GPT-2 with ONNX Runtime, with a generate() that takes the same arguments BonziGPT uses."""
+    def __init__(self, path, config, threads=None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+        self.path = path
+        self.n_layer = config.n_layer
+        self.n_head = config.n_head
+        self.head_dim = config.n_embd // config.n_head
+        self.n_positions = config.n_positions
+        self.eos_token_id = config.eos_token_id
+
+    def cache_key(self):
+        """Return what a cache built by this backend depends on."""
+        return ("onnx", self.path)
+
+    def forward(self, input_ids, attention_mask, position_ids, past):
+        """Run the new tokens and return the logits and the cache with them added."""
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask, "position_ids": position_ids}
+        for i, (key, value) in enumerate(past):
+            feeds[f"past_key_{i}"] = key
+            feeds[f"past_value_{i}"] = value
+        outputs = self.session.run(None, feeds)
+        return outputs[0], list(zip(outputs[1::2], outputs[2::2]))
+
+    def empty_cache(self, batch=1):
+        empty = np.zeros((batch, self.n_head, 0, self.head_dim), dtype=np.float32)
+        return [(empty, empty) for _ in range(self.n_layer)]
+
+    def prefill(self, tokens):
+        """Return the cache for a list of token ids."""
+        input_ids = np.array([tokens], dtype=np.int64)
+        _, past = self.forward(input_ids, np.ones_like(input_ids), np.arange(len(tokens))[None], self.empty_cache())
+        return past
+
+    def generate(self, inputs, attention_mask=None, past_key_values=None, max_length=None, max_new_tokens=None,
+                 min_new_tokens=0, do_sample=False, temperature=1.0, top_p=1.0, pad_token_id=None,
+                 stopping_criteria=None, streamer=None, return_dict_in_generate=False, **unused):
+        """Generate like model.generate(), past_key_values is a cache from this backend covering the start of inputs."""
+        ids = inputs.numpy()
+        batch, length = ids.shape
+        mask = attention_mask.numpy().astype(np.int64) if attention_mask is not None else np.ones_like(ids)
+        past = past_key_values if past_key_values is not None else self.empty_cache(batch)
+        if max_new_tokens is None:
+            max_new_tokens = max_length - length
+        pad_token_id = self.eos_token_id if pad_token_id is None else pad_token_id
+
+        # The same temperature and top_p processing model.generate() uses, so replies are sampled the same way
+        warpers = LogitsProcessorList()
+        if do_sample:
+            warpers.append(TemperatureLogitsWarper(temperature))
+            if top_p < 1.0:
+                warpers.append(TopPLogitsWarper(top_p))
+
+        if streamer is not None:
+            streamer.put(inputs)
+
+        finished = np.zeros(batch, dtype=bool)
+        step_ids = ids[:, past[0][0].shape[2]:]  # only what the cache doesn't cover yet
+        for step in range(max_new_tokens):
+            # Left padding doesn't take up positions
+            positions = np.clip(mask.cumsum(-1) - 1, 0, None)[:, -step_ids.shape[1]:]
+            logits, past = self.forward(step_ids, mask, positions, past)
+            scores = torch.from_numpy(logits[:, -1, :].astype(np.float32))
+            if step < min_new_tokens:
+                scores[:, self.eos_token_id] = -float("inf")
+
+            if do_sample:
+                scores = warpers(torch.from_numpy(ids), scores)
+                next_tokens = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1)[:, 0].numpy()
+            else:
+                next_tokens = scores.argmax(dim=-1).numpy()
+            next_tokens = np.where(finished, pad_token_id, next_tokens)
+
+            ids = np.concatenate([ids, next_tokens[:, None]], axis=1)
+            mask = np.concatenate([mask, np.ones((batch, 1), dtype=np.int64)], axis=1)
+            if streamer is not None:
+                streamer.put(torch.from_numpy(next_tokens))
+
+            finished |= next_tokens == self.eos_token_id
+            if finished.all():
+                break
+            if stopping_criteria is not None and torch.as_tensor(stopping_criteria(torch.from_numpy(ids), scores)).all():
+                break
+            step_ids = next_tokens[:, None]
+
+        if streamer is not None:
+            streamer.end()
+
+        sequences = torch.from_numpy(ids)
+        if return_dict_in_generate:
+            # Like model.generate(), the cache covers every token but the last one
+            return SimpleNamespace(sequences=sequences, past_key_values=past)
+        return sequences
+
+
+def load_onnx_backend(settings, model_dir="bonzi_model"):
+    """Load the exported model for the inference mode in Settings, or None if it is missing or out of date."""
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        print("onnxruntime is not installed, running the model with PyTorch instead.")
+        return None
+
+    int8 = settings.inference_mode == "int8"
+    if settings.inference_mode == "bf16":
+        print("The ONNX backend has no bf16 mode, running it in float32 instead.")
+    path = os.path.join(settings.onnx_model_dir, ONNX_INT8_FILE if int8 else ONNX_FILE)
+
+    # The model is trained with PyTorch first, so without a trained model there is nothing to export yet
+    if not os.path.exists(model_dir):
+        return None
+    if not os.path.exists(path):
+        print(f"No ONNX model at {path}, export one with onnx_backend.py. Running the model with PyTorch instead.")
+        return None
+    if os.path.getmtime(path) < newest_change(model_dir):
+        print(f"{path} is older than {model_dir}, export it again with onnx_backend.py. "
+              "Running the model with PyTorch instead.")
+        return None
+    try:
+        return OnnxBackend(path, GPT2Config.from_pretrained(settings.onnx_model_dir), settings.inference_threads)
+    except Exception as e:
+        print("Error loading the ONNX model, running the model with PyTorch instead:", e)
+        return None
+
+
+def check_parity(model_dir, output_dir, prompts, new_tokens=20):
+    """Compare greedy replies from PyTorch and the exported models, returns True if they all match."""
+    from transformers import GPT2LMHeadModel, GPT2Tokenizer
+
+    tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
+    model = GPT2LMHeadModel.from_pretrained(model_dir).eval()
+    config = model.config
+    matched = True
+    for name in (ONNX_FILE, ONNX_INT8_FILE):
+        path = os.path.join(output_dir, name)
+        if not os.path.exists(path):
+            continue
+        backend = OnnxBackend(path, config)
+        same = 0
+        for prompt in prompts:
+            inputs = tokenizer.encode(prompt, return_tensors="pt")
+            with torch.inference_mode():
+                expected = model.generate(inputs, attention_mask=torch.ones_like(inputs), max_new_tokens=new_tokens,
+                                          do_sample=False, pad_token_id=tokenizer.eos_token_id)
+            result = backend.generate(inputs, max_new_tokens=new_tokens, pad_token_id=tokenizer.eos_token_id)
+            same += torch.equal(expected, result)
+        print(f"{name}: {same} of {len(prompts)} greedy replies match PyTorch")
+        # int8 weights round differently, so only the float32 export has to match exactly
+        matched = matched and (same == len(prompts) or name == ONNX_INT8_FILE)
+    return matched
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-dir", default="bonzi_model")
+    parser.add_argument("--output-dir", default="bonzi_model_onnx")
+    parser.add_argument("--no-int8", action="store_true", help="skip the int8 copy")
+    parser.add_argument("--check", action="store_true", help="compare greedy replies with PyTorch after exporting")
+    args = parser.parse_args()
+
+    export_onnx(args.model_dir, args.output_dir, not args.no_int8)
+    if args.check:
+        prompts = ["Hello!", "What is your name?", "Can you tell me a joke?", "How are you feeling today, Bonzi?"]
+        if not check_parity(args.model_dir, args.output_dir, prompts):
+            raise SystemExit("The float32 export doesn't match PyTorch")
@@ -0,0 +1,67 @@
+import copy
+import hashlib
+import os
+
+
+class PersonaPrefix:
+    """A class for a persona text placed before every prompt, along with GPT-2's key/value cache for it.
+
+    The cache is built once and handed to every generate() call, so the persona adds nothing to the
+    time it takes to read a prompt. It is rebuilt when the text, the file it came from or the model changes.
+    """
+    def __init__(self, tokenizer, prompt=None, path=None, max_tokens=256):
+        """Use the file at path if there is one, otherwise the prompt string. Longer personas are cut to max_tokens."""
+        self.tokenizer = tokenizer
+        self.prompt = prompt
+        self.path = path
+        self.max_tokens = max_tokens
+
+        # The file's text and modified time, so it is only read again after it changes
+        self.file_text = None
+        self.file_time = None
+
+        # What the cache was built for, the persona's token ids and the cache itself
+        self.key = None
+        self.tokens = []
+        self.past_key_values = None
+
+        # Counter to see how often the cache had to be built
+        self.builds = 0
+
+    def text(self):
+        """Return the persona text."""
+        if not self.path:
+            return self.prompt or ""
+        try:
+            file_time = os.stat(self.path).st_mtime_ns
+            if file_time != self.file_time:
+                with open(self.path, encoding="utf-8") as file:
+                    self.file_text = file.read()
+                self.file_time = file_time
+        except OSError as e:
+            print("Error reading persona file:", e)
+        return self.file_text or self.prompt or ""
+
+    def fingerprint(self):
+        """Return a hash of the persona text, e.g. for response cache keys."""
+        return hashlib.sha1(self.text().encode("utf-8")).hexdigest()
+
+    def load(self, backend):
+        """Return the persona's token ids, building its cache first if the text or the model has changed.
+
+        backend is what runs the model, see TorchBackend in bonzi_gpt.py and OnnxBackend in onnx_backend.py.
+        """
+        key = (backend.cache_key(), self.fingerprint(), self.max_tokens)
+        if key == self.key:
+            return self.tokens
+
+        text = self.text()
+        self.tokens = self.tokenizer.encode(text)[:self.max_tokens] if text.strip() else []
+        self.past_key_values = backend.prefill(self.tokens) if self.tokens else None
+        self.key = key
+        self.builds += 1
+        return self.tokens
+
+    def cache(self):
+        """Return a copy of the cache for one generate() call, newer transformers versions add to it in place."""
+        return copy.deepcopy(self.past_key_values)
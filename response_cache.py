@@ -0,0 +1,128 @@
+import hashlib
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize(text):
+    """Return the input text in the form used for cache keys, so "Hi!" and "hi" share an entry."""
+    text = re.sub(r"\s+", " ", text.casefold()).strip()
+    return text.rstrip(".!? ")
+
+
+class ResponseCache:
+    """A class for remembering chatbot replies to inputs that have been seen before.
+
+    Recent keys are kept in memory, least recently used first out, and every reply is also saved
+    to an SQLite file so the cache survives restarts. Replies older than ttl_seconds are ignored.
+
+    With variants above 1 each key collects that many different replies before the cache answers,
+    then picks one of them at random, so a sampled chatbot doesn't always say the same thing.
+    """
+    def __init__(self, path, max_entries=256, ttl_seconds=None, variants=1):
+        """Open or create the cache file, ttl_seconds of None means replies never expire."""
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.variants = max(1, variants)
+
+        # Key -> list of (reply, created time), ordered so the least recently used key is first
+        self.memory = OrderedDict()
+
+        # Replies are looked up and added from the inference worker, the window thread can read stats()
+        self.lock = threading.Lock()
+        self.database = sqlite3.connect(path, check_same_thread=False)
+        self.database.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT, response TEXT, created REAL)")
+        self.database.execute("CREATE INDEX IF NOT EXISTS responses_key ON responses (key)")
+        if self.ttl_seconds is not None:
+            self.database.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl_seconds,))
+        self.database.commit()
+
+        # Counters to see how well the cache is doing
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def key(self, text, settings=None):
+        """Return the cache key for an input and the generation settings that shape its reply."""
+        return hashlib.sha1(json.dumps([normalize(text), settings], sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return a cached reply for the key, or None if it should be generated."""
+        with self.lock:
+            replies = self._replies(key)
+            if len(replies) < self.variants:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return random.choice(replies)[0]
+
+    def put(self, key, response):
+        """Remember a reply, a key that already has all its variants keeps the ones it has."""
+        if not response:
+            return
+        with self.lock:
+            replies = self._replies(key)
+            if len(replies) >= self.variants or any(reply == response for reply, _ in replies):
+                return
+            created = time.time()
+            replies.append((response, created))
+            self.database.execute("INSERT INTO responses VALUES (?, ?, ?)", (key, response, created))
+            self.database.commit()
+
+    def stats(self):
+        """Return a dictionary of the cache counters."""
+        with self.lock:
+            return {"keys": len(self.memory), "hits": self.hits, "misses": self.misses, "expired": self.expired}
+
+    def close(self):
+        self.database.close()
+
+    def _replies(self, key):
+        """Return the live replies for a key, loading them from disk if they aren't in memory."""
+        replies = self.memory.get(key)
+        if replies is None:
+            rows = self.database.execute("SELECT response, created FROM responses WHERE key = ? ORDER BY created",
+                                         (key,)).fetchall()
+            replies = [tuple(row) for row in rows]
+            self.memory[key] = replies
+        self.memory.move_to_end(key)
+
+        # Drop replies past their time to live, from memory and from disk
+        if self.ttl_seconds is not None:
+            oldest = time.time() - self.ttl_seconds
+            live = [reply for reply in replies if reply[1] >= oldest]
+            if len(live) < len(replies):
+                self.expired += len(replies) - len(live)
+                replies[:] = live
+                self.database.execute("DELETE FROM responses WHERE key = ? AND created < ?", (key, oldest))
+                self.database.commit()
+
+        # Only the memory copy is bounded, the file keeps everything until it expires
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+        return replies
+
+
+def cache_pieces(pieces, cache, key):
+    """Pass streamed pieces on, then remember the whole reply if the stream finished without an error."""
+    text = []
+    for piece in pieces:
+        text.append(piece)
+        yield piece
+    cache.put(key, "".join(text))
+
+
+def open_response_cache(settings):
+    """Return the response cache described in Settings, or None if it is turned off."""
+    if not settings.response_cache_path:
+        return None
+    try:
+        return ResponseCache(settings.response_cache_path, settings.response_cache_max_entries,
+                             settings.response_cache_ttl, settings.response_cache_variants)
+    except sqlite3.Error as e:
+        print("Response cache turned off, could not open it:", e)
+        return None
@@ -15,6 +15,12 @@ class Settings:
         # Color used for color keying Bonzi
         self.color_screen = "#04fcfc"
 
+        # Frames drawn per second, animations play at the same speed whatever this is
+        self.frame_rate = 30
+
+        # Only redraw the parts of the window that changed each frame, False redraws everything
+        self.dirty_rects = True
+
         # Input box dimensions
         self.input_box_width = 715
         self.input_box_height = 70
@@ -23,4 +29,81 @@ class Settings:
         self.rate = 225  # words per minute
         self.volume = 1.0  # range from 0.0 to 1.0
 
+        # Memory cap in bytes for decoded animation frames, None keeps every frame loaded
+        self.frame_cache_max_bytes = None
+
+        # Packed sprite atlas built by sprite_atlas.py, loose frame folders are used if it is missing
+        self.atlas_image = "atlas/bonzi_atlas.png"
+        self.atlas_index = "atlas/bonzi_atlas.json"
+
+        # What to do when Enter is pressed while Bonzi is still responding: "drop", "queue" or "cancel"
+        # "queue" starts each waiting message once Bonzi has finished speaking the response before it
+        self.inference_busy_policy = "drop"
+
+        # Show GPT-2's response in the chat bubble as it is generated instead of all at once
+        self.stream_responses = True
+
+        # Persona put before every prompt, from a file like "personality.txt" or a short string, None for neither.
+        # GPT-2's cache of it is built once at startup and again whenever it changes.
+        self.persona_file = None
+        self.persona_prompt = None
+        self.persona_max_tokens = 256  # longer personas are cut, they share GPT-2's 1024 tokens with the conversation
+
+        # Smaller model made by draft_model.py, e.g. "bonzi_draft", that guesses a few tokens ahead for GPT-2
+        # to check at once. Replies are sampled the same as without it, None turns it off.
+        self.draft_model_dir = None
+        self.draft_tokens = 5  # tokens guessed at a time to start with, adjusted by how many get accepted
+
+        # True remembers earlier turns of the conversation, GPT-2 reuses its cache of them so only new text is encoded
+        self.conversation_memory = False
+
+        # File to remember replies to repeated inputs in, e.g. "response_cache.sqlite3", None turns it off
+        self.response_cache_path = None
+        self.response_cache_max_entries = 256  # inputs kept in memory, the file holds the rest
+        self.response_cache_ttl = 7 * 24 * 60 * 60  # seconds before a reply is forgotten, None keeps it
+        # Different replies to collect per input before the cache answers, picked between at random
+        self.response_cache_variants = 3
+
+        # Folder for cached text-to-speech audio, e.g. "speech_cache", None turns the cache off.
+        # A sentence that isn't cached yet is rendered to a file before it plays, which is slower than
+        # speaking it directly, so it pays off for phrases Bonzi repeats like speech_warmup_phrases.
+        self.speech_cache_dir = None
+        self.speech_cache_max_bytes = 50 * 1024 * 1024
+
+        # Phrases to render into the speech cache at startup so they play instantly
+        self.speech_warmup_phrases = []
+
+        # How GPT-2 runs on the CPU: "float32", "int8" (dynamic quantization) or "bf16" (if the CPU supports it)
+        self.inference_mode = "float32"
+
+        # Saved int8 model, made the first time int8 mode runs and reused after that
+        self.quantized_model_path = "bonzi_model_int8.pt"
+
+        # What runs GPT-2: "pytorch", or "onnx" for ONNX Runtime with a model exported by onnx_backend.py
+        self.inference_backend = "pytorch"
+        self.onnx_model_dir = "bonzi_model_onnx"  # int8 mode uses the int8 export in here
+
+        # Fine-tuning, used the first time Bonzi starts without a trained bonzi_model
+        self.train_block_size = 128  # tokens per packed training example, lines are joined to fill it
+        self.train_batch_size = 4
+        self.train_gradient_accumulation = 1  # batches added up before each optimizer step
+        # Packed blocks hold several lines each, so a small file makes few steps, raise this if he doesn't learn
+        self.train_epochs = 2
+        self.train_learning_rate = 5e-5
+        self.train_workers = None  # tokenizer processes, None picks from the file size
+        self.training_cache_dir = "training_cache"  # tokenized text files, None turns the cache off
+
+        # Threads PyTorch uses for each operation, None lets PyTorch decide
+        self.inference_threads = None
+
+        # A shared inference_server.py to ask for responses instead of loading GPT-2 in this window,
+        # e.g. "http://127.0.0.1:8600/v1/chat/completions", None runs the model here
+        self.inference_server_url = None
+        self.inference_server_timeout = 120  # seconds to wait for a response
 
+        # Hot-path timings, see tracing.py. A p50/p95/p99 summary of each stage is printed every
+        # trace_summary_seconds, and trace_file (e.g. "bonzi_trace.json") gets Chrome trace JSON on exit
+        self.trace_enabled = False
+        self.trace_buffer_size = 10000  # spans kept, the oldest are dropped
+        self.trace_summary_seconds = 30  # None turns the printed summary off
+        self.trace_file = None
@@ -0,0 +1,252 @@
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+import pygame
+import pyttsx3
+
+from tracing import traced
+
+
+# A sentence ends at . ! ? (plus any closing quotes or brackets) followed by whitespace, or at a new line
+SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*\s+|\n+")
+
+
+class SentenceSplitter:
+    """A class for cutting streamed text into whole sentences."""
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, text):
+        """Add streamed text and return every sentence it completed."""
+        self.buffer += text
+
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self.buffer):
+            sentence = self.buffer[start:match.end()].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = match.end()
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self):
+        """Return whatever is left over once the stream has ended."""
+        rest = self.buffer.strip()
+        self.buffer = ""
+        return [rest] if rest else []
+
+
+class SpeechCache:
+    """A class for keeping rendered speech on disk, keyed by the text and the voice settings."""
+    def __init__(self, directory, max_bytes):
+        """Create the cache folder, files are evicted least recently used first once over max_bytes."""
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Counters to see how well the cache is doing
+        self.hits = 0
+        self.misses = 0
+
+    def path_for(self, text, voice, rate, volume):
+        """Return the audio file path for a sentence spoken with these voice settings."""
+        key = hashlib.sha1(json.dumps([text, voice, rate, volume]).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key + ".wav")
+
+    def lookup(self, path):
+        """Return True if the audio file is cached, marking it as recently used."""
+        if os.path.exists(path):
+            os.utime(path)  # the modified time doubles as the last used time
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, rendered_path, path):
+        """Move a freshly rendered audio file into the cache and evict old files if over the limit."""
+        os.replace(rendered_path, path)
+        self._evict()
+
+    def stats(self):
+        """Return a dictionary of the cache counters."""
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _evict(self):
+        """Delete the least recently used files until the cache fits in max_bytes."""
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".wav") and os.path.isfile(path):
+                info = os.stat(path)
+                files.append((info.st_mtime, info.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+
+class SpeechService:
+    """A class that owns Bonzi's text-to-speech engine and speaks queued sentences on one thread."""
+    def __init__(self, settings, voice_name="david"):
+        """Start the speech thread, the engine is created and only ever used on that thread."""
+        self.settings = settings
+        self.voice_name = voice_name
+        self.sentences = queue.Queue()
+
+        # Set to cut off the sentence being spoken
+        self.interrupted = threading.Event()
+
+        # Rate and volume last set on the engine, so they're only set again when Settings changes
+        self.engine = None
+        self.voice = None
+        self.applied_settings = None
+
+        # Rendered speech on disk, set up on the speech thread if Settings turns it on
+        self.cache = None
+
+        self.thread = threading.Thread(target=self._run, name="speech", daemon=True)  # thread closes with the program
+        self.thread.start()
+
+    def put(self, sentence):
+        """Queue a sentence to be spoken after everything already queued."""
+        self.sentences.put((sentence, None))
+
+    def speak(self, text, on_done=None):
+        """Queue a whole response sentence by sentence, then call on_done after the last one."""
+        splitter = SentenceSplitter()
+        for sentence in splitter.feed(text) + splitter.flush():
+            self.put(sentence)
+        self.end(on_done)
+
+    def end(self, on_done):
+        """Call on_done on the speech thread once every sentence queued before it has been spoken."""
+        self.sentences.put((None, on_done))
+
+    def cancel(self):
+        """Stop the sentence being spoken and throw away everything still queued, including on_done calls."""
+        while True:
+            try:
+                self.sentences.get_nowait()
+            except queue.Empty:
+                break
+        self.interrupted.set()
+
+    def _run(self):
+        """Speech loop."""
+        try:
+            self.engine = pyttsx3.init()
+            self._resolve_voice()
+
+            # The engine can only be stopped safely from one of its own callbacks
+            self.engine.connect("started-word", self._on_word)
+        except Exception as e:
+            # Keep running without a voice so on_done calls still happen
+            print("Could not start text-to-speech:", e)
+            self.engine = None
+
+        if self.engine is not None and self.settings.speech_cache_dir:
+            self._start_cache()
+
+        while True:
+            sentence, on_done = self.sentences.get()
+            self.interrupted.clear()
+            try:
+                if sentence is not None:
+                    if self.engine is None:
+                        continue
+                    self._say(sentence)
+                elif on_done is not None:
+                    on_done()
+            except Exception as e:
+                print("Error during text-to-speech:", e)
+
+    def _start_cache(self):
+        """Open the speech cache and pre-render the warm-up phrases from Settings."""
+        try:
+            if not pygame.mixer.get_init():
+                pygame.mixer.init()
+            self.cache = SpeechCache(self.settings.speech_cache_dir, self.settings.speech_cache_max_bytes)
+        except (OSError, pygame.error) as e:
+            print("Speech cache turned off, could not start it:", e)
+            return
+
+        self._apply_settings()
+        for phrase in self.settings.speech_warmup_phrases:
+            splitter = SentenceSplitter()
+            for sentence in splitter.feed(phrase) + splitter.flush():
+                path = self._cache_path(sentence)
+                if not os.path.exists(path):
+                    self._render(sentence, path)
+
+    @traced("speech.say")
+    def _say(self, sentence):
+        """Speak one sentence, playing it from the speech cache when it has been rendered before."""
+        self._apply_settings()
+
+        if self.cache is None:
+            self.engine.say(sentence)
+            self.engine.runAndWait()
+            return
+
+        path = self._cache_path(sentence)
+        if not self.cache.lookup(path):
+            self._render(sentence, path)
+
+        if os.path.exists(path):
+            self._play(path)
+        else:
+            # The driver couldn't render to a file, speak it directly instead
+            self.engine.say(sentence)
+            self.engine.runAndWait()
+
+    def _cache_path(self, sentence):
+        """Return the speech cache file for a sentence with the current voice settings."""
+        return self.cache.path_for(sentence, self.voice, self.settings.rate, self.settings.volume)
+
+    @traced("speech.render")
+    def _render(self, sentence, path):
+        """Render a sentence to an audio file with the engine and add it to the speech cache."""
+        rendered_path = path + ".part.wav"
+        self.engine.save_to_file(sentence, rendered_path)
+        self.engine.runAndWait()
+        if os.path.exists(rendered_path):
+            self.cache.add(rendered_path, path)
+
+    def _play(self, path):
+        """Play a cached audio file, blocking until it finishes or cancel() is called."""
+        channel = pygame.mixer.Sound(path).play()
+        while channel is not None and channel.get_busy():
+            if self.interrupted.is_set():
+                channel.stop()
+                return
+            time.sleep(0.02)
+
+    def _resolve_voice(self):
+        """Look for the voice by name once, the engine's default voice is kept if it isn't installed."""
+        for voice in self.engine.getProperty("voices"):
+            if self.voice_name in voice.name.lower():
+                self.engine.setProperty("voice", voice.id)
+                break
+        self.voice = self.engine.getProperty("voice")
+
+    def _apply_settings(self):
+        """Set the rate and volume on the engine if they have changed in Settings."""
+        current = (self.settings.rate, self.settings.volume)
+        if current != self.applied_settings:
+            self.engine.setProperty("rate", self.settings.rate)  # words per minute
+            self.engine.setProperty("volume", self.settings.volume)  # volume level 0.0 to 1.0
+            self.applied_settings = current
+
+    def _on_word(self, name, location, length):
+        """Engine callback before each word, stops speaking if cancel() was called."""
+        if self.interrupted.is_set():
+            self.engine.stop()
@@ -0,0 +1,159 @@
+import fnmatch
+import glob
+import json
+import mmap
+import os
+
+import pygame
+
+
+# Frame globs for each animation, kept in the same order as the loose-file layout in animations.py.
+# talking/* also holds the talking/*.bmp frames bonzi_app.py lists, it picks those out with matching().
+ANIMATION_PATTERNS = {
+    "idle": "idle/*.bmp",
+    "arrive": "arrive/*.bmp",
+    "goodbye": "goodbye/*.bmp",
+    "backflip": "backflip/*.bmp",
+    "glasses": "glasses/*.bmp",
+    "wave": "wave/*.bmp",
+    "talking": "talking/*",
+}
+
+# Atlases wider than this start a new shelf of frames
+MAX_ATLAS_WIDTH = 2048
+
+
+class SpriteAtlas:
+    """A class for reading Bonzi's animation frames out of one packed atlas image."""
+    def __init__(self, image_path, index_path):
+        """Load the atlas index and image."""
+        with open(index_path, "r", encoding="utf-8") as index_file:
+            index = json.load(index_file)
+
+        # Frame order for each animation, the same paths the loose-file layout uses
+        self.animations = index["animations"]
+
+        # Rectangle in the atlas, trim offset and original size for each frame path
+        self.frames = index["frames"]
+
+        self.image = self._load_image(image_path)
+
+    @staticmethod
+    def _load_image(image_path):
+        """Load the atlas image, reading through a memory map when the platform allows it."""
+        with open(image_path, "rb") as image_file:
+            try:
+                with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    return pygame.image.load(mapped, os.path.basename(image_path))
+            except (OSError, ValueError, pygame.error):
+                image_file.seek(0)
+                return pygame.image.load(image_file, os.path.basename(image_path))
+
+    def matching(self, patterns):
+        """Return the frame order for each animation, keeping only the frames that match its glob in patterns.
+
+        For front ends that list fewer frames than the atlas holds, animations without a pattern are kept whole.
+        """
+        return {name: [path for path in frames if fnmatch.fnmatch(path, patterns[name])] if name in patterns
+                else frames
+                for name, frames in self.animations.items()}
+
+    def __contains__(self, path):
+        return path in self.frames
+
+    def get_frame(self, path):
+        """Rebuild a full size frame from its trimmed rectangle in the atlas."""
+        frame = self.frames[path]
+        x, y, width, height = frame["rect"]
+        offset_x, offset_y = frame["offset"]
+
+        # Pad the trimmed frame back out to its original size so it lines up like the loose file
+        image = pygame.Surface(frame["size"], pygame.SRCALPHA)
+        image.fill((0, 0, 0, 0))
+        image.blit(self.image, (offset_x, offset_y), (x, y, width, height), special_flags=pygame.BLEND_RGBA_MAX)
+        return image
+
+
+def find_atlas(settings):
+    """Return a SpriteAtlas if one has been built, otherwise None."""
+    if not (os.path.exists(settings.atlas_image) and os.path.exists(settings.atlas_index)):
+        return None
+    try:
+        return SpriteAtlas(settings.atlas_image, settings.atlas_index)
+    except (OSError, ValueError, KeyError, pygame.error) as e:
+        print("Could not load sprite atlas, using loose frames:", e)
+        return None
+
+
+def build_atlas(image_path, index_path, color_key="#04fcfc", patterns=ANIMATION_PATTERNS):
+    """Pack every animation frame into one image and write an index describing it."""
+    animations = {name: sorted(glob.glob(pattern)) for name, pattern in patterns.items()}
+
+    # Turn the color key into real transparency and trim each frame to the box around what is left
+    trimmed = {}
+    for frames in animations.values():
+        for path in frames:
+            if path in trimmed:
+                continue
+            trimmed[path] = _load_frame(path, color_key)
+
+    # Simple shelf packing, tallest frames first so each shelf wastes less space
+    placements = {}
+    shelf_x = shelf_y = shelf_height = atlas_width = 0
+    for path, (image, bounds) in sorted(trimmed.items(), key=lambda item: -item[1][1].height):
+        if shelf_x + bounds.width > MAX_ATLAS_WIDTH:
+            shelf_y += shelf_height
+            shelf_x = shelf_height = 0
+        placements[path] = pygame.Rect(shelf_x, shelf_y, bounds.width, bounds.height)
+        shelf_x += bounds.width
+        shelf_height = max(shelf_height, bounds.height)
+        atlas_width = max(atlas_width, shelf_x)
+    atlas_height = shelf_y + shelf_height
+
+    atlas = pygame.Surface((max(atlas_width, 1), max(atlas_height, 1)), pygame.SRCALPHA)
+    atlas.fill((0, 0, 0, 0))
+    frames_index = {}
+    for path, (image, bounds) in trimmed.items():
+        rect = placements[path]
+        atlas.blit(image, rect.topleft, bounds, special_flags=pygame.BLEND_RGBA_MAX)
+        frames_index[path] = {
+            "rect": [rect.x, rect.y, rect.width, rect.height],
+            "offset": [bounds.x, bounds.y],
+            "size": list(image.get_size()),
+        }
+
+    # "nothing" is Bonzi's neutral frame, it has no folder of its own
+    animations["nothing"] = ["idle/0999.bmp"]
+
+    os.makedirs(os.path.dirname(image_path) or ".", exist_ok=True)
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    pygame.image.save(atlas, image_path)
+    with open(index_path, "w", encoding="utf-8") as index_file:
+        json.dump({"animations": animations, "frames": frames_index}, index_file, indent=1)
+
+    return len(frames_index), atlas.get_size()
+
+
+def _load_frame(path, color_key):
+    """Load a frame as an RGBA surface with its color key made transparent, and its trimmed bounds."""
+    image = pygame.image.load(path)
+    image.set_colorkey(color_key)
+
+    frame = pygame.Surface(image.get_size(), pygame.SRCALPHA)
+    frame.fill((0, 0, 0, 0))
+    if image.get_flags() & pygame.SRCALPHA:
+        # Already has per-pixel alpha, copy it over untouched
+        frame.blit(image, (0, 0), special_flags=pygame.BLEND_RGBA_MAX)
+    else:
+        # A normal blit skips the color keyed pixels and leaves them transparent
+        frame.blit(image, (0, 0))
+    return frame, frame.get_bounding_rect()
+
+
+# Build the atlas from the loose animation folders
+if __name__ == '__main__':
+    from settings import Settings
+
+    settings = Settings()
+    count, size = build_atlas(settings.atlas_image, settings.atlas_index, settings.color_screen)
+    print(f"Packed {count} frames into a {size[0]}x{size[1]} atlas at {settings.atlas_image}")
@@ -0,0 +1,37 @@
+import pytest
+
+from benchmarks.chat_client import client_settings
+from benchmarks.fake_chat_server import FakeChatServer
+from chat_client import ChatClient
+
+
+@pytest.fixture
+def chat_server():
+    """Start the fake chat API on a free port, call it with FakeChatServer's keyword arguments."""
+    servers = []
+
+    def start(**kwargs):
+        server = FakeChatServer(**kwargs).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def make_client():
+    """Build a ChatClient for a URL with short waits, call it with Settings overrides."""
+    clients = []
+
+    def make(url, **overrides):
+        settings = client_settings(**dict({"api_backoff": 0.01, "api_max_backoff": 1}, **overrides))
+        client = ChatClient(settings, "test-key", url)
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        client.close()
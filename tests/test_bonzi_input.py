@@ -0,0 +1,62 @@
+import os
+import threading
+from types import SimpleNamespace
+
+# Must be set before pygame is imported
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import pytest
+
+from bonzi_input import InputBox
+from inference_worker import InferenceWorker
+
+
+@pytest.fixture
+def worker():
+    """An inference worker whose responses keep generating until the test releases them."""
+    started = threading.Event()
+    release = threading.Event()
+
+    def respond(text, cancel_event):
+        started.set()
+        release.wait(5)
+        return text
+
+    worker = InferenceWorker(respond, "cancel")
+    worker.started = started
+    yield worker
+    release.set()
+    worker.stop()
+
+
+def make_box(worker, speech):
+    pygame.font.init()
+    bonzi = SimpleNamespace(settings=SimpleNamespace(inference_busy_policy="cancel"),
+                            window=pygame.Surface((400, 400)), chatbot=SimpleNamespace(speech=speech),
+                            inference=worker, current_animation=None)
+    box = InputBox(bonzi, 0, 0, 300, 40)
+    box.set_loading(None)
+    box.active = True
+    return box
+
+
+def press_enter(box, text):
+    box.text = text
+    box.handle_event(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_RETURN, unicode="\r"))
+
+
+def test_cancel_policy_cancels_the_old_response_before_its_speech(worker):
+    # Whether each submitted request was cancelled at the moment the speech queue was emptied
+    cancelled = []
+    speech = SimpleNamespace(cancel=lambda: cancelled.append([event.is_set() for event in worker.pending]))
+    box = make_box(worker, speech)
+
+    press_enter(box, "tell me a story")
+    assert worker.started.wait(5)
+
+    # The old response must already be cancelled when its speech is thrown away, or it can queue more
+    press_enter(box, "never mind")
+    assert cancelled[-1] == [True, False]
+    assert box.text == ""
@@ -0,0 +1,175 @@
+import email.utils
+import socket
+import time
+
+import pytest
+import requests
+
+
+DATA = {"model": "fake", "messages": [{"role": "user", "content": "Hello Bonzi!"}]}
+
+
+def reply(response):
+    return response.json()["choices"][0]["message"]["content"]
+
+
+@pytest.mark.parametrize("status", [429, 500, 502, 503, 504])
+def test_retries_until_success(chat_server, make_client, status):
+    server = chat_server(fail_first=2, fail_status=status)
+    client = make_client(server.url)
+
+    assert reply(client.post(DATA)) == server.reply
+    assert client.stats() == {"requests": 3, "retries": 2}
+    assert server.counts["failures"] == 2
+
+
+def test_gives_up_after_max_retries(chat_server, make_client):
+    server = chat_server(fail_rate=1.0, fail_status=503)
+    client = make_client(server.url, api_max_retries=2)
+
+    with pytest.raises(requests.HTTPError) as error:
+        client.post(DATA)
+    assert error.value.response.status_code == 503
+    assert server.counts["requests"] == 3
+
+
+def test_client_errors_are_not_retried(chat_server, make_client):
+    server = chat_server(fail_first=1, fail_status=400)
+    client = make_client(server.url)
+
+    with pytest.raises(requests.HTTPError):
+        client.post(DATA)
+    assert client.retries == 0
+
+
+def test_retry_after_seconds_is_waited(chat_server, make_client):
+    server = chat_server(fail_first=1, retry_after=0.3)
+    client = make_client(server.url)
+
+    start = time.perf_counter()
+    client.post(DATA)
+    assert time.perf_counter() - start >= 0.3
+    assert client.retries == 1
+
+
+def test_retry_after_http_date_is_waited(chat_server, make_client):
+    # HTTP dates only have whole seconds, so two seconds from now is at least one second away
+    when = email.utils.formatdate(time.time() + 2, usegmt=True)
+    server = chat_server(fail_first=1, retry_after=when)
+    client = make_client(server.url, api_max_backoff=5)
+
+    start = time.perf_counter()
+    client.post(DATA)
+    assert time.perf_counter() - start >= 1
+    assert client.retries == 1
+
+
+@pytest.mark.parametrize("value, expected", [("2", 2.0), ("0.5", 0.5), ("-3", 0.0), ("soon", None), ("", None)])
+def test_retry_after_parsing(make_client, value, expected):
+    client = make_client("http://127.0.0.1:1/")
+    response = requests.Response()
+    response.headers["Retry-After"] = value
+    assert client.retry_after(response) == expected
+
+
+def test_retry_after_http_date_parsing(make_client):
+    client = make_client("http://127.0.0.1:1/")
+    response = requests.Response()
+    response.headers["Retry-After"] = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 28 <= client.retry_after(response) <= 30
+
+    response.headers["Retry-After"] = email.utils.formatdate(time.time() - 30, usegmt=True)
+    assert client.retry_after(response) == 0.0
+
+
+def test_gives_up_when_retry_after_is_over_max_backoff(chat_server, make_client):
+    server = chat_server(fail_first=1, fail_status=429, retry_after=60)
+    client = make_client(server.url, api_max_backoff=1)
+
+    start = time.perf_counter()
+    with pytest.raises(requests.HTTPError) as error:
+        client.post(DATA)
+    assert error.value.response.status_code == 429
+    assert time.perf_counter() - start < 1
+    assert server.counts["requests"] == 1
+
+
+def test_backoff_stays_under_max_backoff(make_client):
+    client = make_client("http://127.0.0.1:1/", api_backoff=0.5, api_max_backoff=2)
+    for attempt in range(10):
+        assert 0 <= client.backoff(attempt) <= min(2, 0.5 * 2 ** attempt)
+
+
+def test_connection_is_reused(chat_server, make_client):
+    server = chat_server()
+    client = make_client(server.url)
+
+    for _ in range(5):
+        assert reply(client.post(DATA)) == server.reply
+    assert server.counts == {"connections": 1, "requests": 5, "failures": 0}
+
+
+def test_connection_is_reused_across_retries(chat_server, make_client):
+    server = chat_server(fail_first=2)
+    client = make_client(server.url)
+
+    client.post(DATA)
+    client.post(DATA)
+    assert server.counts == {"connections": 1, "requests": 4, "failures": 2}
+
+
+def test_read_timeout_is_not_retried(chat_server, make_client):
+    server = chat_server(latency=1.0)
+    client = make_client(server.url, api_read_timeout=0.2)
+
+    start = time.perf_counter()
+    with pytest.raises(requests.ReadTimeout):
+        client.post(DATA)
+    assert time.perf_counter() - start < 1
+    assert client.stats() == {"requests": 1, "retries": 0}
+
+
+@pytest.fixture
+def unanswered_port():
+    """A listening port whose backlog is already full, so new connections are never accepted."""
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(0)
+    port = listener.getsockname()[1]
+
+    waiting = []
+    for _ in range(3):
+        blocked = socket.socket()
+        blocked.setblocking(False)
+        try:
+            blocked.connect(("127.0.0.1", port))
+        except BlockingIOError:
+            pass
+        waiting.append(blocked)
+
+    yield port
+    for blocked in waiting:
+        blocked.close()
+    listener.close()
+
+
+def test_connect_timeout_is_retried(unanswered_port, make_client):
+    client = make_client(f"http://127.0.0.1:{unanswered_port}/v1/chat/completions", api_connect_timeout=0.2,
+                         api_max_retries=2)
+
+    start = time.perf_counter()
+    with pytest.raises(requests.ConnectTimeout):
+        client.post(DATA)
+    assert time.perf_counter() - start >= 0.6
+    assert client.stats() == {"requests": 3, "retries": 2}
+
+
+def test_refused_connection_is_retried(make_client):
+    with socket.socket() as unused:
+        unused.bind(("127.0.0.1", 0))
+        port = unused.getsockname()[1]
+    client = make_client(f"http://127.0.0.1:{port}/v1/chat/completions", api_max_retries=1)
+
+    with pytest.raises(requests.ConnectionError):
+        client.post(DATA)
+    assert client.stats() == {"requests": 2, "retries": 1}
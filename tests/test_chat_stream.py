@@ -0,0 +1,122 @@
+import time
+
+from chat_client import AnimationCommandParser, iter_sse, stream_reply
+
+
+DATA = {"model": "fake", "messages": [{"role": "user", "content": "Hello Bonzi!"}]}
+
+ANIMATIONS = ["idle", "arrive", "goodbye", "backflip", "glasses", "wave", "talking", "nothing"]
+
+
+class RecordingSpeech:
+    """Stands in for SpeechService, keeping what would have been spoken."""
+    def __init__(self):
+        self.sentences = []
+        self.ended = []
+
+    def put(self, sentence):
+        self.sentences.append(sentence)
+
+    def end(self, on_done):
+        self.ended.append(on_done)
+
+
+def stream(chat_server, make_client, reply, chunk_chars):
+    """Stream reply from the fake API through stream_reply(), returns (shown pieces, animations, speech)."""
+    server = chat_server(reply=reply, chunk_chars=chunk_chars)
+    client = make_client(server.url)
+    animations = []
+    parser = AnimationCommandParser(ANIMATIONS, animations.append)
+    speech = RecordingSpeech()
+    shown = list(stream_reply(client.stream(DATA), parser, speech, on_done=None))
+    return shown, animations, speech
+
+
+def test_pieces_arrive_as_they_are_sent(chat_server, make_client):
+    server = chat_server(chunk_chars=4, chunk_delay=0.1)
+    client = make_client(server.url)
+    expected = [server.reply[i:i + 4] for i in range(0, len(server.reply), 4)]
+
+    start = time.perf_counter()
+    pieces = []
+    arrivals = []
+    for piece in client.stream(DATA):
+        pieces.append(piece)
+        arrivals.append(time.perf_counter() - start)
+
+    assert pieces == expected
+    # The first piece shows long before the server has finished sending the rest
+    assert arrivals[0] < arrivals[-1] - 0.1 * (len(expected) - 2)
+
+
+def test_done_ends_the_stream_and_the_connection_is_reused(chat_server, make_client):
+    server = chat_server()
+    client = make_client(server.url)
+
+    for _ in range(3):
+        assert "".join(client.stream(DATA)) == server.reply
+    assert server.counts == {"connections": 1, "requests": 3, "failures": 0}
+
+
+def test_iter_sse():
+    lines = [": keep-alive", "", "data: one", "", "event: message", "data:two", "data: lines", "", "data: [DONE]"]
+    assert list(iter_sse(lines)) == ["one", "two\nlines", "[DONE]"]
+
+
+def test_reply_is_shown_and_spoken(chat_server, make_client):
+    shown, animations, speech = stream(chat_server, make_client, "  Hello! I am Bonzi. Nice to meet you", 3)
+
+    assert "".join(shown) == "Hello! I am Bonzi. Nice to meet you"
+    assert animations == []
+    assert speech.sentences == ["Hello!", "I am Bonzi.", "Nice to meet you"]
+    assert speech.ended == [None]
+
+
+def test_command_split_across_chunks(chat_server, make_client):
+    shown, animations, speech = stream(chat_server, make_client, "/animation:backflip", 2)
+
+    assert "".join(shown) == ""
+    assert animations == ["backflip"]
+    assert speech.sentences == []
+    assert speech.ended == [None]
+
+
+def test_text_before_a_command_is_shown_and_the_rest_dropped(chat_server, make_client):
+    shown, animations, speech = stream(chat_server, make_client, "Watch this! /animation:wave Ta-da!", 3)
+
+    assert "".join(shown) == "Watch this! "
+    assert animations == ["wave"]
+    assert speech.sentences == ["Watch this!"]
+
+
+def test_slash_that_is_not_a_command_is_shown(chat_server, make_client):
+    shown, animations, _ = stream(chat_server, make_client, "Use /anim or /animation: to animate", 4)
+
+    assert "".join(shown) == "Use /anim or /animation: to animate"
+    assert animations == []
+
+
+def test_command_cut_off_by_the_end_of_the_stream(chat_server, make_client):
+    shown, animations, _ = stream(chat_server, make_client, "Look! /animation:glass", 5)
+
+    assert "".join(shown) == "Look! "
+    assert animations == ["glass"]
+
+
+def test_prefix_cut_off_by_the_end_of_the_stream_is_shown(chat_server, make_client):
+    shown, animations, _ = stream(chat_server, make_client, "Almost /anima", 5)
+
+    assert "".join(shown) == "Almost /anima"
+    assert animations == []
+
+
+def test_parser_holds_back_only_a_possible_prefix():
+    animations = []
+    parser = AnimationCommandParser(ANIMATIONS, animations.append)
+
+    assert parser.feed("Hi /an") == "Hi "
+    assert parser.feed("imation:gla") == ""
+    assert parser.feed("sses") == ""
+    assert animations == ["glasses"]
+    assert parser.feed(" more text") == ""
+    assert parser.flush() == ""
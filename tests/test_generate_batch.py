@@ -0,0 +1,62 @@
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from bonzi_gpt import BonziGPT, TorchBackend
+
+
+EOS = 256
+TEXTS = ["Hi", "What is your name, Bonzi?", "Tell me a joke about a purple gorilla please", "Hello there"]
+
+
+class ByteTokenizer:
+    """One token per UTF-8 byte plus an end token, enough for generate_batch() without downloading GPT-2's."""
+    pad_token_id = EOS
+    eos_token_id = EOS
+
+    def encode(self, text):
+        return list(text.encode("utf-8"))
+
+    def decode(self, tokens, skip_special_tokens=False):
+        return bytes(int(token) for token in tokens if token != EOS).decode("utf-8", errors="replace")
+
+
+class GreedyBackend(TorchBackend):
+    """Picks the likeliest token every step, so replies can be compared exactly."""
+    def generate(self, **kwargs):
+        return super().generate(**dict(kwargs, do_sample=False, temperature=None, top_p=None))
+
+
+def make_chatbot():
+    torch.manual_seed(0)
+    # Untied embeddings, a random GPT-2 with tied ones greedily repeats the last token, which says little
+    config = GPT2Config(vocab_size=EOS + 1, n_positions=128, n_embd=32, n_layer=2, n_head=4,
+                        bos_token_id=EOS, eos_token_id=EOS, tie_word_embeddings=False)
+    model = GPT2LMHeadModel(config).eval()
+
+    # Only what generate_batch() reads, the real constructor loads a trained model and a voice
+    chatbot = BonziGPT.__new__(BonziGPT)
+    chatbot.tokenizer = ByteTokenizer()
+    chatbot.backend = GreedyBackend(model)
+    chatbot.persona = None
+    chatbot.max_length = 60
+    chatbot.top_p = 0.9
+    return chatbot, model
+
+
+def test_batched_replies_match_replies_on_their_own():
+    chatbot, _ = make_chatbot()
+
+    alone = [chatbot.generate_batch([text], 0.7)[0] for text in TEXTS]
+    assert chatbot.generate_batch(TEXTS, 0.7) == alone
+
+
+def test_reply_length_matches_a_single_generate():
+    chatbot, model = make_chatbot()
+
+    # get_response() without a persona generates up to max_length tokens including the input text
+    for text, reply in zip(TEXTS, chatbot.generate_batch(TEXTS, 0.7)):
+        inputs = torch.tensor([chatbot.tokenizer.encode(text)])
+        with torch.inference_mode():
+            output = model.generate(inputs, attention_mask=torch.ones_like(inputs), max_length=chatbot.max_length,
+                                    do_sample=False, pad_token_id=EOS)
+        assert reply == chatbot.tokenizer.decode(output[0])
@@ -0,0 +1,73 @@
+import pytest
+import torch
+
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from onnx_backend import ONNX_FILE, OnnxBackend, export_onnx
+
+
+NEW_TOKENS = 12
+PROMPT = [5, 17, 42, 8, 99]
+PERSONA = [3, 14, 15, 92, 65, 35, 89, 79]
+
+
+@pytest.fixture(scope="module")
+def exported(tmp_path_factory):
+    """Save a tiny random GPT-2 and export it, returns (PyTorch model, ONNX backend)."""
+    torch.manual_seed(0)
+    # Untied embeddings, a random GPT-2 with tied ones greedily repeats the last token, which says little
+    config = GPT2Config(vocab_size=128, n_positions=64, n_embd=32, n_layer=2, n_head=4,
+                        bos_token_id=127, eos_token_id=127, tie_word_embeddings=False)
+    model_dir = tmp_path_factory.mktemp("model")
+    output_dir = tmp_path_factory.mktemp("onnx")
+    GPT2LMHeadModel(config).save_pretrained(model_dir)
+
+    export_onnx(str(model_dir), str(output_dir), int8=False)
+    model = GPT2LMHeadModel.from_pretrained(model_dir).eval()
+    return model, OnnxBackend(str(output_dir / ONNX_FILE), GPT2Config.from_pretrained(output_dir))
+
+
+def torch_generate(model, inputs, **kwargs):
+    with torch.inference_mode():
+        return model.generate(inputs, attention_mask=torch.ones_like(inputs), max_new_tokens=NEW_TOKENS,
+                              do_sample=False, pad_token_id=model.config.eos_token_id, **kwargs)
+
+
+def test_greedy_reply_matches_pytorch(exported):
+    model, backend = exported
+    inputs = torch.tensor([PROMPT])
+
+    expected = torch_generate(model, inputs)
+    result = backend.generate(inputs, max_new_tokens=NEW_TOKENS)
+    assert torch.equal(expected, result)
+
+
+def test_greedy_reply_after_a_persona_cache_matches_pytorch(exported):
+    model, backend = exported
+    inputs = torch.tensor([PERSONA + PROMPT])
+
+    # Like PersonaPrefix, the persona's cache is built once and generate() only runs the text after it
+    with torch.inference_mode():
+        torch_cache = model(torch.tensor([PERSONA]), use_cache=True).past_key_values
+    expected = torch_generate(model, inputs, past_key_values=torch_cache)
+    result = backend.generate(inputs, max_new_tokens=NEW_TOKENS, past_key_values=backend.prefill(PERSONA))
+    assert torch.equal(expected, result)
+
+
+def test_greedy_conversation_turns_match_pytorch(exported):
+    model, backend = exported
+
+    # Like ConversationSession, the cache returned by one turn starts the next one
+    expected = torch_generate(model, torch.tensor([PROMPT]), return_dict_in_generate=True)
+    result = backend.generate(torch.tensor([PROMPT]), max_new_tokens=NEW_TOKENS, return_dict_in_generate=True)
+    assert torch.equal(expected.sequences, result.sequences)
+
+    next_turn = [7, 70, 77]
+    expected = torch_generate(model, torch.cat([expected.sequences, torch.tensor([next_turn])], dim=1),
+                              past_key_values=expected.past_key_values)
+    result = backend.generate(torch.cat([result.sequences, torch.tensor([next_turn])], dim=1),
+                              max_new_tokens=NEW_TOKENS, past_key_values=result.past_key_values)
+    assert torch.equal(expected, result)
@@ -0,0 +1,15 @@
+from functools import lru_cache
+
+import pygame
+
+
+@lru_cache(maxsize=None)
+def get_font(size):
+    """Return one shared default font for each size instead of loading a new one every time."""
+    return pygame.font.Font(None, size)
+
+
+@lru_cache(maxsize=512)
+def render_line(text, size, color):
+    """Render a line of text once, the same line with the same font and color is reused after that."""
+    return get_font(size).render(text, True, color)
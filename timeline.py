@@ -0,0 +1,112 @@
+import os
+import time
+
+
+# How long each frame of an animation shows, and the frames to repeat while Bonzi is still talking.
+# loop is the (first, last) frame file names without extension, both included, or None for animations that
+# just play through. Names rather than indexes, so the loop stays on the same frames whichever files a
+# front end lists for the animation.
+DEFAULT_FRAME_SECONDS = 0.125
+ANIMATION_TIMING = {
+    "idle": {"frame_seconds": DEFAULT_FRAME_SECONDS, "loop": None},
+    "arrive": {"frame_seconds": DEFAULT_FRAME_SECONDS, "loop": None},
+    "goodbye": {"frame_seconds": DEFAULT_FRAME_SECONDS, "loop": None},
+    "backflip": {"frame_seconds": DEFAULT_FRAME_SECONDS, "loop": None},
+    "glasses": {"frame_seconds": DEFAULT_FRAME_SECONDS, "loop": None},
+    "wave": {"frame_seconds": DEFAULT_FRAME_SECONDS, "loop": None},
+    "nothing": {"frame_seconds": DEFAULT_FRAME_SECONDS, "loop": None},
+    # 0035.png to 0040.bmp are Bonzi's mouth moving
+    "talking": {"frame_seconds": DEFAULT_FRAME_SECONDS, "loop": ("0035", "0040")},
+}
+
+# bonzi_app.py and borderless.py only list the .bmp talking frames. bonzi_app.py has always looped 0029 to 0040.
+# borderless.py used to bounce between 0040 and the frame before it (0033 in its list), it now loops like bonzi_app.py
+BMP_ANIMATION_TIMING = dict(ANIMATION_TIMING, talking={"frame_seconds": DEFAULT_FRAME_SECONDS,
+                                                       "loop": ("0029", "0040")})
+
+
+def loop_indexes(frames, loop):
+    """Return the (first, last) indexes of the loop's frame names in frames, or None if either is missing."""
+    if loop is None:
+        return None
+    names = [os.path.splitext(os.path.basename(path))[0] for path in frames]
+    try:
+        return names.index(loop[0]), names.index(loop[1])
+    except ValueError:
+        return None
+
+
+class Timeline:
+    """A class for playing an animation by elapsed time instead of by how often the window redraws.
+
+    A slow frame doesn't slow Bonzi down, the frames that should have shown in the meantime are skipped.
+    """
+    def __init__(self, timing=ANIMATION_TIMING, clock=time.perf_counter):
+        """timing maps animation names to their frame_seconds and loop, clock returns the time in seconds."""
+        self.timing = timing
+        self.clock = clock
+
+        # The animation playing, None when nothing is
+        self.name = None
+        self.frames = []
+        self.index = 0
+
+        # The (first, last) frame indexes repeated while looping, found when the animation starts
+        self.loop = None
+
+        # Time already spent on the current frame, and when update() last ran
+        self.elapsed = 0.0
+        self.last_update = None
+
+        # Frames that were never shown because a redraw came too late
+        self.skipped = 0
+
+    def play(self, name, frames):
+        """Start an animation from its first frame."""
+        self.name = name
+        self.frames = frames or []
+        self.index = 0
+        self.loop = loop_indexes(self.frames, self.timing.get(name, {}).get("loop"))
+        self.elapsed = 0.0
+        self.last_update = self.clock()
+
+    def stop(self):
+        """Stop the current animation, the next play() starts fresh even with the same name."""
+        self.name = None
+        self.frames = []
+
+    def update(self, looping=False):
+        """Move the animation on by the time since the last update and return the frame to show.
+
+        While looping is True the animation's loop range repeats instead of finishing.
+        Returns None once the animation has played through, or if nothing is playing.
+        """
+        if not self.frames:
+            return None
+
+        now = self.clock()
+        self.elapsed += now - self.last_update
+        self.last_update = now
+
+        timing = self.timing.get(self.name, {})
+        frame_seconds = timing.get("frame_seconds", DEFAULT_FRAME_SECONDS)
+        loop = self.loop if looping else None
+
+        steps = int(self.elapsed // frame_seconds)
+        self.elapsed -= steps * frame_seconds
+        if steps > 1:
+            self.skipped += steps - 1
+
+        if loop is not None:
+            first, last = loop
+            self.index += steps
+            if self.index > last:
+                # Wrap around inside the loop range however far behind the redraws are
+                self.index = first + (self.index - first) % (last - first + 1)
+        else:
+            self.index += steps
+
+        if self.index >= len(self.frames):
+            self.stop()
+            return None
+        return self.frames[self.index]
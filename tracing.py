@@ -0,0 +1,186 @@
+"""Times Bonzi's hot paths so a slow turn can be broken down into its stages.
+
+Set trace_enabled = True in settings.py and each stage (tokenizing, model.generate, decoding, the API
+round trip, text-to-speech, drawing a frame, ...) is timed into a ring buffer. Every
+trace_summary_seconds the p50/p95/p99 of each stage is printed, and if trace_file is set the buffer is
+saved as Chrome trace-event JSON on exit, open it in chrome://tracing or https://ui.perfetto.dev.
+While tracing is off, each traced call only costs a check of TRACER.enabled.
+"""
+import atexit
+import collections
+import functools
+import json
+import os
+import threading
+import time
+
+
+def percentile(values, pct):
+    """Return the pct percentile of a list of numbers, nearest rank."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Span:
+    """Times a with block and records it in the tracer when the block ends."""
+    __slots__ = ("tracer", "name", "start")
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.record(self.name, self.start)
+        return False
+
+
+class NullSpan:
+    """Stand-in for Span while tracing is off, it does nothing."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer:
+    """A class for recording how long named stages take, keeping only the most recent ones."""
+    def __init__(self, capacity=10000, enabled=False):
+        """capacity is how many spans the ring buffer holds, the oldest are dropped once it is full."""
+        self.enabled = enabled
+
+        # Spans as (name, start ns, duration ns, thread id), times are from time.perf_counter_ns()
+        self.events = collections.deque(maxlen=capacity)
+        self.lock = threading.Lock()  # reading the buffer while another thread adds to it isn't safe
+        self.thread_names = {}
+
+        # The printed summary, None turns it off
+        self.summary_seconds = None
+        self.last_summary = time.perf_counter()
+
+    def span(self, name):
+        """Return a context manager that times its with block as the stage name."""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def record(self, name, start, end=None):
+        """Record a stage that started at start and ended at end, both from time.perf_counter_ns()."""
+        if not self.enabled:
+            return
+        if end is None:
+            end = time.perf_counter_ns()
+        thread = threading.get_ident()
+        with self.lock:
+            self.events.append((name, start, end - start, thread))
+        if thread not in self.thread_names:
+            self.thread_names[thread] = threading.current_thread().name
+
+    def resize(self, capacity):
+        """Change how many spans the ring buffer holds, keeping the newest."""
+        with self.lock:
+            self.events = collections.deque(self.events, maxlen=capacity)
+
+    def clear(self):
+        with self.lock:
+            self.events.clear()
+
+    def snapshot(self):
+        """Return a list of the spans in the buffer, oldest first."""
+        with self.lock:
+            return list(self.events)
+
+    def summary(self):
+        """Return {stage: {"count", "p50_ms", "p95_ms", "p99_ms", "total_ms"}} for the spans in the buffer."""
+        durations = collections.defaultdict(list)
+        for name, _, duration, _ in self.snapshot():
+            durations[name].append(duration / 1e6)
+        return {name: {"count": len(values),
+                       "p50_ms": round(percentile(values, 50), 3),
+                       "p95_ms": round(percentile(values, 95), 3),
+                       "p99_ms": round(percentile(values, 99), 3),
+                       "total_ms": round(sum(values), 3)}
+                for name, values in sorted(durations.items())}
+
+    def report(self):
+        """Print the summary as a table, slowest total first."""
+        rows = sorted(self.summary().items(), key=lambda row: -row[1]["total_ms"])
+        print(f"{'stage':<24} {'count':>7} {'p50_ms':>10} {'p95_ms':>10} {'p99_ms':>10} {'total_ms':>11}")
+        for name, row in rows:
+            print(f"{name:<24} {row['count']:>7} {row['p50_ms']:>10.3f} {row['p95_ms']:>10.3f} "
+                  f"{row['p99_ms']:>10.3f} {row['total_ms']:>11.1f}")
+
+    def report_if_due(self):
+        """Print the summary if summary_seconds have passed since the last one, called once per frame."""
+        if not self.enabled or not self.summary_seconds:
+            return
+        now = time.perf_counter()
+        if now - self.last_summary >= self.summary_seconds:
+            self.last_summary = now
+            self.report()
+
+    def chrome_trace(self):
+        """Return the spans in the buffer as a Chrome trace-event dictionary."""
+        pid = os.getpid()
+        events = [{"name": name, "cat": name.split(".")[0], "ph": "X", "pid": pid, "tid": thread,
+                   "ts": start / 1000, "dur": duration / 1000}  # microseconds
+                  for name, start, duration, thread in self.snapshot()]
+
+        # Name each thread's row after the Python thread
+        with self.lock:
+            thread_names = dict(self.thread_names)
+        for thread, thread_name in thread_names.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": thread,
+                           "args": {"name": thread_name}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, path):
+        """Write the spans in the buffer to path as Chrome trace-event JSON."""
+        try:
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(self.chrome_trace(), file)
+            print(f"Saved the trace to {path}")
+        except OSError as e:
+            print("Error saving trace:", e)
+
+
+# One tracer for the whole program, so every module records into the same buffer
+TRACER = Tracer()
+
+
+def traced(name):
+    """Decorator that times every call of a function as the stage name while tracing is on."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                TRACER.record(name, start)
+        return wrapper
+    return decorate
+
+
+def configure_tracing(settings):
+    """Turn tracing on or off from Settings, the trace file is written when the program exits."""
+    TRACER.resize(settings.trace_buffer_size)
+    TRACER.summary_seconds = settings.trace_summary_seconds
+    TRACER.enabled = settings.trace_enabled
+    if settings.trace_enabled and settings.trace_file:
+        atexit.register(TRACER.save, settings.trace_file)
@@ -0,0 +1,106 @@
+import hashlib
+import os
+
+from datasets import Dataset, load_dataset, load_from_disk
+
+
+# Lines each tokenizer process should get, below this starting more processes costs more than it saves
+LINES_PER_WORKER = 5000
+
+
+def file_hash(path, *extra):
+    """Return a hash of a file's contents and anything else the cached result depends on."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    for value in extra:
+        digest.update(repr(value).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def tokenize_file(text_file, tokenizer, cache_dir="training_cache", workers=None):
+    """Return a dataset of the text file's non-empty lines as token ids.
+
+    The result is saved in cache_dir under a hash of the file, so the same text is only tokenized once.
+    workers is the number of tokenizer processes, None picks it from the number of lines.
+    """
+    path = None
+    if cache_dir:
+        path = os.path.join(cache_dir, file_hash(text_file, tokenizer.name_or_path, len(tokenizer)))
+        if os.path.exists(path):
+            return load_from_disk(path)
+
+    dataset = load_dataset("text", data_files=text_file)["train"]
+    dataset = dataset.filter(lambda example: example["text"].strip() != "")
+    if workers is None:
+        workers = max(1, min(os.cpu_count() or 1, len(dataset) // LINES_PER_WORKER))
+
+    dataset = dataset.map(lambda examples: {"input_ids": tokenizer(examples["text"])["input_ids"]},
+                          batched=True,
+                          remove_columns=["text"],
+                          num_proc=workers if workers > 1 else None)
+
+    if path:
+        dataset.save_to_disk(path)
+    return dataset
+
+
+def pack_blocks(token_lists, block_size, eos_token_id):
+    """Join tokenized lines into one stream with EOS between them and cut it into blocks of block_size tokens.
+
+    Every block is full except the last, whose padding is left out of the attention and the loss.
+    """
+    stream = []
+    for ids in token_lists:
+        stream.extend(ids)
+        stream.append(eos_token_id)
+
+    blocks = {"input_ids": [], "attention_mask": [], "labels": []}
+    for start in range(0, len(stream), block_size):
+        block = stream[start:start + block_size]
+        padding = block_size - len(block)
+        blocks["input_ids"].append(block + [eos_token_id] * padding)
+        blocks["attention_mask"].append([1] * len(block) + [0] * padding)
+        blocks["labels"].append(block + [-100] * padding)  # -100 is ignored by the loss
+    return Dataset.from_dict(blocks)
+
+
+def load_training_blocks(text_file, tokenizer, block_size=128, cache_dir="training_cache", workers=None):
+    """Return the text file as packed training blocks, ready for Trainer with default_data_collator."""
+    lines = tokenize_file(text_file, tokenizer, cache_dir, workers)
+    return pack_blocks(lines["input_ids"], block_size, tokenizer.eos_token_id)
+
+
+def train_model(model, tokenizer, text_file, output_dir, settings, epochs=None):
+    """Fine-tune a GPT-2 model on a text file with the train_* Settings and save it to output_dir."""
+    from transformers import Trainer, TrainingArguments, default_data_collator
+
+    # Tokenized once and cached, then packed into full-length blocks so no step is spent on padding
+    train_dataset = load_training_blocks(text_file, tokenizer, settings.train_block_size,
+                                         settings.training_cache_dir, settings.train_workers)
+
+    # Training arguments
+    training_args = TrainingArguments(
+        output_dir=output_dir,  # output directory
+        num_train_epochs=epochs or settings.train_epochs,  # number of times the model will see the dataset
+        per_device_train_batch_size=settings.train_batch_size,  # blocks per forward/backward pass
+        gradient_accumulation_steps=settings.train_gradient_accumulation,  # passes per optimizer step
+        save_steps=10_000,  # number of steps before saving
+        save_total_limit=2,  # limit the number of checkpoints, or saved models
+        learning_rate=settings.train_learning_rate,  # 5e-5 is the standard rate for fine-tuning GPT-2
+    )
+
+    # Create the trainer using the model, training arguments, data collator, and dataset, it shuffles the blocks each epoch
+    trainer = Trainer(
+        model=model,
+        args=training_args,
+        data_collator=default_data_collator,  # blocks are all the same length and already have labels
+        train_dataset=train_dataset,
+    )
+
+    # Call the training method
+    trainer.train()
+
+    # Save the model
+    trainer.save_model(output_dir)